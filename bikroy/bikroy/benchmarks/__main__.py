@@ -0,0 +1,272 @@
+"""
+Бенчмарки разбора страниц без сети. Запуск из папки с scrapy.cfg:
+
+    python -m bikroy.benchmarks
+    python -m bikroy.benchmarks --update-baseline
+
+Для каждого шага разбора печатаются пропускная способность (страниц или
+объявлений в секунду), пик памяти за один вызов, а также память и число
+блоков памяти (аллокаций), которые держат результат вызова и оставшиеся
+после него объекты (по tracemalloc). Результаты сравниваются с baseline.json:
+при росте пика памяти или числа аллокаций больше --tolerance, а также без
+baseline команда завершается с кодом 1. Пропускная способность зависит от машины
+и её загрузки, поэтому изменение относительно baseline только печатается.
+"""
+import argparse
+import io
+import json
+import logging
+import pickle
+import resource
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+from scrapy import Request
+from scrapy.crawler import Crawler
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+
+from .. import settings as project_settings
+from ..exporters import NdjsonItemExporter
+from ..items import CompactProductItem, ProductItem
+from ..spiders.bikroy_spider import BikroyComParser, BikroySpiderSpider
+from ..spiders.constants.bikroy_com import PRODUCT_DATA_PATH, SERP_DATA_PATH
+from .corpus import CORPUS_PATH, load_corpus, record_page
+
+logger = logging.getLogger(__name__)
+
+BASELINE_PATH = Path(__file__).parent / 'baseline.json'
+# у маленьких шагов доля от baseline меньше шума интерпретатора: допуск не меньше этого
+MIN_PEAK_SLACK = 16 * 1024
+MIN_BLOCKS_SLACK = 32
+# настройки, при которых паук ничего не пишет рядом с проектом и не открывает портов
+BENCHMARK_SETTINGS = {
+    'METRICS_ENABLED': False,
+    'TELNETCONSOLE_ENABLED': False,
+    'PARSE_OFFLOAD_WORKERS': 0,
+    'CATEGORY_TREE_TTL': 0,
+}
+
+
+class Benchmark:
+
+    def __init__(self, name: str, func: Callable, units: int, unit: str):
+        self.name = name
+        self.func = func
+        self.units = units  # сколько страниц или объявлений обрабатывает один вызов
+        self.unit = unit
+
+
+class BenchmarkResult:
+
+    def __init__(self, name: str, unit: str, throughput: float, peak_bytes: int, retained_bytes: int,
+                 retained_blocks: int):
+        self.name = name
+        self.unit = unit
+        self.throughput = throughput
+        self.peak_bytes = peak_bytes
+        self.retained_bytes = retained_bytes
+        self.retained_blocks = retained_blocks
+
+    def to_dict(self) -> dict:
+        return {'unit': self.unit, 'throughput': self.throughput, 'peak_bytes': self.peak_bytes,
+                'retained_bytes': self.retained_bytes, 'retained_blocks': self.retained_blocks}
+
+
+def get_spider(state_path: Path) -> BikroySpiderSpider:
+    settings = Settings()
+    settings.setmodule(project_settings, priority='project')
+    settings.update({**BENCHMARK_SETTINGS, 'CRAWL_STATE_PATH': str(state_path)}, priority='cmdline')
+    crawler = Crawler(BikroySpiderSpider, settings)
+    return BikroySpiderSpider.from_crawler(crawler)
+
+
+def get_listing_response(page) -> HtmlResponse:
+    category_url = page.url.split('?', 1)[0]
+    request = Request(page.url, meta={'category_url': category_url})
+    return HtmlResponse(page.url, body=page.body, encoding='utf-8', request=request)
+
+
+def get_product_response(page) -> HtmlResponse:
+    request = Request(page.url, meta={'category_url': None, 'updated_timestamp': 0})
+    return HtmlResponse(page.url, body=page.body, encoding='utf-8', request=request)
+
+
+def export_items(items: list) -> bytes:
+    output = io.BytesIO()
+    exporter = NdjsonItemExporter(output)
+    for item in items:
+        exporter.export_item(item)
+    exporter.finish_exporting()
+    return output.getvalue()
+
+
+def get_item_benchmarks(product_fields: list) -> list:
+    """
+    Память продуктов видна по retained KiB у items/*, стоимость выгрузки - по export/*.
+    Поля каждый раз распаковываются заново, как результаты из пула процессов,
+    чтобы продукты не делили строки между собой.
+    """
+    pickled_fields = [pickle.dumps(fields) for fields in product_fields]
+    benchmarks = []
+    for item_class in (ProductItem, CompactProductItem):
+        items = [item_class(fields) for fields in product_fields]
+        benchmarks += [
+            Benchmark(f'items/{item_class.__name__}',
+                      lambda item_class=item_class: [item_class(pickle.loads(fields)) for fields in pickled_fields],
+                      len(product_fields), 'items'),
+            Benchmark(f'export/{item_class.__name__}', lambda items=items: export_items(items), len(items), 'items'),
+        ]
+    return benchmarks
+
+
+def get_benchmarks(corpus: dict, spider: BikroySpiderSpider) -> list:
+    parser = BikroyComParser()
+    listing_bodies = [page.body for page in corpus['listing']]
+    product_bodies = [page.body for page in corpus['product']]
+    listing_ads = [ad for body in listing_bodies for ad in parser.get_json_data(body, SERP_DATA_PATH)['ads']]
+    product_ads = [parser.get_json_data(body, PRODUCT_DATA_PATH) for body in product_bodies]
+    listing_responses = [get_listing_response(page) for page in corpus['listing']]
+    product_responses = [get_product_response(page) for page in corpus['product']]
+
+    def parse_listings():
+        # каждый раз как первый обход категории: с планированием следующих страниц
+        spider.category_progress.clear()
+        for response in listing_responses:
+            list(spider.parse(response))
+
+    def parse_products():
+        for response in product_responses:
+            list(spider.parse_product(response))
+
+    return [
+        Benchmark('get_json_data/listing', lambda: [parser.get_json_data(body, SERP_DATA_PATH)
+                                                    for body in listing_bodies], len(listing_bodies), 'pages'),
+        Benchmark('get_json_data/product', lambda: [parser.get_json_data(body, PRODUCT_DATA_PATH)
+                                                    for body in product_bodies], len(product_bodies), 'pages'),
+        Benchmark('get_product_updated_dates', lambda: parser.get_product_updated_dates(listing_ads),
+                  len(listing_ads), 'ads'),
+        Benchmark('get_price', lambda: [parser.get_price(ad) for ad in product_ads], len(product_ads), 'ads'),
+        Benchmark('get_metadata', lambda: [parser.get_metadata(ad) for ad in product_ads], len(product_ads), 'ads'),
+        Benchmark('get_listing_data', lambda: [parser.get_listing_data(body) for body in listing_bodies],
+                  len(listing_bodies), 'pages'),
+        Benchmark('get_product_fields', lambda: [parser.get_product_fields(page.body, page.url)
+                                                 for page in corpus['product']], len(product_bodies), 'pages'),
+        Benchmark('parse', parse_listings, len(listing_responses), 'pages'),
+        Benchmark('parse_product', parse_products, len(product_responses), 'pages'),
+        *get_item_benchmarks([parser.get_product_fields(page.body, page.url) for page in corpus['product']]),
+    ]
+
+
+def run_benchmark(benchmark: Benchmark, repeat: int, min_time: float) -> BenchmarkResult:
+    timer = timeit.Timer(benchmark.func)
+    benchmark.func()  # прогрев: кеши дат, состояние краулинга
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    try:
+        memory_before = tracemalloc.get_traced_memory()[0]
+        result = benchmark.func()
+        memory_after, memory_peak = tracemalloc.get_traced_memory()
+        # трассировка началась перед вызовом: в снимке только живые блоки, выделенные им
+        blocks = sum(statistic.count for statistic in tracemalloc.take_snapshot().statistics('filename'))
+        del result
+    finally:
+        tracemalloc.stop()
+    return BenchmarkResult(benchmark.name, benchmark.unit, benchmark.units / best,
+                           memory_peak - memory_before, memory_after - memory_before, blocks)
+
+
+def get_regressions(results: list, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None:
+            regressions.append(f'{result.name}: not in the baseline, run with --update-baseline')
+            continue
+        if result.peak_bytes > expected['peak_bytes'] + max(expected['peak_bytes'] * tolerance, MIN_PEAK_SLACK):
+            regressions.append(f"{result.name}: peak {result.peak_bytes / 1024:,.0f} KiB, "
+                               f"baseline {expected['peak_bytes'] / 1024:,.0f} KiB")
+        blocks_slack = max(expected.get('retained_blocks', 0) * tolerance, MIN_BLOCKS_SLACK)
+        if 'retained_blocks' in expected and result.retained_blocks > expected['retained_blocks'] + blocks_slack:
+            regressions.append(f"{result.name}: {result.retained_blocks:,} allocations, "
+                               f"baseline {expected['retained_blocks']:,}")
+    return regressions
+
+
+def print_results(results: list, baseline: dict):
+    print(f"{'benchmark':<28}{'throughput':>18}{'vs baseline':>13}{'peak KiB':>11}{'retained KiB':>14}"
+          f"{'allocations':>13}")
+    for result in results:
+        expected = baseline.get(result.name)
+        change = f"{result.throughput / expected['throughput'] - 1:+.1%}" if expected else '-'
+        print(f"{result.name:<28}{result.throughput:>12,.0f} {result.unit + '/s':<7}{change:>11}"
+              f"{result.peak_bytes / 1024:>11,.0f}{result.retained_bytes / 1024:>14,.0f}{result.retained_blocks:>13,}")
+    # ru_maxrss в килобайтах на Linux
+    print(f'process peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:,.0f} MiB')
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Offline parser benchmarks')
+    parser.add_argument('-k', '--filter', default='', help='запускать только бенчмарки, в имени которых есть строка')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='минимальное время одного замера, секунд')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='записать результаты как новый baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='допустимый рост пика памяти и числа аллокаций (доля)')
+    parser.add_argument('--corpus', type=Path, default=CORPUS_PATH)
+    parser.add_argument('--record', action='append', default=[], metavar='URL',
+                        help='скачать страницу в корпус (нужна сеть) и выйти')
+    return parser.parse_args()
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('scrapy').setLevel(logging.WARNING)
+    args = get_arguments()
+
+    if args.record:
+        for url in args.record:
+            logger.info(f'Recorded {url} to {record_page(url, args.corpus)}')
+        return 0
+
+    baseline = dict()
+    if not args.update_baseline:
+        if not args.baseline.exists():
+            logger.error(f'No baseline at {args.baseline}, run with --update-baseline to create it')
+            return 1
+        baseline = json.loads(args.baseline.read_text())
+
+    with tempfile.TemporaryDirectory(prefix='bikroy-benchmarks-') as temp_dir:
+        spider = get_spider(Path(temp_dir) / 'crawl_state.sqlite3')
+        try:
+            benchmarks = [benchmark for benchmark in get_benchmarks(load_corpus(args.corpus), spider)
+                          if args.filter in benchmark.name]
+            results = [run_benchmark(benchmark, args.repeat, args.min_time) for benchmark in benchmarks]
+        finally:
+            spider.crawl_state.close()
+
+    print_results(results, baseline)
+    if args.update_baseline:
+        saved = json.loads(args.baseline.read_text()) if args.baseline.exists() else dict()
+        saved.update({result.name: result.to_dict() for result in results})
+        args.baseline.write_text(json.dumps(saved, indent=2, sort_keys=True))
+        logger.info(f'Baseline saved to {args.baseline}')
+        return 0
+
+    regressions = get_regressions(results, baseline, args.tolerance)
+    for regression in regressions:
+        logger.error(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
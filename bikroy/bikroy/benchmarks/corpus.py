@@ -0,0 +1,156 @@
+"""
+Корпус страниц для бенчмарков. Записанные страницы лежат в corpus/listing
+и corpus/product (html.gz), их можно пополнить командой --record. Если
+записанных страниц нет, страницы собираются из объявлений example.json
+в том же виде, что отдаёт сайт: HTML с большим window.initialData,
+где нужные пауку данные лежат среди навигации, локаций и разметки.
+"""
+import gzip
+import json
+import random
+import urllib.request
+from pathlib import Path
+from urllib.parse import urlparse
+
+CORPUS_PATH = Path(__file__).parent / 'corpus'
+EXAMPLE_PATH = Path(__file__).parents[3] / 'example.json'
+LISTING_URL = 'https://bikroy.com/en/ads/bangladesh/mobile-phones'
+PAGE_TYPES = ('listing', 'product')
+
+ADS_PER_PAGE = 25
+LISTING_PAGES = 8
+PRODUCT_PAGES = 40
+TOTAL_ADS = 1200
+# относительные даты, поднятые объявления (без даты) и ISO, как в выдаче сайта
+LISTING_TIMESTAMPS = ('5 mins', '42 mins', '1 hour', '3 hours', '1 day', None, '2022-09-15T10:11:35.000Z')
+RECORD_USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:104.0) Gecko/20100101 Firefox/104.0'
+
+
+class Page:
+
+    def __init__(self, page_type: str, url: str, body: bytes):
+        self.page_type = page_type
+        self.url = url
+        self.body = body
+
+
+def load_corpus(path: Path = CORPUS_PATH) -> dict:
+    """Возвращает {'listing': [Page], 'product': [Page]}."""
+    corpus = {page_type: load_recorded_pages(path / page_type, page_type) for page_type in PAGE_TYPES}
+    if not all(corpus.values()):
+        synthetic = build_synthetic_corpus()
+        corpus = {page_type: corpus[page_type] or synthetic[page_type] for page_type in PAGE_TYPES}
+    return corpus
+
+
+def load_recorded_pages(path: Path, page_type: str) -> list:
+    pages = []
+    for page_path in sorted(path.glob('*.html.gz')):
+        with gzip.open(page_path, 'rb') as page_file:
+            url = page_file.readline().decode().strip()
+            pages.append(Page(page_type, url, page_file.read()))
+    return pages
+
+
+def record_page(url: str, path: Path = CORPUS_PATH) -> Path:
+    """Скачивает страницу в корпус. Первая строка файла - ссылка, дальше тело ответа."""
+    page_type = 'product' if '/ad/' in url else 'listing'
+    request = urllib.request.Request(url, headers={'User-Agent': RECORD_USER_AGENT})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        body = response.read()
+
+    page_path = path / page_type / f"{urlparse(url).path.strip('/').replace('/', '_')}.html.gz"
+    page_path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(page_path, 'wb') as page_file:
+        page_file.write(f'{url}\n'.encode())
+        page_file.write(body)
+    return page_path
+
+
+def build_synthetic_corpus(seed: int = 0) -> dict:
+    rnd = random.Random(seed)
+    with open(EXAMPLE_PATH, encoding='utf-8') as example_file:
+        examples = json.load(example_file)
+    ads = [get_ad_data(examples[index % len(examples)], index, rnd) for index in range(TOTAL_ADS)]
+
+    listing_pages = []
+    for page in range(1, LISTING_PAGES + 1):
+        page_ads = ads[(page - 1) * ADS_PER_PAGE:page * ADS_PER_PAGE]
+        serp = {'ads': {'data': {
+            'ads': [get_listing_ad(ad, rnd) for ad in page_ads],
+            'paginationData': {'activePage': page, 'pageSize': ADS_PER_PAGE, 'total': TOTAL_ADS},
+        }}}
+        listing_pages.append(Page('listing', f'{LISTING_URL}?page={page}', render_page({'serp': serp}, rnd)))
+
+    product_pages = []
+    for ad in ads[:PRODUCT_PAGES]:
+        ad_detail = {'data': {'ad': ad}}
+        product_pages.append(Page('product', f"https://bikroy.com/en/ad/{ad['slug']}",
+                                  render_page({'adDetail': ad_detail}, rnd)))
+    return {'listing': listing_pages, 'product': product_pages}
+
+
+def get_ad_data(example: dict, index: int, rnd: random.Random) -> dict:
+    """Данные объявления в формате window.initialData страницы продукта."""
+    slug = f"{example['url'].rsplit('/', 1)[-1]}-{index}"
+    phone_numbers = []
+    if example['author_phone']:
+        phone_numbers.append({'number': example['author_phone'].replace('+88', '', 1), 'verified': True})
+    return {
+        'id': f'{int(example["item_id"], 16) + index:024x}',
+        'slug': slug,
+        'title': example['title'],
+        'description': example['description'],
+        'adDate': f'2022-09-{1 + index % 28:02d}T{index % 24:02d}:{index % 60:02d}:35.000Z',
+        'contactCard': {'name': example['author_name'], 'phoneNumbers': phone_numbers},
+        'money': {'amount': f"Tk {int(example['price'] or rnd.randint(100, 100000)):,}"},
+        'images': {'meta': [{'src': image_url.rsplit('/', 3)[0], 'alt': example['title']}
+                            for image_url in example['images'] or []]},
+        'properties': [{'label': label, 'key': label.lower().replace(' ', '_'), 'value': value}
+                       for label, value in (example['metadata'] or {}).items()],
+        'isVerified': bool(index % 2),
+        'shop': None,
+    }
+
+
+def get_listing_ad(ad: dict, rnd: random.Random) -> dict:
+    listing_ad = {
+        'id': ad['id'],
+        'slug': ad['slug'],
+        'title': ad['title'],
+        'description': ad['description'][:100],
+        'price': ad['money']['amount'],
+        'images': {'meta': ad['images']['meta'][:1]},
+        'isFeatured': rnd.random() < 0.1,
+    }
+    timestamp = rnd.choice(LISTING_TIMESTAMPS)
+    if timestamp is not None:
+        listing_ad['timeStamp'] = timestamp
+    return listing_ad
+
+
+def render_page(data: dict, rnd: random.Random) -> bytes:
+    """Нужные данные окружены навигацией и разметкой примерно тех же размеров, что и на сайте."""
+    initial_data = {
+        'locale': 'en',
+        'locations': get_tree('location', 6, rnd),
+        'categories': get_tree('category', 5, rnd),
+        **data,
+        'footer': {'links': [{'title': f'Link {index}', 'url': f'/en/page-{index}'} for index in range(200)]},
+    }
+    markup = ''.join(f'<div class="item--{index}"><a href="/en/ads/item-{index}">Item {index}</a></div>'
+                     for index in range(3000))
+    return (
+        '<!DOCTYPE html><html><head><title>Bikroy</title></head><body>'
+        f'<div id="app">{markup[:len(markup) // 3]}</div>'
+        f'<script>window.initialData = {json.dumps(initial_data, ensure_ascii=False)}</script>'
+        f'{markup}</body></html>'
+    ).encode()
+
+
+def get_tree(name: str, depth: int, rnd: random.Random) -> list:
+    if depth <= 0:
+        return []
+    return [{'id': rnd.randint(1, 10 ** 6), 'slug': f'{name}-{depth}-{index}', 'name': f'{name.title()} {index}',
+             'children': get_tree(name, depth - 2, rnd)}
+            for index in range(depth * 2)]
@@ -0,0 +1,156 @@
+import json
+from typing import Optional
+
+from scrapy.exporters import BaseItemExporter
+
+from .items import CompactProductItem, ProductItem
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+METADATA_FIELD = 'metadata'
+METADATA_COLUMN_PREFIX = 'metadata.'
+METADATA_OTHER_COLUMN = 'metadata.other'
+
+
+def dump_line(record: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(record, ensure_ascii=False).encode() + b'\n'
+
+
+def to_str(value) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def get_serialized_item(exporter: BaseItemExporter, item) -> dict:
+    if exporter.fields_to_export is None and isinstance(item, CompactProductItem):
+        return item.to_dict()  # единственный сериализатор полей (фотографии) to_dict применяет сам
+    return dict(exporter._get_serialized_fields(item))
+
+
+class NdjsonItemExporter(BaseItemExporter):
+    """
+    По объекту JSON в строке. Строки копятся в буфере и пишутся
+    в файл одной записью, когда набирается batch_bytes байт.
+    """
+
+    def __init__(self, file, batch_bytes: int = 1024 * 1024, **kwargs):
+        super().__init__(dont_fail=True, **kwargs)
+        self.file = file
+        self.batch_bytes = batch_bytes
+        self.buffer = []
+        self.buffered_bytes = 0
+
+    def export_item(self, item):
+        line = dump_line(get_serialized_item(self, item))
+        self.buffer.append(line)
+        self.buffered_bytes += len(line)
+        if self.buffered_bytes >= self.batch_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.file.write(b''.join(self.buffer))
+        self.buffer.clear()
+        self.buffered_bytes = 0
+
+    def finish_exporting(self):
+        self.flush()
+
+
+class ColumnarItemExporter(BaseItemExporter):
+    """
+    Копит продукты пачками по batch_items и пишет каждую пачку группой строк.
+    Колонки и их типы берутся из полей ProductItem (или FEED_EXPORT_FIELDS),
+    незаполненное поле пишется как null. metadata раскладывается по колонкам
+    metadata.<ключ>: набор ключей фиксируется по первой пачке, ключи,
+    появившиеся позже, попадают в metadata.other одной JSON-строкой.
+    Нужен пакет pyarrow.
+    """
+
+    def __init__(self, file, batch_items: int = 10000, compression: Optional[str] = None, **kwargs):
+        import pyarrow
+
+        super().__init__(dont_fail=True, **kwargs)
+        self.pyarrow = pyarrow
+        self.file = file
+        self.batch_items = batch_items
+        self.compression = compression
+        self.rows = []
+        self.schema = None
+        self.writer = None
+        self.string_columns = set()
+        self.metadata_keys = []
+
+    def export_item(self, item):
+        self.rows.append(get_serialized_item(self, item))
+        if len(self.rows) >= self.batch_items:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.schema is None:
+            self.schema = self.get_schema(self.rows)
+            self.writer = self.open_writer(self.schema)
+        rows = [self.flatten(row) for row in self.rows]
+        self.writer.write_table(self.pyarrow.Table.from_pylist(rows, schema=self.schema))
+        self.rows.clear()
+
+    def finish_exporting(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+    def get_schema(self, rows: list):
+        pyarrow = self.pyarrow
+        column_types = {
+            'creation_timestamp': pyarrow.int64(),
+            'updated_timestamp': pyarrow.int64(),
+            'price': pyarrow.float64(),
+            'images': pyarrow.list_(pyarrow.string()),
+            'image_files': pyarrow.list_(pyarrow.string()),
+        }
+        columns = [field for field in self.fields_to_export or ProductItem.fields if field != METADATA_FIELD]
+        self.string_columns = {column for column in columns if column not in column_types}
+        self.metadata_keys = sorted({key for row in rows for key in (row.get(METADATA_FIELD) or {})})
+
+        fields = [pyarrow.field(column, column_types.get(column, pyarrow.string())) for column in columns]
+        fields += [pyarrow.field(f'{METADATA_COLUMN_PREFIX}{key}', pyarrow.string()) for key in self.metadata_keys]
+        fields.append(pyarrow.field(METADATA_OTHER_COLUMN, pyarrow.string()))
+        return pyarrow.schema(fields)
+
+    def flatten(self, row: dict) -> dict:
+        metadata = row.pop(METADATA_FIELD, None) or {}
+        for column in self.string_columns.intersection(row):
+            row[column] = to_str(row[column])
+        for key in self.metadata_keys:
+            row[f'{METADATA_COLUMN_PREFIX}{key}'] = to_str(metadata.get(key))
+        other = {key: value for key, value in metadata.items() if f'{METADATA_COLUMN_PREFIX}{key}' not in row}
+        row[METADATA_OTHER_COLUMN] = json.dumps(other, ensure_ascii=False) if other else None
+        return row
+
+    def open_writer(self, schema):
+        raise NotImplementedError
+
+
+class ParquetItemExporter(ColumnarItemExporter):
+
+    def open_writer(self, schema):
+        import pyarrow.parquet
+
+        return pyarrow.parquet.ParquetWriter(self.file, schema, compression=self.compression or 'snappy')
+
+
+class ArrowItemExporter(ColumnarItemExporter):
+    """Arrow IPC (Feather v2); поддерживает только сжатие lz4 и zstd."""
+
+    def open_writer(self, schema):
+        options = self.pyarrow.ipc.IpcWriteOptions(compression=self.compression)
+        return self.pyarrow.ipc.new_file(self.file, schema, options=options)
@@ -1,5 +1,27 @@
+import operator
+import re
+import sys
+from collections.abc import Sequence
+from typing import Optional
+
+import attr
 from scrapy import Item, Field
 
+from .spiders.constants.bikroy_com import IMAGE_UUID_RE
+
+UUID_SIZE = 16
+ADDRESS_KEY = 'Address'
+IMAGE_UUID_PATTERN = re.compile(IMAGE_UUID_RE)
+
+
+def pack_uuid(uuid: str) -> bytes:
+    return bytes.fromhex(uuid.replace('-', ''))
+
+
+def unpack_uuid(packed: bytes) -> str:
+    value = packed.hex()
+    return f'{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}'
+
 
 class ProductItem(Item):
     url = Field()
@@ -7,9 +29,143 @@ class ProductItem(Item):
     title = Field()
     description = Field()
     creation_timestamp = Field()
+    updated_timestamp = Field()
     author_name = Field()
     author_phone = Field()
     price = Field()
     images = Field()
     metadata = Field()
     address = Field()
+    image_files = Field()
+    change_type = Field()
+
+
+class ImageRefs(Sequence):
+    """
+    Ссылки на фотографии объявления без повторов: общее начало ссылок
+    (хост и slug объявления), общий конец (размер и вариант) и UUID
+    фотографий по 16 байт. При обращении разворачивается в обычные ссылки.
+    """
+    __slots__ = ('prefix', 'suffix', 'packed_uuids')
+
+    def __init__(self, prefix: str, suffix: str, packed_uuids: bytes):
+        self.prefix = prefix
+        self.suffix = sys.intern(suffix)
+        self.packed_uuids = packed_uuids
+
+    @classmethod
+    def from_urls(cls, urls: list) -> Optional['ImageRefs']:
+        """None, если ссылки устроены по-разному и сжать их так нельзя."""
+        prefix = suffix = None
+        packed_uuids = bytearray()
+        for url in urls:
+            match = IMAGE_UUID_PATTERN.search(url)
+            if match is None:
+                return None
+            if prefix is None:
+                prefix, suffix = url[:match.start()], url[match.end():]
+            elif url[:match.start()] != prefix or url[match.end():] != suffix:
+                return None
+            packed_uuids += pack_uuid(match.group(1))
+        return cls(prefix or '', suffix or '', bytes(packed_uuids))
+
+    @property
+    def uuids(self) -> list:
+        return [unpack_uuid(self.packed_uuids[start:start + UUID_SIZE])
+                for start in range(0, len(self.packed_uuids), UUID_SIZE)]
+
+    def __len__(self):
+        return len(self.packed_uuids) // UUID_SIZE
+
+    def __iter__(self):
+        for start in range(0, len(self.packed_uuids), UUID_SIZE):
+            yield f'{self.prefix}/{unpack_uuid(self.packed_uuids[start:start + UUID_SIZE])}{self.suffix}'
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('image index out of range')
+        start = index * UUID_SIZE
+        return f'{self.prefix}/{unpack_uuid(self.packed_uuids[start:start + UUID_SIZE])}{self.suffix}'
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f'<ImageRefs: {len(self)}>'
+
+
+def to_image_refs(images):
+    if images is None or isinstance(images, ImageRefs):
+        return images
+    return ImageRefs.from_urls(images) or images
+
+
+def expand_images(images) -> Optional[list]:
+    return list(images) if images is not None else None
+
+
+def intern_metadata_keys(metadata):
+    """
+    Названия характеристик у всех объявлений одни и те же, храним их по одному разу.
+    Адрес - район, он тоже повторяется у множества объявлений.
+    """
+    if not isinstance(metadata, dict):
+        return metadata
+    metadata = {sys.intern(key): value for key, value in metadata.items()}
+    address = metadata.get(ADDRESS_KEY)
+    if isinstance(address, str):
+        metadata[ADDRESS_KEY] = sys.intern(address)
+    return metadata
+
+
+def intern_string(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+@attr.define(init=False, eq=False, getstate_setstate=False)
+class CompactProductItem:
+    """
+    Те же поля, что у ProductItem, в слотах вместо словаря (COMPACT_ITEMS).
+    Ключи metadata и адрес интернируются, так что у объявлений из одного района
+    address и metadata['Address'] - одна строка на всех. Фотографии хранятся
+    как ImageRefs и разворачиваются в ссылки при выгрузке. Незаполненные поля
+    выгружаются как null.
+    Собирается дольше ProductItem из-за упаковки ссылок, выгружается быстрее
+    через to_dict.
+    """
+    url: Optional[str] = None
+    item_id: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    creation_timestamp: Optional[int] = None
+    updated_timestamp: Optional[int] = None
+    author_name: Optional[str] = None
+    author_phone: Optional[str] = None
+    price: Optional[float] = None
+    images: Optional[Sequence] = attr.field(default=None, converter=to_image_refs,
+                                            metadata={'serializer': expand_images})
+    metadata: Optional[dict] = attr.field(default=None, converter=intern_metadata_keys)
+    address: Optional[str] = attr.field(default=None, converter=intern_string)
+    image_files: Optional[list] = None
+    change_type: Optional[str] = None
+
+    def __init__(self, fields: dict = None, **kwargs):
+        # как у scrapy.Item: поля можно передать словарём или именованными аргументами.
+        # Один вызов __attrs_init__: setattr на каждое поле проходит ещё и через хуки on_setattr
+        self.__attrs_init__(**{**(fields or {}), **kwargs})
+
+    def to_dict(self) -> dict:
+        """Поля для выгрузки, как их отдал бы ItemAdapter с сериализаторами, но без обхода метаданных attrs."""
+        record = dict(zip(COMPACT_FIELD_NAMES, get_compact_fields(self)))
+        record['images'] = expand_images(self.images)
+        return record
+
+
+COMPACT_FIELD_NAMES = tuple(field.name for field in attr.fields(CompactProductItem))
+get_compact_fields = operator.attrgetter(*COMPACT_FIELD_NAMES)
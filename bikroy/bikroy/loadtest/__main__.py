@@ -0,0 +1,142 @@
+"""
+Нагрузочный прогон настоящего паука bikroy.com против локального mock-сайта.
+Запуск из папки с scrapy.cfg:
+
+    python -m bikroy.loadtest --error-rate 0.02 --burst-every 30 --dead-proxies 0.25 -s CONCURRENT_REQUESTS=32
+
+Сайт и прокси работают в отдельном процессе (см. server.py), паук ходит к ним
+через обычный ProxyRotator. Кеши паука пишутся во временную папку (SPIDER_CACHE_DIR),
+поэтому кеши и состояние настоящих запусков не затрагиваются. В конце печатается отчёт:
+время до завершения, страниц и продуктов в секунду, повторы, впустую
+потраченные запросы, новые соединения и TLS-рукопожатия; с --json он же сохраняется в файл.
+"""
+import argparse
+import json
+import logging
+import ssl
+import subprocess
+import sys
+import tempfile
+import urllib.request
+from pathlib import Path
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.settings import Settings
+
+from .. import settings as project_settings
+from ..runner import PROJECT_PATH
+from ..spiders.bikroy_spider import BikroySpiderSpider
+from .server import add_arguments, get_server_arguments
+from .site import STATS_PATH
+
+logger = logging.getLogger(__name__)
+
+# кеши и сохранённое дерево категорий от прошлых прогонов не должны влиять на замер
+LOADTEST_SETTINGS = {
+    'CATEGORY_TREE_TTL': 0,
+    'METRICS_PORT': 0,
+    'TELNETCONSOLE_ENABLED': False,
+    'LOG_LEVEL': 'INFO',
+}
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Load test the spider against a local mock bikroy.com')
+    add_arguments(parser)
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='настройка Scrapy для паука')
+    parser.add_argument('--json', type=Path, help='сохранить отчёт в файл')
+    return parser.parse_args()
+
+
+def start_server(args) -> tuple:
+    command = [sys.executable, '-m', 'bikroy.loadtest.server', *get_server_arguments(args)]
+    server = subprocess.Popen(command, cwd=PROJECT_PATH, stdout=subprocess.PIPE, text=True)
+    ready_line = server.stdout.readline()
+    if not ready_line:
+        server.wait()
+        raise RuntimeError(f'Mock server exited with code {server.returncode}')
+    return server, json.loads(ready_line)
+
+
+def get_site_stats(site_port: int) -> dict:
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    with urllib.request.urlopen(f'https://127.0.0.1:{site_port}{STATS_PATH}', context=context, timeout=10) as response:
+        return json.load(response)
+
+
+def run_crawl(args, proxies: list, work_path: Path) -> dict:
+    proxies_path = work_path / 'proxies.txt'
+    proxies_path.write_text('\n'.join(proxies))
+
+    settings = Settings()
+    settings.setmodule(project_settings, priority='project')
+    # кеши паука (дерево категорий, редиректы, состояние краулинга) - во временной папке
+    settings.update({**LOADTEST_SETTINGS, 'PROXY_POOL_FILE': str(proxies_path),
+                     'SPIDER_CACHE_DIR': str(work_path / 'cache')}, priority='cmdline')
+    settings.update(dict(setting.split('=', 1) for setting in args.set), priority='cmdline')
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(BikroySpiderSpider)
+    process.crawl(crawler)
+    process.start()
+    return crawler.stats.get_stats()
+
+
+def get_report(stats: dict, site_stats: dict, ready: dict) -> dict:
+    elapsed = stats.get('elapsed_time_seconds') or 0.0
+    statuses = {int(key.rsplit('/', 1)[1]): value for key, value in stats.items()
+                if key.startswith('downloader/response_status_count/')}
+    items = stats.get('item_scraped_count', 0)
+    requests = stats.get('downloader/request_count', 0)
+    return {
+        'finish_reason': stats.get('finish_reason'),
+        'time_to_completion_s': round(elapsed, 1),
+        'pages_per_s': round(statuses.get(200, 0) / elapsed, 1) if elapsed else 0.0,
+        'items_per_s': round(items / elapsed, 1) if elapsed else 0.0,
+        'items': items,
+        'expected_items': ready['ads'],
+        'requests': requests,
+        'retries': stats.get('retry/count', 0),
+        'retries_exhausted': stats.get('retry/max_reached', 0),
+        # всё, что не принесло страницу: ошибки, баны, редиректы, оборванные соединения
+        'wasted_requests': requests - statuses.get(200, 0),
+        'redirects': sum(value for status, value in statuses.items() if 300 <= status < 400),
+        'responses_429': statuses.get(429, 0),
+        'responses_5xx': sum(value for status, value in statuses.items() if status >= 500),
+        'download_exceptions': stats.get('downloader/exception_count', 0),
+        'new_connections': stats.get('connection_pool/new', 0),
+        'connection_reuse_ratio': stats.get('connection_pool/reuse_ratio', 0.0),
+        'tls_handshakes': stats.get('tls/handshakes', 0),
+        'tls_sessions_offered': stats.get('tls/sessions_offered', 0),
+        'proxies_dead': site_stats.get('proxies/dead', 0),
+        'site_requests': site_stats.get('requests', 0),
+    }
+
+
+def main() -> int:
+    args = get_arguments()
+    server, ready = start_server(args)
+    try:
+        logger.info(f"Mock site on port {ready['site_port']}: {ready['leaf_categories']} leaf categories, "
+                    f"{ready['ads']} ads, {len(ready['proxies'])} proxies")
+        with tempfile.TemporaryDirectory(prefix='bikroy-loadtest-') as work_dir:
+            stats = run_crawl(args, ready['proxies'], Path(work_dir))
+        site_stats = get_site_stats(ready['site_port'])
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = get_report(stats, site_stats, ready)
+    width = max(map(len, report))
+    for name, value in report.items():
+        print(f'{name:<{width}}  {value}')
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+    return 0 if report['items'] == report['expected_items'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import logging
+from typing import Optional
+
+from twisted.internet import reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.internet.protocol import Factory, Protocol
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_SIZE = 64 * 1024
+CONNECTION_ESTABLISHED = b'HTTP/1.1 200 Connection established\r\n\r\n'
+METHOD_NOT_ALLOWED = b'HTTP/1.1 405 Method Not Allowed\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+
+class TunnelClient(Protocol):
+    """Сторона туннеля, подключённая к mock-сайту."""
+
+    def __init__(self, server: 'TunnelServer'):
+        self.server = server
+
+    def dataReceived(self, data: bytes):
+        self.server.transport.write(data)
+
+    def connectionLost(self, reason=None):
+        self.server.transport.loseConnection()
+
+
+class TunnelServer(Protocol):
+    """
+    Принимает CONNECT, как HTTPS-прокси, но любой хост соединяет с mock-сайтом,
+    так что паук с настоящими ссылками bikroy.com никуда, кроме него, не ходит.
+    """
+
+    def __init__(self, proxy: 'FakeProxy'):
+        self.proxy = proxy
+        self.buffer = b''
+        self.client: Optional[TunnelClient] = None
+
+    def connectionMade(self):
+        self.proxy.connections.add(self)
+
+    def connectionLost(self, reason=None):
+        self.proxy.connections.discard(self)
+        if self.client is not None:
+            self.client.transport.loseConnection()
+
+    def dataReceived(self, data: bytes):
+        if self.client is not None:
+            self.client.transport.write(data)
+            return
+
+        self.buffer += data
+        head, separator, rest = self.buffer.partition(b'\r\n\r\n')
+        if not separator:
+            if len(self.buffer) > MAX_HEADER_SIZE:
+                self.transport.loseConnection()
+            return
+        if not head.startswith(b'CONNECT '):
+            self.transport.write(METHOD_NOT_ALLOWED)
+            self.transport.loseConnection()
+            return
+
+        self.buffer = b''
+        self.proxy.tunnels += 1
+        self.transport.pauseProducing()
+        endpoint = TCP4ClientEndpoint(reactor, '127.0.0.1', self.proxy.site_port)
+        connectProtocol(endpoint, TunnelClient(self)).addCallbacks(
+            lambda client: self.tunnel_opened(client, rest),
+            lambda failure: self.transport.loseConnection(),
+        )
+
+    def tunnel_opened(self, client: TunnelClient, rest: bytes):
+        self.client = client
+        self.transport.write(CONNECTION_ESTABLISHED)
+        if rest:
+            client.transport.write(rest)
+        self.transport.resumeProducing()
+
+
+class FakeProxy(Factory):
+    """Локальная прокси, которую можно «убить»: она перестаёт принимать соединения и рвёт открытые."""
+
+    def __init__(self, site_port: int):
+        self.site_port = site_port
+        self.connections: set[TunnelServer] = set()
+        self.tunnels = 0
+        self.port = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port.getHost().port}'
+
+    @property
+    def is_alive(self) -> bool:
+        return self.port is not None and self.port.connected
+
+    def buildProtocol(self, addr):
+        return TunnelServer(self)
+
+    def listen(self):
+        self.port = reactor.listenTCP(0, self, interface='127.0.0.1')
+
+    def kill(self):
+        logger.info(f'Proxy {self.url} is dead')
+        self.port.stopListening()
+        for connection in list(self.connections):
+            connection.transport.abortConnection()
@@ -0,0 +1,114 @@
+"""
+Mock bikroy.com с набором фейковых прокси. Сайт отвечает по TLS с самоподписанным
+сертификатом (Scrapy сертификаты не проверяет), прокси принимают CONNECT на любой
+хост и соединяют с ним. Когда всё поднято, в stdout пишется одна JSON-строка
+с портом сайта и ссылками на прокси. Обычно запускается из python -m bikroy.loadtest.
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+
+from OpenSSL import crypto
+from twisted.internet import reactor, ssl
+from twisted.web.resource import EncodingResourceWrapper
+from twisted.web.server import GzipEncoderFactory, Site
+
+from .proxies import FakeProxy
+from .site import HOST, Catalog, FaultInjector, MockSiteResource
+
+logger = logging.getLogger(__name__)
+
+
+def get_tls_options() -> ssl.CertificateOptions:
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    certificate = crypto.X509()
+    certificate.get_subject().CN = HOST
+    certificate.set_serial_number(1)
+    certificate.gmtime_adj_notBefore(0)
+    certificate.gmtime_adj_notAfter(7 * 24 * 60 * 60)
+    certificate.set_issuer(certificate.get_subject())
+    certificate.set_pubkey(key)
+    certificate.sign(key, 'sha256')
+    # как CDN перед настоящим сайтом: сессии можно возобновлять по id и по билетам
+    return ssl.CertificateOptions(privateKey=key, certificate=certificate,
+                                  enableSessions=True, enableSessionTickets=True)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    site = parser.add_argument_group('mock site')
+    site.add_argument('--depth', type=int, default=2, help='глубина дерева категорий')
+    site.add_argument('--branching', type=int, default=4, help='подкатегорий на каждом уровне')
+    site.add_argument('--ads-per-category', type=int, default=100)
+    site.add_argument('--seed', type=int, default=0)
+
+    faults = parser.add_argument_group('faults')
+    faults.add_argument('--latency', type=float, default=0.05, help='задержка ответа, секунд')
+    faults.add_argument('--jitter', type=float, default=0.05, help='случайная добавка к задержке, до секунд')
+    faults.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 500/502/503')
+    faults.add_argument('--burst-every', type=float, default=0.0, help='период всплесков 429, секунд (0 - без них)')
+    faults.add_argument('--burst-length', type=float, default=5.0, help='длительность всплеска 429, секунд')
+    faults.add_argument('--burst-rate', type=float, default=1.0, help='доля ответов 429 во время всплеска')
+
+    proxies = parser.add_argument_group('proxies')
+    proxies.add_argument('--proxies', type=int, default=8, help='число фейковых прокси')
+    proxies.add_argument('--dead-proxies', type=float, default=0.0, help='доля прокси, которые умрут')
+    proxies.add_argument('--death-window', type=float, default=30.0,
+                         help='прокси умирают в случайный момент за столько секунд от старта')
+
+
+def get_server_arguments(args) -> list:
+    """Аргументы сервера из общего набора аргументов, для запуска отдельным процессом."""
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    names = vars(parser.parse_args([]))
+    return [argument for name in names for argument in (f"--{name.replace('_', '-')}", str(getattr(args, name)))]
+
+
+def start(args) -> dict:
+    catalog = Catalog(args.depth, args.branching, args.ads_per_category, args.seed)
+    faults = FaultInjector(args.latency, args.jitter, args.error_rate,
+                           args.burst_every, args.burst_length, args.burst_rate, args.seed)
+    resource = MockSiteResource(catalog, faults)
+    site = Site(EncodingResourceWrapper(resource, [GzipEncoderFactory()]))
+    site.noisy = False
+    site_port = reactor.listenSSL(0, site, get_tls_options(), interface='127.0.0.1').getHost().port
+
+    proxies = [FakeProxy(site_port) for _ in range(args.proxies)]
+    for proxy in proxies:
+        proxy.listen()
+
+    rnd = random.Random(args.seed)
+    for proxy in rnd.sample(proxies, round(len(proxies) * args.dead_proxies)):
+        reactor.callLater(rnd.uniform(0, args.death_window), kill_proxy, proxy, resource)
+
+    return {
+        'site_port': site_port,
+        'proxies': [proxy.url for proxy in proxies],
+        'categories': len(catalog.children),
+        'leaf_categories': len(catalog.leaves),
+        'ads': catalog.total_ads,
+    }
+
+
+def kill_proxy(proxy: FakeProxy, resource: MockSiteResource):
+    proxy.kill()
+    resource.inc_stat('proxies/dead')
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    parser = argparse.ArgumentParser(description='Mock bikroy.com with fake proxies')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    ready = start(args)
+    print(json.dumps(ready), flush=True)
+    reactor.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
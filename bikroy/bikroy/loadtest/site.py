@@ -0,0 +1,208 @@
+import json
+import random
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+
+from ..benchmarks.corpus import EXAMPLE_PATH, get_ad_data, get_listing_ad, get_tree
+
+HOST = 'bikroy.com'
+ROOT_PATH = '/en/ads'
+CATEGORY_PATH_PREFIX = '/en/ads/bangladesh/'
+PRODUCT_PATH_PREFIX = '/en/ad/'
+STATS_PATH = '/__stats'
+ADS_PER_PAGE = 25
+ERROR_STATUSES = (500, 502, 503)
+
+
+class Catalog:
+    """
+    Синтетическое дерево категорий глубины depth с branching подкатегориями
+    на каждом уровне и ads_per_category объявлениями в каждой конечной
+    категории. Страницы устроены как на сайте: ссылки на подкатегории
+    в первом collapsible-content, данные в window.initialData.
+    """
+
+    def __init__(self, depth: int, branching: int, ads_per_category: int, seed: int = 0):
+        self.ads_per_category = ads_per_category
+        self.seed = seed
+        with open(EXAMPLE_PATH, encoding='utf-8') as example_file:
+            self.examples = json.load(example_file)
+
+        # путь категории -> пути подкатегорий, у конечных пустой список
+        self.children: dict[str, list] = {}
+        self.add_categories(ROOT_PATH, '', depth, branching)
+        self.leaves = [path for path, children in self.children.items() if not children]
+        self.leaf_indexes = {path: index for index, path in enumerate(self.leaves)}
+
+        rnd = random.Random(seed)
+        padding_data = {'locations': get_tree('location', 6, rnd), 'categories': get_tree('category', 5, rnd)}
+        self.initial_data_prefix = json.dumps(padding_data, ensure_ascii=False)[:-1]
+        self.markup = ''.join(f'<div class="item--{index}"><a href="/en/promo-{index}">Item {index}</a></div>'
+                              for index in range(3000))
+
+    def add_categories(self, path: str, name: str, depth: int, branching: int):
+        children = []
+        if depth:
+            for number in range(1, branching + 1):
+                child_name = f'{name}-{number}' if name else f'c{number}'
+                children.append(f'{CATEGORY_PATH_PREFIX}{child_name}')
+                self.add_categories(children[-1], child_name, depth - 1, branching)
+        self.children[path] = children
+
+    @property
+    def total_ads(self) -> int:
+        return len(self.leaves) * self.ads_per_category
+
+    def get_ad(self, index: int) -> dict:
+        rnd = random.Random(self.seed + index)
+        return get_ad_data(self.examples[index % len(self.examples)], index, rnd)
+
+    def get_category_page(self, path: str, page: int) -> Optional[bytes]:
+        if path not in self.children:
+            return None
+        children = self.children[path]
+        links = ([path] if path != ROOT_PATH else []) + children
+        navigation = ''.join(f'<a href="{link}">{link.rsplit("/", 1)[-1]}</a>' for link in links)
+        navigation = (f'<div id="collapsible-content-categories">{navigation}</div>'
+                      f'<div id="collapsible-content-locations"></div>')
+        data = {}
+        if not children:
+            data['serp'] = {'ads': {'data': self.get_serp_data(path, page)}}
+        return self.render_page(navigation, data)
+
+    def get_serp_data(self, path: str, page: int) -> dict:
+        first_index = self.leaf_indexes[path] * self.ads_per_category
+        page_start = (page - 1) * ADS_PER_PAGE
+        page_end = min(page * ADS_PER_PAGE, self.ads_per_category)
+        rnd = random.Random(f'{self.seed}:{path}:{page}')
+        ads = [get_listing_ad(self.get_ad(first_index + offset), rnd) for offset in range(page_start, page_end)]
+        return {'ads': ads,
+                'paginationData': {'activePage': page, 'pageSize': ADS_PER_PAGE, 'total': self.ads_per_category}}
+
+    def get_product_page(self, slug: str) -> Optional[bytes]:
+        try:
+            index = int(slug.rsplit('-', 1)[1])
+        except (IndexError, ValueError):
+            return None
+        if not 0 <= index < self.total_ads:
+            return None
+        ad = self.get_ad(index)
+        if ad['slug'] != slug:
+            return None
+        return self.render_page('', {'adDetail': {'data': {'ad': ad}}})
+
+    def render_page(self, navigation: str, data: dict) -> bytes:
+        initial_data = f'{self.initial_data_prefix}, {json.dumps(data, ensure_ascii=False)[1:]}'
+        return (
+            '<!DOCTYPE html><html><head><title>Bikroy</title></head><body>'
+            f'{navigation}<div id="app">{self.markup[:len(self.markup) // 3]}</div>'
+            f'<script>window.initialData = {initial_data}</script>'
+            f'{self.markup}</body></html>'
+        ).encode()
+
+
+def get_canonical_location(host: str, uri: str) -> str:
+    """Куда сайт отправит редиректом: без www, без слеша в конце, параметры по алфавиту."""
+    parsed_uri = urlparse(uri)
+    path = parsed_uri.path.rstrip('/') or '/'
+    query = urlencode(sorted(parse_qsl(parsed_uri.query)))
+    return f"https://{host.removeprefix('www.')}{path}{'?' + query if query else ''}"
+
+
+class FaultInjector:
+    """
+    Задержка ответа (latency плюс случайная добавка до jitter), доля ответов
+    с 5xx и периодические всплески 429: каждые burst_every секунд
+    в течение burst_length секунд доля burst_rate ответов получает 429.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 burst_every: float = 0.0, burst_length: float = 0.0, burst_rate: float = 1.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.burst_rate = burst_rate
+        self.random = random.Random(seed)
+        self.started_at = time.monotonic()
+
+    def get_delay(self) -> float:
+        return self.latency + self.random.uniform(0, self.jitter)
+
+    def is_burst(self, now: float) -> bool:
+        return bool(self.burst_every) and (now - self.started_at) % self.burst_every < self.burst_length
+
+    def get_fault_status(self) -> Optional[int]:
+        if self.is_burst(time.monotonic()) and self.random.random() < self.burst_rate:
+            return 429
+        if self.random.random() < self.error_rate:
+            return self.random.choice(ERROR_STATUSES)
+        return None
+
+
+class MockSiteResource(Resource):
+    """Отвечает за все хосты сайта. Счётчики отдаются в JSON по /__stats."""
+    isLeaf = True
+
+    def __init__(self, catalog: Catalog, faults: FaultInjector):
+        super().__init__()
+        self.catalog = catalog
+        self.faults = faults
+        self.stats: dict[str, int] = {}
+
+    def inc_stat(self, name: str, count: int = 1):
+        self.stats[name] = self.stats.get(name, 0) + count
+
+    def render_GET(self, request):
+        host = (request.getHeader('host') or HOST).split(':')[0]
+        uri = request.uri.decode()
+        if request.path == STATS_PATH.encode():
+            request.setHeader('Content-Type', 'application/json')
+            return json.dumps(self.stats).encode()
+
+        self.inc_stat('requests')
+        status, headers, body = self.get_response(host, uri)
+        self.inc_stat(f'status/{status}')
+        self.inc_stat('bytes', len(body))
+
+        call = reactor.callLater(self.faults.get_delay(), self.finish, request, status, headers, body)
+        request.notifyFinish().addErrback(lambda failure: call.active() and call.cancel())
+        return NOT_DONE_YET
+
+    def get_response(self, host: str, uri: str) -> tuple:
+        fault_status = self.faults.get_fault_status()
+        if fault_status is not None:
+            return fault_status, {}, b'<html><body>Too many requests</body></html>'
+
+        location = get_canonical_location(host, uri)
+        if location != f'https://{host}{uri}':
+            self.inc_stat('redirects')
+            return 301, {'Location': location}, b''
+
+        parsed_uri = urlparse(uri)
+        body = None
+        if parsed_uri.path.startswith(PRODUCT_PATH_PREFIX):
+            self.inc_stat('pages/product')
+            body = self.catalog.get_product_page(parsed_uri.path[len(PRODUCT_PATH_PREFIX):])
+        else:
+            self.inc_stat('pages/category')
+            page = dict(parse_qsl(parsed_uri.query)).get('page', '1')
+            if page.isdigit():
+                body = self.catalog.get_category_page(parsed_uri.path, int(page))
+        if body is None:
+            return 404, {}, b'<html><body>Not found</body></html>'
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, body
+
+    @staticmethod
+    def finish(request, status: int, headers: dict, body: bytes):
+        request.setResponseCode(status)
+        for name, value in headers.items():
+            request.setHeader(name, value)
+        request.write(body)
+        request.finish()
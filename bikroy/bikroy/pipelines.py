@@ -1,16 +1,260 @@
+import gzip
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
 from itemadapter import ItemAdapter
-from scrapy.exceptions import DropItem
+from scrapy import Request
+from scrapy.core.downloader import Slot
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.pipelines.files import FilesPipeline, FSFilesStore
+
+from .exporters import ArrowItemExporter, NdjsonItemExporter, ParquetItemExporter
+from .spiders.constants.bikroy_com import IMAGE_URL_TEMPLATE, IMAGE_UUID_RE
+from .spiders.helpers.crawl_state import CHANGE_UNCHANGED
+from .spiders.helpers.id_set import ObjectIdSet, pack_ad_id
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+IMAGE_INDEX_FILENAME = 'stored_images.bin'
+IMAGE_SLOT_PREFIX = 'img:'
 
 
 class DuplicatesPipeline:
 
     def __init__(self):
-        self.ids_seen = set()
+        self.ids_seen = ObjectIdSet()
 
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
-        if adapter['item_id'] in self.ids_seen:
+        if not self.ids_seen.add(pack_ad_id(adapter['item_id'])):
             raise DropItem(f"Duplicate item found: {item!r}")
         else:
-            self.ids_seen.add(adapter['item_id'])
             return item
+
+
+class DeltaPipeline:
+    """
+    Пропускает в выгрузку только новые, изменившиеся и снятые объявления
+    (поле change_type). Объявления, содержимое которых совпало с прошлым
+    запуском, отбрасываются.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('DELTA_OUTPUT_ENABLED'):
+            raise NotConfigured
+        return cls(crawler.stats)
+
+    def process_item(self, item, spider):
+        change_type = ItemAdapter(item).get('change_type')
+        self.stats.inc_value(f'delta/{change_type}', spider=spider)
+        if change_type == CHANGE_UNCHANGED:
+            raise DropItem(f"Unchanged item: {item!r}")
+        return item
+
+
+class StreamingExportPipeline:
+    """
+    Пишет продукты в файлы по частям: NDJSON большими буферизованными пачками
+    (со сжатием gzip или zstd) либо Parquet/Arrow с metadata, разложенной
+    по колонкам. Файл закрывается и начинается следующий, когда он вырос
+    больше STREAM_EXPORT_ROTATE_BYTES или пишется дольше STREAM_EXPORT_ROTATE_SECONDS.
+    Недописанный файл имеет суффикс .part, так что забирать можно всё остальное.
+    """
+
+    def __init__(self, uri: str, export_format: str, compression: str = None, batch_bytes: int = 0,
+                 batch_items: int = 0, rotate_bytes: int = 0, rotate_seconds: float = 0):
+        self.uri = uri
+        self.export_format = export_format
+        self.compression = compression
+        self.batch_bytes = batch_bytes
+        self.batch_items = batch_items
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.started_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H-%M-%S')
+        self.spider_name = None
+        self.part = 0
+        self.path = None
+        self.raw_file = None
+        self.file = None
+        self.exporter = None
+        self.part_opened_at = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        uri = settings.get('STREAM_EXPORT_URI')
+        if not uri:
+            raise NotConfigured
+        return cls(
+            uri,
+            settings.get('STREAM_EXPORT_FORMAT'),
+            compression=settings.get('STREAM_EXPORT_COMPRESSION'),
+            batch_bytes=settings.getint('STREAM_EXPORT_BATCH_BYTES'),
+            batch_items=settings.getint('STREAM_EXPORT_BATCH_ITEMS'),
+            rotate_bytes=settings.getint('STREAM_EXPORT_ROTATE_BYTES'),
+            rotate_seconds=settings.getfloat('STREAM_EXPORT_ROTATE_SECONDS'),
+        )
+
+    def open_spider(self, spider):
+        self.spider_name = spider.name
+
+    def close_spider(self, spider):
+        if self.exporter is not None:
+            self.close_part()
+
+    def process_item(self, item, spider):
+        if self.exporter is None:
+            self.open_part()
+        self.exporter.export_item(item)
+        if self.should_rotate():
+            self.close_part()
+        return item
+
+    def should_rotate(self) -> bool:
+        if self.rotate_seconds and time.monotonic() - self.part_opened_at >= self.rotate_seconds:
+            return True
+        return bool(self.rotate_bytes) and self.raw_file.tell() >= self.rotate_bytes
+
+    def open_part(self):
+        self.path = Path(self.uri.format(spider=self.spider_name, time=self.started_at, part=self.part))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.raw_file = open(f'{self.path}{PART_SUFFIX}', 'wb')
+        self.part_opened_at = time.monotonic()
+
+        if self.export_format == 'ndjson':
+            self.file = self.open_compressed(self.raw_file)
+            self.exporter = NdjsonItemExporter(self.file, batch_bytes=self.batch_bytes)
+        else:
+            # у колоночных форматов сжатие своё, внутри файла
+            exporter_cls = ParquetItemExporter if self.export_format == 'parquet' else ArrowItemExporter
+            self.file = self.raw_file
+            self.exporter = exporter_cls(self.file, batch_items=self.batch_items, compression=self.compression)
+        self.exporter.start_exporting()
+
+    def open_compressed(self, raw_file):
+        if self.compression == 'gzip':
+            return gzip.GzipFile(fileobj=raw_file, mode='wb', compresslevel=6)
+        if self.compression == 'zstd':
+            import zstandard
+
+            return zstandard.ZstdCompressor(level=3).stream_writer(raw_file, closefd=False)
+        return raw_file
+
+    def close_part(self):
+        self.exporter.finish_exporting()
+        if self.file is not self.raw_file:
+            self.file.close()
+        self.raw_file.close()
+        os.replace(f'{self.path}{PART_SUFFIX}', self.path)
+        logger.info(f'Exported part {self.part}: {self.path}')
+
+        self.part += 1
+        self.exporter = self.file = self.raw_file = None
+
+
+class ImageFilesPipeline(FilesPipeline):
+    """
+    Скачивает фотографии объявлений во время обхода. Файл называется по UUID
+    фотографии из её ссылки, поэтому фотография, которая встречается в разных
+    (в том числе перевыложенных) объявлениях, скачивается и хранится один раз.
+    Сохранённые UUID записываются в индекс в папке варианта и размера
+    (FILES_STORE/<вариант>/<ширина>x<высота>), и при следующем запуске
+    такие фотографии не скачиваются и даже не проверяются в хранилище.
+    Каждый хост фотографий получает свой слот загрузчика с параллельностью
+    IMAGES_CONCURRENCY_PER_HOST. Пути к файлам попадают в поле image_files.
+    """
+
+    def __init__(self, store_uri, download_func=None, settings=None):
+        super().__init__(store_uri, download_func=download_func, settings=settings)
+        self.width = settings.getint('IMAGES_WIDTH')
+        self.height = settings.getint('IMAGES_HEIGHT')
+        self.variant = settings.get('IMAGES_VARIANT')
+        self.concurrency_per_host = settings.getint('IMAGES_CONCURRENCY_PER_HOST')
+        self.uuid_re = re.compile(IMAGE_UUID_RE)
+        # индекс ведётся только для локального хранилища, для s3/gcs/ftp наличие файла проверяет сам FilesPipeline
+        self.index_path = Path(self.store.basedir) / self.get_size_dir() / IMAGE_INDEX_FILENAME \
+            if isinstance(self.store, FSFilesStore) else None
+        self.stored_uuids = ObjectIdSet(self.index_path)
+        # UUID в упакованном виде (pack_ad_id): фотографии, которые сейчас качаются и которые не скачались
+        self.requested_uuids: set[bytes] = set()
+        self.failed_uuids: set[bytes] = set()
+
+    def close_spider(self, spider):
+        if self.index_path:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            self.stored_uuids.save()
+        self.stored_uuids.close()
+
+    def get_image(self, image_url: str) -> Optional[tuple[str, str]]:
+        """Возвращает UUID фотографии и ссылку на неё в нужном размере."""
+        match = self.uuid_re.search(image_url)
+        if match is None:
+            return None
+        src = image_url[:match.end()]
+        url = IMAGE_URL_TEMPLATE.format(src=src, width=self.width, height=self.height, variant=self.variant)
+        return match.group(1), url
+
+    def get_media_requests(self, item, info):
+        requests = []
+        for image_url in ItemAdapter(item).get('images') or []:
+            image = self.get_image(image_url)
+            if image is None:
+                continue
+            uuid, url = image
+            packed_uuid = pack_ad_id(uuid)
+            if packed_uuid in self.requested_uuids or packed_uuid in self.stored_uuids:
+                self.crawler.stats.inc_value('images/skipped_known')
+                continue
+            self.requested_uuids.add(packed_uuid)
+            requests.append(Request(url, meta={'image_uuid': uuid, 'download_slot': self.get_slot_key(url)}))
+        return requests
+
+    def get_slot_key(self, url: str) -> str:
+        slot_key = f'{IMAGE_SLOT_PREFIX}{urlparse(url).hostname}'
+        downloader = self.crawler.engine.downloader
+        if slot_key not in downloader.slots:  # простаивающие слоты загрузчик удаляет
+            delay = self.crawler.settings.getfloat('DOWNLOAD_DELAY')
+            downloader.slots[slot_key] = Slot(self.concurrency_per_host, delay, downloader.randomize_delay)
+        return slot_key
+
+    def media_failed(self, failure, request, info):
+        packed_uuid = pack_ad_id(request.meta['image_uuid'])
+        # фотография может встретиться в следующем объявлении, там попробуем ещё раз
+        self.requested_uuids.discard(packed_uuid)
+        self.failed_uuids.add(packed_uuid)
+        return super().media_failed(failure, request, info)
+
+    def file_path(self, request, response=None, info=None, *, item=None):
+        return self.get_file_path(request.meta['image_uuid'])
+
+    def get_size_dir(self) -> str:
+        return f'{self.variant}/{self.width}x{self.height}'
+
+    def get_file_path(self, uuid: str) -> str:
+        return f'{self.get_size_dir()}/{uuid[:2]}/{uuid}.jpg'
+
+    def item_completed(self, results, item, info):
+        for ok, result in results:
+            if ok:
+                packed_uuid = pack_ad_id(Path(result['path']).stem)
+                self.stored_uuids.add(packed_uuid)
+                self.requested_uuids.discard(packed_uuid)
+                self.failed_uuids.discard(packed_uuid)
+
+        adapter = ItemAdapter(item)
+        uuids = [image[0] for image in map(self.get_image, adapter.get('images') or []) if image]
+        # фотографии, которые качает другое объявление, уже имеют известный путь
+        adapter['image_files'] = [self.get_file_path(uuid) for uuid in uuids
+                                  if pack_ad_id(uuid) not in self.failed_uuids]
+        return item
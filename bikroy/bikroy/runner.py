@@ -0,0 +1,93 @@
+"""
+Шардированный запуск паука. Один процесс обходит дерево категорий
+и складывает конечные категории в общий фронтир, воркеры параллельно
+разбирают их оттуда. Запуск из папки с scrapy.cfg:
+
+    python -m bikroy.runner --workers 4 -o result-{worker}.jl
+
+Воркеры на других машинах подключаются к тому же обходу через Redis:
+
+    python -m bikroy.runner --frontier redis://host:6379/0 --join --workers 4 -o result-{worker}.jl
+
+С --metrics-port каждый процесс отдаёт метрики на своём порту: обход
+категорий на указанном, воркер N на следующем после него + N.
+"""
+import argparse
+import logging
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+from .spiders.helpers.frontier import get_frontier
+
+logger = logging.getLogger(__name__)
+
+SPIDER_NAME = 'bikroy.com'
+PROJECT_PATH = Path(__file__).resolve().parent.parent
+# абсолютный путь: раннер и воркеры должны открыть один и тот же файл, откуда бы их ни запустили
+DEFAULT_FRONTIER = f'sqlite:///{PROJECT_PATH / "bikroy" / "spiders" / "cache" / "frontier.sqlite3"}'
+
+
+def get_crawl_command(args, *spider_args: str, output: str = None, metrics_port: int = None) -> list:
+    command = [sys.executable, '-m', 'scrapy', 'crawl', SPIDER_NAME, '-a', f'frontier={args.frontier}']
+    for spider_arg in spider_args:
+        command += ['-a', spider_arg]
+    for setting in args.set:
+        command += ['-s', setting]
+    if metrics_port is not None:
+        command += ['-s', 'METRICS_ENABLED=1', '-s', f'METRICS_PORT={metrics_port}']
+    if output:
+        command += ['-o', output]
+    return command
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description='Sharded bikroy.com crawl')
+    parser.add_argument('--frontier', default=DEFAULT_FRONTIER,
+                        help='sqlite:///path или redis://host:port/db')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--start-urls', help='стартовые ссылки через "|"')
+    parser.add_argument('--join', action='store_true',
+                        help='подключиться к идущему обходу: не очищать фронтир и не обходить категории')
+    parser.add_argument('-o', '--output', help='файл результатов воркера, {worker} заменяется на номер')
+    parser.add_argument('--metrics-port', type=int,
+                        help='включить метрики: первый порт, каждый процесс получает свой')
+    parser.add_argument('-s', '--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='настройка Scrapy для всех процессов')
+    return parser.parse_args()
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    args = get_arguments()
+
+    if not args.join:
+        frontier = get_frontier(args.frontier)
+        frontier.reset()
+        frontier.close()
+
+    processes = []
+    if not args.join:
+        discover_args = ['role=discover']
+        if args.start_urls:
+            discover_args.append(f'start_urls={args.start_urls}')
+        processes.append(subprocess.Popen(get_crawl_command(args, *discover_args, metrics_port=args.metrics_port),
+                                          cwd=PROJECT_PATH))
+
+    hostname = socket.gethostname()
+    for worker in range(args.workers):
+        output = args.output.format(worker=worker) if args.output else None
+        metrics_port = args.metrics_port + 1 + worker if args.metrics_port is not None else None
+        command = get_crawl_command(args, f'worker_id={hostname}-{worker}', output=output, metrics_port=metrics_port)
+        processes.append(subprocess.Popen(command, cwd=PROJECT_PATH))
+
+    return_codes = [process.wait() for process in processes]
+    failed = [code for code in return_codes if code]
+    if failed:
+        logger.error(f'{len(failed)} of {len(processes)} crawl processes failed')
+    return max(return_codes, default=0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
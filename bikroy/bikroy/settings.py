@@ -19,7 +19,8 @@ USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:104.0) Gecko/20100101
 # ROBOTSTXT_OBEY = True
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-CONCURRENT_REQUESTS = 10
+# With ADAPTIVE_CONCURRENCY_ENABLED this is only the global ceiling
+CONCURRENT_REQUESTS = 64
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -43,26 +44,46 @@ CONCURRENT_REQUESTS = 10
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#    'bikroy.middlewares.BikroySpiderMiddleware': 543,
-# }
+SPIDER_MIDDLEWARES = {
+    'bikroy.spiders.extensions.dedup.AdDedupMiddleware': 50,
+    # close to the spider, so the other middlewares already see canonical URLs
+    'bikroy.spiders.extensions.canonical_url.CanonicalUrlMiddleware': 940,
+    # wraps request.callback, so the call and the iteration of its result are timed
+    'bikroy.spiders.extensions.metrics.CallbackTimingMiddleware': 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
-    'bikroy.spiders.extensions.proxy_rotator.ProxyRotator': 100,
+    'bikroy.spiders.extensions.pagination.SpeculativePaginationMiddleware': 40,
+    # after RetryMiddleware (550) to see failed responses, before HttpProxyMiddleware (750)
+    'bikroy.spiders.extensions.proxy_rotator.ProxyRotator': 610,
+    'bikroy.spiders.extensions.concurrency.AdaptiveConcurrency': 620,
+    # above HttpCacheMiddleware (900) so the cache stores the already truncated response
+    'bikroy.spiders.extensions.early_stop.EarlyStopMiddleware': 950,
 }
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-# }
+EXTENSIONS = {
+    #    'scrapy.extensions.telnet.TelnetConsole': None,
+    'bikroy.spiders.extensions.metrics.MetricsExtension': 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     'bikroy.pipelines.DuplicatesPipeline': 50,
+    'bikroy.pipelines.DeltaPipeline': 100,
+    'bikroy.pipelines.ImageFilesPipeline': 300,
+    'bikroy.pipelines.StreamingExportPipeline': 900,
+}
+
+# Extra formats for -o / FEEDS, e.g. -o result.ndjson
+FEED_EXPORTERS = {
+    'ndjson': 'bikroy.exporters.NdjsonItemExporter',
+    'parquet': 'bikroy.exporters.ParquetItemExporter',
+    'arrow': 'bikroy.exporters.ArrowItemExporter',
 }
 
 # Number of retries if status received from RETRY_HTTP_CODES (default: 3)
@@ -90,4 +111,183 @@ DOWNLOAD_TIMEOUT = 60
 # HTTPCACHE_EXPIRATION_SECS = 0
 # HTTPCACHE_DIR = 'httpcache'
 # HTTPCACHE_IGNORE_HTTP_CODES = []
-# HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+HTTPCACHE_STORAGE = 'bikroy.spiders.extensions.httpcache.SegmentCacheStorage'
+# SegmentCacheStorage: compressed bodies in append-only segments of this size
+# with an mmap index by canonical URL
+HTTPCACHE_SEGMENT_SIZE = 256 * 1024 * 1024
+# zstd level (zlib is used, capped at 9, when zstandard is not installed)
+HTTPCACHE_COMPRESSION_LEVEL = 3
+# Rewrite the segments on open once this share of them holds overwritten records
+HTTPCACHE_COMPACT_RATIO = 0.5
+# Lifetime per page type in seconds, 0 never expires; other requests use HTTPCACHE_EXPIRATION_SECS
+# Leaf categories known from the saved category tree are listing pages, not navigation
+HTTPCACHE_TTL_NAVIGATION = 7 * 24 * 60 * 60
+HTTPCACHE_TTL_LISTING = 60 * 60
+HTTPCACHE_TTL_PRODUCT = 0
+
+# Build items straight from category listing data and download the product
+# page only when one of LISTING_FIRST_REQUIRED_FIELDS is missing there. Listings
+# carry only updated_timestamp: add creation_timestamp (adDate) to always fetch it
+LISTING_FIRST_ENABLED = False
+LISTING_FIRST_REQUIRED_FIELDS = ['title', 'price']
+
+# Folder for the spider caches: category stats and tree, known redirects and
+# the crawl state. Defaults to bikroy/spiders/cache inside the project,
+# wherever the crawl is started from
+# SPIDER_CACHE_DIR = ''
+
+# Per-ad crawl state (SQLite, WAL) used to skip unchanged ads on recrawls.
+# Defaults to <spider name>_crawl_state.sqlite3 in SPIDER_CACHE_DIR
+# CRAWL_STATE_PATH = ''
+# Commit the state after this many ad updates or seconds, whichever comes first.
+# The time-based commit runs on a timer, so a shared database is never locked
+# for writing longer than that
+CRAWL_STATE_CHECKPOINT_ITEMS = 50
+CRAWL_STATE_CHECKPOINT_INTERVAL = 5
+
+# Export only the churn between runs: items get change_type new / changed,
+# items whose content hash matches the crawl state are dropped, and ads missing
+# from a fully traversed category are emitted as change_type=removed
+DELTA_OUTPUT_ENABLED = False
+
+# Build CompactProductItem (attrs, slots) instead of the dict-backed ProductItem:
+# interned metadata keys, photos kept as UUIDs and expanded to URLs on export.
+# Fields that were never filled are exported as null
+COMPACT_ITEMS = False
+
+# Drop product requests for ads that were already scheduled, dont_filter or not.
+# An ad counts as seen once its item is scraped; a failed product download
+# releases it. The seen ids are persisted to JOBDIR (or DEDUP_PATH) and reused
+# when the crawl is resumed
+DEDUP_ENABLED = True
+# DEDUP_PATH = ''
+# Expected number of ads; enables a Bloom filter in front of the id set
+DEDUP_BLOOM_CAPACITY = 0
+
+# Proxy pool source: a file with one proxy per line, or an environment variable
+# with comma separated proxies. Falls back to the built-in ProxyLine list
+# PROXY_POOL_FILE = 'proxies.txt'
+PROXY_POOL_ENV = 'BIKROY_PROXIES'
+
+# Give every proxy its own download slot and tune its concurrency with AIMD:
+# +1 after a window of fast successful responses, halve on 403/429/5xx/timeouts
+ADAPTIVE_CONCURRENCY_ENABLED = True
+ADAPTIVE_CONCURRENCY_START = 2
+ADAPTIVE_CONCURRENCY_MIN = 1
+ADAPTIVE_CONCURRENCY_MAX_PER_SLOT = 16
+# Responses slower than this (seconds) do not raise the concurrency
+ADAPTIVE_CONCURRENCY_TARGET_LATENCY = 3.0
+
+# Keep up to CONNECTION_POOL_MAX_PER_PROXY persistent tunnels per (proxy, host),
+# resume TLS sessions instead of full handshakes and open CONNECTION_POOL_PREWARM
+# connections through every proxy before the first request. Proxies with an idle
+# tunnel to the request host get CONNECTION_POOL_WARM_BONUS times the weight.
+# Pre-warming runs in the background through the downloader middlewares
+CONNECTION_POOL_ENABLED = False
+CONNECTION_POOL_MAX_PER_PROXY = 16
+CONNECTION_POOL_PREWARM = 2
+CONNECTION_POOL_PREWARM_URL = 'https://bikroy.com/'
+CONNECTION_POOL_PREWARM_TIMEOUT = 10
+CONNECTION_POOL_WARM_BONUS = 2.0
+DOWNLOAD_HANDLERS = {
+    'https': 'bikroy.spiders.extensions.connection_pool.PooledDownloadHandler',
+}
+DOWNLOADER_CLIENTCONTEXTFACTORY = 'bikroy.spiders.extensions.connection_pool.SessionReuseContextFactory'
+
+# Reuse the discovered category/location tree for this many seconds and go
+# straight to leaf listing pages (0 always re-crawls the navigation)
+CATEGORY_TREE_TTL = 24 * 60 * 60
+
+# Canonicalise every outgoing request (sorted query, no "www.") and remember
+# redirects the site still makes, so later requests skip them
+CANONICAL_URL_ENABLED = True
+CANONICAL_URL_LEARN_CODES = [301, 302, 303, 307, 308]
+
+# Schedule all pages of a category once page 1 tells how many there are.
+# Categories with a watermark from a previous run keep only this many pages
+# in flight; pages past the watermark are cancelled
+PAGINATION_FANOUT_ENABLED = True
+PAGINATION_SPECULATIVE_WINDOW = 5
+
+# Sharded crawling with a shared frontier (see bikroy/runner.py): how many
+# leaf categories a worker holds at once and how long a taken shard stays
+# leased before another worker may pick it up
+FRONTIER_SHARDS_IN_FLIGHT = 4
+FRONTIER_LEASE_SECONDS = 30 * 60
+
+# Decode initialData and build item fields in this many worker processes
+# instead of the reactor thread (0 parses in the crawl process). At most
+# PARSE_OFFLOAD_MAX_PENDING pages are handed to the pool at once
+# (0 means twice the number of workers)
+PARSE_OFFLOAD_WORKERS = 0
+PARSE_OFFLOAD_MAX_PENDING = 0
+
+# Streaming export (StreamingExportPipeline), off while STREAM_EXPORT_URI is
+# not set. The URI may use {spider}, {time} (crawl start, UTC) and {part}
+# STREAM_EXPORT_URI = 'output/{spider}/{time}-{part:05d}.ndjson.zst'
+# ndjson, parquet or arrow (the columnar formats need pyarrow)
+STREAM_EXPORT_FORMAT = 'ndjson'
+# gzip or zstd for ndjson (zstd needs zstandard); a parquet/arrow codec name otherwise
+STREAM_EXPORT_COMPRESSION = None
+# ndjson is written in chunks of this many bytes, columnar formats in row groups of this many items
+STREAM_EXPORT_BATCH_BYTES = 1024 * 1024
+STREAM_EXPORT_BATCH_ITEMS = 10000
+# Start a new file once the current one is this large (bytes on disk) or this old (seconds); 0 disables
+STREAM_EXPORT_ROTATE_BYTES = 512 * 1024 * 1024
+STREAM_EXPORT_ROTATE_SECONDS = 60 * 60
+
+# Download ad photos during the crawl (ImageFilesPipeline), off while
+# FILES_STORE is not set. Files are keyed by the photo UUID, so a photo
+# shared by several ads is fetched and stored once
+# FILES_STORE = 'images'
+# Photos never change under the same UUID
+FILES_EXPIRES = 10 * 365
+# Size and variant (fitted keeps the aspect ratio, cropped fills the frame)
+IMAGES_WIDTH = 780
+IMAGES_HEIGHT = 585
+IMAGES_VARIANT = 'fitted'
+# Each photo host gets its own download slot with this concurrency
+IMAGES_CONCURRENCY_PER_HOST = 8
+
+# Callback, parser step, latency and response size metrics. They are served
+# in Prometheus text format on METRICS_HOST:METRICS_PORT (0 disables the
+# endpoint) and summarised in the log and stats when the spider closes. Off by
+# default: parallel crawls would fight over one port (the runner's --metrics-port
+# gives every process its own)
+METRICS_ENABLED = False
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9410
+
+# Stop listing and product downloads as soon as the window.initialData script
+# has arrived and pass the decompressed head of the page to the callback.
+# A request can opt out with meta['dont_stop_early'] (disabled by default)
+EARLY_STOP_ENABLED = False
+# A stopped download drops its connection, and the next request pays for a new
+# tunnel and TLS handshake. Stop only if at least EARLY_STOP_MIN_SAVING bytes are
+# still to come and downloading them would take longer than opening a connection
+# (measured by the connection pool; EARLY_STOP_CONNECTION_COST seconds until then)
+EARLY_STOP_MIN_SAVING = 16 * 1024
+EARLY_STOP_CONNECTION_COST = 0.5
+
+# Products are scheduled before listing pages and listing pages before
+# category navigation. Beyond SCHEDULER_MEMORY_LIMIT queued requests the
+# lower-priority ones (below SCHEDULER_SPILL_BELOW_PRIORITY, i.e. navigation and
+# listing) spill to a disk queue: in JOBDIR when set, so the crawl can be
+# resumed, otherwise in a temporary directory (0 keeps everything in memory)
+SCHEDULER = 'bikroy.spiders.extensions.scheduler.SpillScheduler'
+SCHEDULER_MEMORY_LIMIT = 10000
+SCHEDULER_SPILL_BELOW_PRIORITY = 20
+
+# Daemon mode (-a daemon=true): the process stays up and revisits every leaf
+# category on its own schedule. After each visit the rate of new ads is
+# smoothed (EWMA with DAEMON_REVISIT_SMOOTHING) and the next visit is planned
+# for when about DAEMON_REVISIT_TARGET_ADS new ads are expected, clamped to
+# [DAEMON_REVISIT_MIN_INTERVAL, DAEMON_REVISIT_MAX_INTERVAL] seconds.
+# The category tree is re-walked every CATEGORY_TREE_TTL seconds
+DAEMON_TICK_INTERVAL = 10
+DAEMON_REVISIT_TARGET_ADS = 10
+DAEMON_REVISIT_MIN_INTERVAL = 5 * 60
+DAEMON_REVISIT_MAX_INTERVAL = 6 * 60 * 60
+DAEMON_REVISIT_SMOOTHING = 0.3
+# A visit that has not finished after this many seconds may be started again
+DAEMON_VISIT_TIMEOUT = 60 * 60
@@ -1,21 +1,34 @@
-import json
 import logging
-import re
+import os
+import socket
+import time
 from contextlib import suppress
 from functools import wraps
+from pathlib import Path
 from typing import Any, Optional
-from urllib.parse import parse_qsl, urlparse, urljoin
+from urllib.parse import urljoin
 
-import dateparser
+from itemadapter import ItemAdapter
 from price_parser import Price
 from pydispatch import dispatcher
 from scrapy import Request, Spider, signals
-from w3lib.url import url_query_parameter, add_or_replace_parameter, add_or_replace_parameters
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet.task import LoopingCall
+from w3lib.url import url_query_parameter, add_or_replace_parameter
 
 from .constants.bikroy_com import *
-from .helpers.helpers import get_url_without_query, get_latest_category_stats, \
-    save_current_category_stats
-from ..items import ProductItem
+from .helpers.crawl_state import CHANGE_CHANGED, CHANGE_NEW, CHANGE_REMOVED, CHANGE_UNCHANGED, \
+    CRAWL_STATE_FILENAME, CrawlStateStore, get_item_fingerprint
+from .helpers.frontier import Frontier, get_frontier
+from .helpers.helpers import CACHE_CATEGORY_PATH, get_url_without_query, get_latest_category_stats, \
+    get_cached_category_tree, get_known_leaf_urls, save_category_tree, get_canonical_url, ad_request_failed
+from .helpers.initial_data import extract_initial_data
+from .helpers.metrics import timed
+from .helpers.offload import ParseOffloader, extract_listing_data, extract_product_fields
+from .helpers.pagination import CategoryProgress
+from .helpers.revisit import RevisitScheduler
+from .helpers.timestamps import TimestampParser, get_timestamp_resolution
+from ..items import CompactProductItem, ProductItem
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +50,7 @@ def optional_field(default: Any = None):
 
 
 class BikroyComParser:
+    timestamp_parser = TimestampParser()
 
     def get_item_id(self, prod_data: dict) -> str:
         return prod_data['id']
@@ -59,10 +73,12 @@ class BikroyComParser:
             phone_number = f'+88{phone_number}'
         return phone_number
 
+    @timed('date_parsing')
     def get_creation_timestamp(self, prod_data: dict) -> int:
-        creation_timestamp = prod_data['adDate']
-        creation_timestamp = dateparser.parse(creation_timestamp)
-        return int(creation_timestamp.timestamp())
+        creation_timestamp = self.timestamp_parser.to_timestamp(prod_data['adDate'])
+        if creation_timestamp is None:
+            raise ValueError(f"Can't parse adDate: {prod_data['adDate']!r}")
+        return creation_timestamp
 
     @optional_field()
     def get_images(self, prod_data: dict) -> Optional[list]:
@@ -71,7 +87,8 @@ class BikroyComParser:
         # у фотографий на сайте можно указать любое желаемое
         # разрешение, по умолчанию указывается 780x585
         # есть форматы cropped.jpg и fitted.jpg (оригинальный)
-        image_urls = [f'{image_url}/780/585/fitted.jpg' for image_url in image_urls]
+        image_urls = [IMAGE_URL_TEMPLATE.format(src=image_url, width=780, height=585, variant='fitted')
+                      for image_url in image_urls]
         return image_urls
 
     @optional_field()
@@ -87,6 +104,7 @@ class BikroyComParser:
 
         return metadata
 
+    @timed('price_parsing')
     @optional_field(default=0.0)
     def get_price(self, prod_data: dict) -> float:
         price = Price.fromstring(prod_data['money']['amount'])
@@ -94,33 +112,63 @@ class BikroyComParser:
         return price
 
     @optional_field()
-    def get_address(self, item: ProductItem) -> Optional[str]:
+    def get_address(self, item: dict) -> Optional[str]:
         return item['metadata']['Address']
 
-    def get_next_page(self, response):
-        current_page = int(url_query_parameter(response.url, 'page', '1'))
-        next_page_url = add_or_replace_parameter(response.url, 'page', str(current_page + 1))
-        return next_page_url
+    @optional_field()
+    def get_listing_title(self, listing_data: dict) -> Optional[str]:
+        return listing_data['title']
 
-    def get_non_redirect_category_urls(self, category_urls: list) -> list:
+    @timed('price_parsing')
+    @optional_field()
+    def get_listing_price(self, listing_data: dict) -> Optional[float]:
+        price = listing_data['price']
+        if isinstance(price, dict):
+            price = price['amount']
+        return Price.fromstring(price).amount_float
+
+    def get_product_item_fields(self, prod_data: dict, url: str) -> dict:
+        fields = dict()
+        fields['url'] = url
+        fields['item_id'] = self.get_item_id(prod_data)
+        fields['title'] = self.get_title(prod_data)
+        fields['description'] = self.get_description(prod_data)
+        fields['creation_timestamp'] = self.get_creation_timestamp(prod_data)
+        fields['author_name'] = self.get_author_name(prod_data)
+        fields['author_phone'] = self.get_author_phone(prod_data)
+        fields['price'] = self.get_price(prod_data)
+        fields['images'] = self.get_images(prod_data)
+        fields['metadata'] = self.get_metadata(prod_data)
+        fields['address'] = self.get_address(fields)
+        return fields
+
+    def get_listing_item_fields(self, listing_data: dict, updated_timestamp: int) -> dict:
         """
-        Сайт редиректит при любом удобном случае, замедляя паука
-        в несколько раз. Нужно ставить query-params в алфавитном
-        порядке и удалять "www.", хотя сайт сам его даёт.
+        Собирает поля продукта, которые уже есть в выдаче категории.
+        Поля, которых в выдаче нет, в результат не попадают.
         """
-        result_urls = []
-        for url in category_urls:
-            parsed_url = urlparse(url)
-            captured_value = parse_qsl(parsed_url.query)
-            sorted_params = sorted(captured_value)
-            sorted_query = {key: value for key, value in sorted_params}
-
-            url_without_query = get_url_without_query(url)
-            url = add_or_replace_parameters(url_without_query, sorted_query)
-            result_urls.append(url)
+        fields = {
+            'url': urljoin(PART_PRODUCT_PAGE_URL, listing_data['slug']),
+            'item_id': self.get_item_id(listing_data),
+            'title': self.get_listing_title(listing_data),
+            'description': self.get_description(listing_data),
+            # в выдаче только время обновления объявления, adDate есть лишь на его странице
+            'updated_timestamp': updated_timestamp or None,
+            'price': self.get_listing_price(listing_data),
+            'images': self.get_images(listing_data),
+        }
+        return {field: value for field, value in fields.items() if value is not None}
+
+    def get_page_number(self, url: str) -> int:
+        return int(url_query_parameter(url, 'page', '1'))
+
+    def get_page_url(self, url: str, page: int) -> str:
+        page_url = add_or_replace_parameter(url, 'page', str(page))
+        return get_canonical_url(page_url)
 
-        result_urls = [url.replace('://www.', '://') for url in result_urls]
-        return result_urls
+    def get_non_redirect_category_urls(self, category_urls: list) -> list:
+        """Приводит ссылки к виду, на который сайт не редиректит."""
+        return [get_canonical_url(url) for url in category_urls]
 
     def get_category_urls(self, response):
         category_urls = response.xpath(CATEGORY_URLS_XPATH).getall()
@@ -134,13 +182,31 @@ class BikroyComParser:
 
         return self.get_non_redirect_category_urls(locations_url)
 
-    def has_next_page(self, json_data: dict) -> bool:
-        pagination_data = json_data['serp']['ads']['data']['paginationData']
-        current_page = pagination_data['activePage']
-        total_products = pagination_data['total']
-        page_size = pagination_data['pageSize']
-        return total_products > page_size * current_page
+    def get_category_progress(self, category_url: str, pagination_data: dict, page: int) -> CategoryProgress:
+        """Число страниц известно уже по первой из них: total и pageSize в paginationData."""
+        progress = self.category_progress.get(category_url)
+        if progress is None:
+            progress = CategoryProgress.from_pagination_data(pagination_data, scheduled_until=page)
+            self.category_progress[category_url] = progress
+        return progress
+
+    def get_pagination_window(self, category_url: str, progress: CategoryProgress) -> int:
+        """
+        Сколько страниц категории держать запланированными наперёд. При полном
+        обходе это все страницы сразу, при повторном - небольшое окно, потому что
+        обход остановится на объявлении, собранном в прошлый раз.
+        """
+        if not self.pagination_fanout:
+            return 1
+        if category_url in self.latest_category_stats:
+            return self.pagination_window
+        return progress.total_pages
+
+    def is_page_cancelled(self, request) -> bool:
+        progress = self.category_progress.get(request.meta.get('category_url'))
+        return progress is not None and progress.is_cancelled(request.meta['category_page'])
 
+    @timed('date_parsing')
     def get_product_updated_dates(self, products: list) -> list:
         """
         Возвращает время обновления продуктов в категории.
@@ -149,32 +215,77 @@ class BikroyComParser:
         result = []
         for product in products:
             try:
-                creation_date = dateparser.parse(product['timeStamp'])
-                result.append(int(creation_date.timestamp()))
-            except (AttributeError, KeyError):  # поднятые объявления не имеют даты обновления
-                result.append(0)
+                creation_timestamp = self.timestamp_parser.to_timestamp(product['timeStamp'])
+            except KeyError:  # поднятые объявления не имеют даты обновления
+                creation_timestamp = None
+            result.append(creation_timestamp or 0)
         return result
 
     def parsed_before(self, product_updated_timestamp: int, category_url: str) -> bool:
+        if not product_updated_timestamp:  # поднятое объявление ничего не говорит о порядке выдачи
+            return False
         previous_parsed_timestamp = self.latest_category_stats.get(category_url)
         if previous_parsed_timestamp:
             return previous_parsed_timestamp > product_updated_timestamp
         return False
 
-    def update_parsed_category_date(self, response, item: ProductItem):
-        category_url = response.meta.get('category_url')
-        if not category_url:
+    def is_unchanged(self, product_updated_timestamp: int, known_updated_timestamp: Optional[int]) -> bool:
+        """
+        Объявление уже собиралось и с тех пор не обновлялось. Поднятые
+        объявления (без даты обновления) считаются неизменными.
+        """
+        if known_updated_timestamp is None:
+            return False
+        if not product_updated_timestamp:
+            return True
+        resolution = get_timestamp_resolution(product_updated_timestamp)
+        return product_updated_timestamp <= known_updated_timestamp + resolution
+
+    def update_parsed_category_date(self, category_url: Optional[str], updated_timestamp: Optional[int]):
+        """
+        Отметка категории - время обновления объявления из выдачи: с ним
+        parsed_before сравнивает объявления при следующем обходе.
+        """
+        if not category_url or not updated_timestamp:
             return
 
-        creation_timestamp = item['creation_timestamp']
-
         min_parsed_category_timestamp = self.current_category_stats.get(category_url)
-        if not min_parsed_category_timestamp or creation_timestamp > min_parsed_category_timestamp:
-            self.current_category_stats[category_url] = creation_timestamp
+        if not min_parsed_category_timestamp or updated_timestamp > min_parsed_category_timestamp:
+            self.current_category_stats[category_url] = updated_timestamp
 
-    def get_json_data(self, response) -> dict:
-        json_data = re.search(r'window.initialData = ({.*})', response.text).group(1)
-        return json.loads(json_data)
+    @timed('json_extraction')
+    def get_json_data(self, body: bytes, path: tuple = ()) -> Any:
+        """Декодирует только то поддерево window.initialData, что лежит по пути path."""
+        return extract_initial_data(body, path)
+
+    def get_listing_data(self, body: bytes, listing_first: bool = False) -> dict:
+        """
+        Разбирает страницу выдачи в простые данные: пагинацию и id, slug и время
+        обновления каждого объявления (в режиме listing-first ещё и поля из выдачи).
+        Не зависит от состояния паука, поэтому может выполняться в пуле процессов.
+        """
+        try:
+            serp_data = self.get_json_data(body, SERP_DATA_PATH)
+            products = serp_data['ads']
+        except KeyError:
+            products = []
+        if not products:
+            return {'pagination': None, 'products': []}
+
+        listing_products = []
+        for product, updated_timestamp in zip(products, self.get_product_updated_dates(products)):
+            listing_product = {
+                'id': self.get_item_id(product),
+                'slug': product['slug'],
+                'updated_timestamp': updated_timestamp,
+            }
+            if listing_first:
+                listing_product['listing_fields'] = self.get_listing_item_fields(product, updated_timestamp)
+            listing_products.append(listing_product)
+        return {'pagination': serp_data['paginationData'], 'products': listing_products}
+
+    def get_product_fields(self, body: bytes, url: str) -> dict:
+        return self.get_product_item_fields(self.get_json_data(body, PRODUCT_DATA_PATH), url)
 
     def get_cleared_category_urls(self, response, category_urls: list) -> list:
         """Возвращает ссылки на все категории ниже текущей."""
@@ -191,93 +302,494 @@ class BikroyComParser:
 class BikroySpiderSpider(Spider, BikroyComParser):
     name = 'bikroy.com'
 
-    def __init__(self, start_urls=None, **kwargs):
+    def __init__(self, start_urls=None, frontier=None, role='worker', worker_id=None, daemon=None, **kwargs):
         super().__init__(**kwargs)
         self.start_urls = start_urls.split('|') if start_urls else [
             'https://bikroy.com/en/ads',  # все категории сайта
         ]
         dispatcher.connect(self.spider_closed, signals.spider_closed)
-        self.latest_category_stats = get_latest_category_stats(self.name)
+        # при шардированном запуске (см. bikroy/runner.py) категории берутся из общего фронтира
+        self.frontier: Optional[Frontier] = get_frontier(frontier) if frontier else None
+        self.role = role
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.shards_in_flight = set()
+        self.shards_limit = 1
+        self.shard_lease_seconds = 0
+        # в режиме демона процесс не завершается и сам повторяет обход категорий
+        self.daemon = str(daemon).lower() in ('1', 'true', 'yes') and self.frontier is None
+        self.revisit_scheduler: Optional[RevisitScheduler] = None
+        self.revisit_loop: Optional[LoopingCall] = None
+        self.checkpoint_loop: Optional[LoopingCall] = None
+        self.revisit_interval = 0
+        self.visit_timeout = 0
+        self.visiting: dict[str, float] = dict()
+        self.category_new_ads: dict[str, int] = dict()
+        self.category_tree_ttl = 0
+        self.category_tree_walked_at = 0.0
+        self.cache_path = CACHE_CATEGORY_PATH
+        self.crawl_state: Optional[CrawlStateStore] = None
+        self.delta_output = False
+        self.partial_categories = set()
+        self.latest_category_stats = dict()
         self.current_category_stats = dict()
-
-    def spider_closed(self, spider):
+        self.cached_category_tree = dict()
+        self.category_tree = dict()
+        self.known_leaf_urls = set()
+        self.category_progress: dict[str, CategoryProgress] = dict()
+        self.pagination_fanout = False
+        self.pagination_window = 1
+        self.listing_first = False
+        self.listing_required_fields = []
+        self.parse_offloader: Optional[ParseOffloader] = None
+        self.item_class = ProductItem
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.listing_first = crawler.settings.getbool('LISTING_FIRST_ENABLED')
+        spider.listing_required_fields = crawler.settings.getlist('LISTING_FIRST_REQUIRED_FIELDS')
+        if crawler.settings.getbool('COMPACT_ITEMS'):
+            spider.item_class = CompactProductItem
+        spider.pagination_fanout = crawler.settings.getbool('PAGINATION_FANOUT_ENABLED')
+        spider.pagination_window = crawler.settings.getint('PAGINATION_SPECULATIVE_WINDOW')
+        spider.cache_path = Path(crawler.settings.get('SPIDER_CACHE_DIR') or CACHE_CATEGORY_PATH)
+        spider.cache_path.mkdir(parents=True, exist_ok=True)
+        spider.open_crawl_state(crawler.settings)
+        crawler.signals.connect(spider.crawl_state_opened, signal=signals.spider_opened)
+        spider.delta_output = crawler.settings.getbool('DELTA_OUTPUT_ENABLED')
+        spider.shards_limit = crawler.settings.getint('FRONTIER_SHARDS_IN_FLIGHT')
+        spider.shard_lease_seconds = crawler.settings.getint('FRONTIER_LEASE_SECONDS')
+        if spider.frontier is not None:
+            crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        offload_workers = crawler.settings.getint('PARSE_OFFLOAD_WORKERS')
+        if offload_workers:
+            spider.parse_offloader = ParseOffloader(offload_workers,
+                                                    crawler.settings.getint('PARSE_OFFLOAD_MAX_PENDING'))
+
+        spider.category_tree_ttl = crawler.settings.getint('CATEGORY_TREE_TTL')
+        if spider.category_tree_ttl:
+            spider.cached_category_tree = get_cached_category_tree(spider.name, spider.category_tree_ttl,
+                                                                   spider.cache_path)
+        spider.known_leaf_urls = get_known_leaf_urls(spider.name, spider.cache_path)
+        if spider.daemon:
+            spider.open_daemon(crawler)
+        return spider
+
+    def open_daemon(self, crawler):
+        settings = crawler.settings
+        self.revisit_scheduler = RevisitScheduler(
+            target_ads=settings.getfloat('DAEMON_REVISIT_TARGET_ADS'),
+            min_interval=settings.getfloat('DAEMON_REVISIT_MIN_INTERVAL'),
+            max_interval=settings.getfloat('DAEMON_REVISIT_MAX_INTERVAL'),
+            smoothing=settings.getfloat('DAEMON_REVISIT_SMOOTHING'),
+            schedules=self.crawl_state.get_category_schedules(),
+        )
+        self.revisit_interval = settings.getfloat('DAEMON_TICK_INTERVAL')
+        self.visit_timeout = settings.getfloat('DAEMON_VISIT_TIMEOUT')
+        self.category_tree_walked_at = time.time()
+        crawler.signals.connect(self.daemon_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.daemon_idle, signal=signals.spider_idle)
+
+    def open_crawl_state(self, settings):
+        state_path = settings.get('CRAWL_STATE_PATH') or \
+            self.cache_path / CRAWL_STATE_FILENAME.format(spider_name=self.name)
+        self.crawl_state = CrawlStateStore(
+            Path(state_path),
+            checkpoint_items=settings.getint('CRAWL_STATE_CHECKPOINT_ITEMS'),
+            checkpoint_interval=settings.getfloat('CRAWL_STATE_CHECKPOINT_INTERVAL'),
+        )
+        self.latest_category_stats = self.crawl_state.get_category_watermarks()
+        if not self.latest_category_stats:
+            # при первом запуске переносим отметки из старого json-файла
+            self.latest_category_stats = get_latest_category_stats(self.name, self.cache_path)
+            self.crawl_state.save_category_watermarks(self.latest_category_stats)
+
+    def spider_closed(self, spider, reason='finished'):
         """
         При повторном запуске для ускорения работы паука сохраняем данные
-        о времени создания объявления, с которого начали парсить категорию.
+        о времени создания объявления, с которого начали парсить категорию,
+        и дерево категорий, если его удалось обойти целиком.
         """
+        # пишем только свои отметки: общую базу могут обновлять и другие воркеры
         self.latest_category_stats.update(self.current_category_stats)
-        save_current_category_stats(self.name, self.latest_category_stats)
+        if self.checkpoint_loop is not None and self.checkpoint_loop.running:
+            self.checkpoint_loop.stop()
+        self.crawl_state.save_category_watermarks(self.current_category_stats)
+        self.crawl_state.close()
+
+        if self.frontier is not None:
+            if self.is_discovery_only():
+                self.frontier.set_discovery_done()
+            self.frontier.close()
+
+        if reason == 'finished' and self.category_tree:
+            save_category_tree(self.name, self.category_tree, self.cache_path)
+
+        if self.revisit_loop is not None and self.revisit_loop.running:
+            self.revisit_loop.stop()
+
+        for stat_name, value in self.timestamp_parser.stats.items():
+            self.crawler.stats.set_value(f'timestamp_parser/{stat_name}', value)
+
+        if self.parse_offloader is not None:
+            self.crawler.stats.set_value('offload/tasks', self.parse_offloader.tasks)
+            self.parse_offloader.close()
+
+    def crawl_state_opened(self, spider):
+        # фиксируем изменения по времени, даже если новых записей нет: иначе открытая
+        # транзакция держит блокировку базы до следующего сохранения
+        self.checkpoint_loop = LoopingCall(self.crawl_state.checkpoint)
+        self.checkpoint_loop.start(self.crawl_state.checkpoint_interval, now=False).addErrback(
+            lambda failure: logger.error(f'Crawl state checkpoints stopped: {failure.getErrorMessage()}')
+        )
+
+    def is_discovery_only(self) -> bool:
+        """Процесс только обходит дерево категорий и складывает конечные категории во фронтир."""
+        return self.frontier is not None and self.role == 'discover'
+
+    def spider_idle(self, spider):
+        """Воркер берёт из фронтира новые категории и не закрывается, пока работа не кончится у всех."""
+        if self.is_discovery_only():
+            return
+
+        # раз паук простаивает, взятые категории обработаны (или не скачались)
+        for category_url in self.shards_in_flight:
+            self.frontier.done(category_url)
+        self.shards_in_flight.clear()
+
+        scheduled = False
+        for request in self.get_shard_requests():
+            self.crawler.engine.crawl(request)
+            scheduled = True
+        if scheduled or not self.frontier.is_discovery_done() or self.frontier.has_unfinished():
+            raise DontCloseSpider
+
+    def daemon_opened(self, spider):
+        self.revisit_loop = LoopingCall(self.revisit_categories)
+        self.revisit_loop.start(self.revisit_interval, now=False).addErrback(
+            lambda failure: logger.error(f'Category revisits stopped: {failure.getErrorMessage()}')
+        )
+
+    def daemon_idle(self, spider):
+        raise DontCloseSpider
+
+    def revisit_categories(self):
+        """Ставит в очередь категории, которым пора на повторный обход, и раз в CATEGORY_TREE_TTL - дерево категорий."""
+        now = time.time()
+        for category_url in self.revisit_scheduler.get_due(now):
+            if now - self.visiting.get(category_url, 0) < self.visit_timeout:
+                continue
+            self.start_category_visit(category_url, now)
+            self.crawler.stats.inc_value('daemon/revisits')
+            self.crawler.engine.crawl(Request(url=category_url, callback=self.parse, errback=self.listing_failed,
+                                              dont_filter=True, priority=LISTING_PRIORITY,
+                                              meta={'category_url': category_url}))
+
+        if self.category_tree_ttl and now - self.category_tree_walked_at > self.category_tree_ttl:
+            self.category_tree_walked_at = now
+            for url in self.start_urls:
+                if not self.is_product_url(url):
+                    self.crawler.engine.crawl(Request(url=url, callback=self.parse_categories, dont_filter=True,
+                                                      priority=NAVIGATION_PRIORITY, meta={'start_url': url}))
+
+    def finish_category_visit(self, category_url: str):
+        """Запоминает, сколько новых объявлений принёс обход, и назначает следующий."""
+        now = time.time()
+        previous_watermark = self.latest_category_stats.get(category_url)
+        new_ads = self.category_new_ads.pop(category_url, 0)
+        schedule = self.revisit_scheduler.record_visit(category_url, new_ads, now, since=previous_watermark)
+        self.crawl_state.save_category_schedule(category_url, schedule)
+        self.visiting.pop(category_url, None)
+
+        # следующий обход остановится на объявлениях, собранных в этот раз
+        current_watermark = self.current_category_stats.get(category_url)
+        if current_watermark:
+            self.latest_category_stats[category_url] = current_watermark
+            self.crawl_state.save_category_watermarks({category_url: current_watermark})
+        logger.debug(f'{new_ads} new ads in {category_url}, next visit in {schedule.next_visit - now:.0f}s')
+
+    def is_visit_due(self, category_url: str) -> bool:
+        """В режиме демона категории, которым ещё рано на обход, только регистрируются."""
+        if not self.daemon:
+            return True
+        now = time.time()
+        if category_url not in self.revisit_scheduler:
+            self.revisit_scheduler.add(category_url, now)
+        if not self.revisit_scheduler.is_due(category_url, now):
+            return False
+        self.start_category_visit(category_url, now)
+        return True
+
+    def start_category_visit(self, category_url: str, now: float):
+        """Прогресс прошлого обхода уже завершён: с ним новый обход не поставил бы ни одной страницы."""
+        self.visiting[category_url] = now
+        self.category_progress.pop(category_url, None)
+
+    def get_shard_requests(self):
+        while len(self.shards_in_flight) < self.shards_limit:
+            category_url = self.frontier.pop(self.worker_id, self.shard_lease_seconds)
+            if category_url is None:
+                return
+            self.shards_in_flight.add(category_url)
+            yield Request(url=category_url, callback=self.parse, errback=self.listing_failed, dont_filter=True,
+                          priority=LISTING_PRIORITY, meta={'category_url': category_url})
+
+    def get_leaf_category_requests(self, category_urls):
+        if self.is_discovery_only():
+            self.frontier.push(category_urls)
+            return
+        for category_url in category_urls:
+            if not self.is_visit_due(category_url):
+                continue
+            yield Request(url=category_url, callback=self.parse, errback=self.listing_failed, priority=LISTING_PRIORITY,
+                          meta={'category_url': category_url})
 
     def start_requests(self):
+        if self.frontier is not None and not self.is_discovery_only():
+            yield from self.get_shard_requests()
+            return
+
         for url in self.start_urls:
             if self.is_product_url(url):
-                yield Request(url=url, callback=self.parse_product)
+                yield Request(url=url, callback=self.parse_product, priority=PRODUCT_PRIORITY)
+            elif url in self.cached_category_tree:
+                # дерево категорий недавно обходили, сразу идём в конечные категории
+                yield from self.get_leaf_category_requests(self.cached_category_tree[url])
             else:
-                yield Request(url=url, callback=self.parse_categories)
+                yield Request(url=url, callback=self.parse_categories, priority=NAVIGATION_PRIORITY,
+                              meta={'start_url': url})
 
     def parse_categories(self, response):
 
+        meta = {'start_url': response.meta.get('start_url')}
+
         category_urls = self.get_category_urls(response)
         category_urls = self.get_cleared_category_urls(response, category_urls)
         if category_urls:
-            for url in category_urls:
-                yield Request(url=url, callback=self.parse_categories, dont_filter=True)
-            return
+            return self.get_category_requests(category_urls, meta)
 
         city_urls = self.get_location_urls(response)
         city_urls = self.get_cleared_category_urls(response, city_urls)
         if city_urls:
-            for url in city_urls:
-                yield Request(url=url, callback=self.parse_categories, dont_filter=True)
-            return
-
-        yield Request(url=response.url, callback=self.parse, dont_filter=True, meta={'category_url': response.url})
+            return self.get_category_requests(city_urls, meta)
+
+        # конечная категория: это уже первая страница выдачи, качать её второй раз незачем
+        self.category_tree.setdefault(meta['start_url'], set()).add(response.url)
+        self.known_leaf_urls.add(response.url)
+        if self.is_discovery_only():
+            self.frontier.push([response.url])
+            return []
+        if not self.is_visit_due(response.url):
+            return []
+        response.meta['category_url'] = response.url
+        return self.parse(response)
+
+    def get_category_requests(self, urls, meta: dict) -> list:
+        # конечная категория - первая страница выдачи, HTTP-кеш должен хранить её как выдачу
+        return [Request(url=url, callback=self.parse_categories, dont_filter=True, priority=NAVIGATION_PRIORITY,
+                        meta={**meta, 'leaf_category': True} if url in self.known_leaf_urls else meta)
+                for url in urls]
 
     def parse(self, response):
-        json_data = self.get_json_data(response)
-        try:
-            products = json_data['serp']['ads']['data']['ads']
-        except KeyError:
-            products = []
+        if self.parse_offloader is not None:
+            return self.parse_offloaded(response, self.parse_listing_data,
+                                        extract_listing_data, response.body, self.listing_first)
+        return self.parse_listing_data(response, self.get_listing_data(response.body, self.listing_first))
+
+    async def parse_offloaded(self, response, callback, func, *args) -> list:
+        """Ждёт результат тяжёлой части разбора из пула процессов и дальше обрабатывает его как обычно."""
+        data = await self.parse_offloader.run(func, *args)
+        return list(callback(response, data))
+
+    def parse_listing_data(self, response, listing_data: dict):
+        category_url = response.meta['category_url']
+        page = self.get_page_number(response.url)
+        products = listing_data['products']
 
         if not products:
             logger.debug(f'Empty category page: {response.url}')
+            progress = self.category_progress.setdefault(category_url, CategoryProgress(page, scheduled_until=page))
+            progress.stop(page)
+            yield from self.mark_page_parsed(category_url, progress, page)
             return
 
-        category_url = response.meta['category_url']
-        products_updated_dates = self.get_product_updated_dates(products)
+        progress = self.get_category_progress(category_url, listing_data['pagination'], page)
+        if progress.is_cancelled(page):
+            logger.debug(f'Page after parsed before: {response.url}')
+            return
 
-        for product, product_updated_timestamp in zip(products, products_updated_dates):
-            if self.parsed_before(product_updated_timestamp, category_url):
-                logger.debug(f'Parsed before: {response.url}')
-                return
+        known_updated_dates = self.crawl_state.get_ads_updated_timestamps(product['id'] for product in products)
+        if self.delta_output:
+            self.crawl_state.mark_ads_seen(product['id'] for product in products)
+
+        stop_index = next((index for index, product in enumerate(products)
+                           if self.parsed_before(product['updated_timestamp'], category_url)), None)
+        if stop_index is not None:
+            logger.debug(f'Parsed before: {response.url}')
+            progress.stop(page)
+            products = products[:stop_index]
+            self.partial_categories.add(category_url)
+        else:
+            window = self.get_pagination_window(category_url, progress)
+            # демон обходит те же страницы повторно, дубль-фильтр их уже видел
+            for next_page in progress.get_pages_to_schedule(page, window):
+                yield Request(url=self.get_page_url(response.url, next_page), callback=self.parse,
+                              errback=self.listing_failed, priority=LISTING_PRIORITY, dont_filter=self.daemon,
+                              meta={'category_url': category_url, 'category_page': next_page})
+
+        if self.daemon:
+            new_ads = sum(1 for product in products if product['updated_timestamp'])
+            self.category_new_ads[category_url] = self.category_new_ads.get(category_url, 0) + new_ads
+
+        for product in products:
+            product_updated_timestamp = product['updated_timestamp']
+            known_updated_timestamp = known_updated_dates.get(product['id'])
+            if self.is_unchanged(product_updated_timestamp, known_updated_timestamp):
+                self.crawler.stats.inc_value('crawl_state/skipped_unchanged')
+                continue
+
+            meta = {
+                'category_url': category_url,
+                'updated_timestamp': product_updated_timestamp,
+                'ad_id': product['id'],
+            }
+            if known_updated_timestamp is not None:
+                # объявление уже собирали, но оно изменилось: AdDedupMiddleware пропустит его снова
+                meta['ad_changed'] = True
+            if self.listing_first:
+                listing_fields = product['listing_fields']
+                if self.has_required_fields(listing_fields):
+                    item = self.item_class(listing_fields)
+                    self.record_fields_provenance('listing', listing_fields)
+                    self.update_parsed_category_date(category_url, product_updated_timestamp)
+                    self.remember_item(response.meta, item, product_updated_timestamp)
+                    yield item
+                    continue
+                meta['listing_fields'] = listing_fields
 
             slug = product['slug']
             url = urljoin(PART_PRODUCT_PAGE_URL, slug)
-            yield Request(url=url, callback=self.parse_product, meta={'category_url': category_url})
+            # адрес изменившегося объявления дубль-фильтр уже видел (с JOBDIR - и в прошлых запусках)
+            yield Request(url=url, callback=self.parse_product, errback=self.product_failed,
+                          priority=PRODUCT_PRIORITY, meta=meta, dont_filter=known_updated_timestamp is not None)
 
-        if self.has_next_page(json_data):
-            next_page_url = self.get_next_page(response)
-            yield Request(url=next_page_url, callback=self.parse,
-                          meta={'category_url': category_url})
-        else:
-            logger.debug(f'Last category page: {response.url}')
+        yield from self.mark_page_parsed(category_url, progress, page)
+
+    def mark_page_parsed(self, category_url: str, progress: CategoryProgress, page: int) -> list:
+        if progress.mark_parsed(page):
+            logger.debug(f'Category finished on page {progress.last_page}: {category_url}')
+            return self.category_finished(category_url)
+        return []
+
+    def category_finished(self, category_url: str) -> list:
+        """
+        Вызывается один раз, когда разобраны все нужные страницы категории.
+        Возвращает отметки о снятых объявлениях, если они нужны.
+        """
+        self.crawler.stats.inc_value('pagination/categories_finished')
+        removed_items = self.get_removed_items(category_url) if self.delta_output else []
+        if self.daemon:
+            self.finish_category_visit(category_url)
+        if category_url in self.shards_in_flight:
+            self.shards_in_flight.discard(category_url)
+            self.frontier.done(category_url)
+        return removed_items
+
+    def get_removed_items(self, category_url: str) -> list:
+        """
+        Объявления категории, которых не было в выдаче за этот обход, сняты с сайта.
+        Это известно только после полного обхода: повторный останавливается
+        на объявлениях, собранных в прошлый раз.
+        """
+        if category_url in self.partial_categories:
+            self.partial_categories.discard(category_url)
+            return []
+
+        traversal_started_at = int(self.visiting.get(category_url) or self.crawl_state.opened_at)
+        unseen_ads = self.crawl_state.count_category_ads(category_url, seen_before=traversal_started_at)
+        if not unseen_ads:
+            return []
+        if unseen_ads == self.crawl_state.count_category_ads(category_url):
+            # пустая выдача скорее значит, что сайт отдал не ту страницу, чем что сняли всё
+            logger.warning(f'No known ads found in {category_url}, skipping removed ads detection')
+            return []
+
+        item_ids = self.crawl_state.pop_unseen_ads(category_url, seen_before=traversal_started_at)
+        logger.debug(f'{len(item_ids)} ads removed from {category_url}')
+        return [self.item_class(item_id=item_id, change_type=CHANGE_REMOVED) for item_id in item_ids]
+
+    def listing_failed(self, failure):
+        """
+        Страница выдачи не скачалась и после повторов: считаем её разобранной,
+        иначе категория не завершится. Такой обход неполный, снятые объявления
+        по нему не ищутся. Отменённые страницы после собранного в прошлый раз не в счёт.
+        """
+        meta = failure.request.meta
+        category_url = meta['category_url']
+        page = meta.get('category_page') or self.get_page_number(failure.request.url)
+        progress = self.category_progress.setdefault(category_url, CategoryProgress(page, scheduled_until=page))
+        if progress.is_cancelled(page):
+            return []
+        logger.warning(f'Category page failed: {failure.request.url} ({failure.getErrorMessage()})')
+        self.crawler.stats.inc_value('pagination/failed_pages')
+        self.partial_categories.add(category_url)
+        return self.mark_page_parsed(category_url, progress, page)
+
+    def product_failed(self, failure):
+        """Продукт не скачался: объявление снимается с учёта AdDedupMiddleware, его можно запланировать снова."""
+        self.crawler.signals.send_catch_log(signal=ad_request_failed, ad_id=failure.request.meta['ad_id'], spider=self)
 
     def parse_product(self, response):
-        json_data = self.get_json_data(response)
-        product_data = json_data['adDetail']['data']['ad']
-
-        item = ProductItem()
-        item['url'] = response.url
-        item['item_id'] = self.get_item_id(product_data)
-        item['title'] = self.get_title(product_data)
-        item['description'] = self.get_description(product_data)
-        item['creation_timestamp'] = self.get_creation_timestamp(product_data)
-        item['author_name'] = self.get_author_name(product_data)
-        item['author_phone'] = self.get_author_phone(product_data)
-        item['price'] = self.get_price(product_data)
-        item['images'] = self.get_images(product_data)
-        item['metadata'] = self.get_metadata(product_data)
-        item['address'] = self.get_address(item)
-        self.update_parsed_category_date(response, item)
+        if self.parse_offloader is not None:
+            return self.parse_offloaded(response, self.parse_product_fields,
+                                        extract_product_fields, response.body, response.url)
+        return self.parse_product_fields(response, self.get_product_fields(response.body, response.url))
+
+    def parse_product_fields(self, response, product_fields: dict):
+        item = self.item_class(product_fields)
+
+        listing_fields = response.meta.get('listing_fields')
+        if listing_fields is not None:
+            self.merge_listing_fields(item, listing_fields)
+
+        updated_timestamp = response.meta.get('updated_timestamp')
+        if updated_timestamp:
+            ItemAdapter(item)['updated_timestamp'] = updated_timestamp
+
+        self.update_parsed_category_date(response.meta.get('category_url'), updated_timestamp)
+        self.remember_item(response.meta, item, updated_timestamp)
         yield item
+
+    def remember_item(self, meta: dict, item: ProductItem, updated_timestamp: Optional[int]):
+        """Запоминает объявление, чтобы при следующих запусках не скачивать его, пока оно не обновится."""
+        adapter = ItemAdapter(item)
+        updated_timestamp = updated_timestamp or adapter.get('creation_timestamp') or 0
+        content_hash = get_item_fingerprint(item)
+        if self.delta_output:
+            adapter['change_type'] = self.get_change_type(adapter['item_id'], content_hash)
+        self.crawl_state.save_ad(adapter['item_id'], updated_timestamp, content_hash, meta.get('category_url'))
+
+    def get_change_type(self, item_id: str, content_hash: str) -> str:
+        previous_content_hash = self.crawl_state.get_content_hash(item_id)
+        if previous_content_hash is None:
+            return CHANGE_NEW
+        if previous_content_hash == content_hash:
+            return CHANGE_UNCHANGED
+        return CHANGE_CHANGED
+
+    def has_required_fields(self, listing_fields: dict) -> bool:
+        return all(field in listing_fields for field in self.listing_required_fields)
+
+    def merge_listing_fields(self, item: ProductItem, listing_fields: dict):
+        """Дополняет продукт полями из выдачи, которых не нашлось на странице продукта."""
+        adapter = ItemAdapter(item)
+        product_fields = [field for field, value in adapter.items() if value is not None]
+        listing_only_fields = {field: value for field, value in listing_fields.items()
+                               if adapter.get(field) is None}
+        adapter.update(listing_only_fields)
+        self.record_fields_provenance('product', product_fields)
+        self.record_fields_provenance('listing', listing_only_fields)
+
+    def record_fields_provenance(self, source: str, fields):
+        for field in fields:
+            self.crawler.stats.inc_value(f'provenance/{source}/{field}')
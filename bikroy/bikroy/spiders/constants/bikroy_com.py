@@ -2,5 +2,17 @@ DOMAIN = "https://www.bikroy.com"
 
 PART_PRODUCT_PAGE_URL = 'https://bikroy.com/en/ad/'
 
+# src фотографии заканчивается её UUID, размер и вариант (fitted/cropped) дописываются в конец
+IMAGE_URL_TEMPLATE = '{src}/{width}/{height}/{variant}.jpg'
+IMAGE_UUID_RE = r'/([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(?=/|$)'
+
 CATEGORY_URLS_XPATH = "(//div[contains(@id, 'collapsible-content')])[1]//a/@href"
 REGION_URLS_XPATH = "(//div[contains(@id, 'collapsible-content')])[2]//a/@href"
+
+SERP_DATA_PATH = ('serp', 'ads', 'data')
+PRODUCT_DATA_PATH = ('adDetail', 'data', 'ad')
+
+# приоритеты запросов: сначала продукты, затем выдача, обход дерева категорий в последнюю очередь
+NAVIGATION_PRIORITY = 0
+LISTING_PRIORITY = 10
+PRODUCT_PRIORITY = 20
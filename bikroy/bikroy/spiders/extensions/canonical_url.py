@@ -0,0 +1,118 @@
+import json
+import logging
+from json import JSONDecodeError
+from pathlib import Path
+
+from scrapy import Request, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+
+from ..helpers.helpers import CACHE_CATEGORY_PATH, get_canonical_url
+
+logger = logging.getLogger(__name__)
+
+REDIRECTS_FILENAME = '{spider_name}_redirects.json'
+MAX_REDIRECT_HOPS = 10
+
+
+class CanonicalUrlMiddleware:
+    """
+    Приводит каждый запрос паука к каноническому виду (см. get_canonical_url)
+    и запоминает редиректы, которые сайт всё равно делает: source -> target
+    сохраняется между запусками, и следующий запрос сразу уходит на target.
+    Это spider middleware: адрес меняется до того, как запрос попадёт
+    в планировщик, поэтому запрос не проходит планировщик и дубль-фильтр
+    второй раз. Редиректы узнаются по meta['redirect_urls'] ответа, который
+    дошёл до паука.
+    """
+
+    def __init__(self, crawler: Crawler):
+        self.stats = crawler.stats
+        self.learn_codes = {int(code) for code in crawler.settings.getlist('CANONICAL_URL_LEARN_CODES')}
+        self.cache_path = Path(crawler.settings.get('SPIDER_CACHE_DIR') or CACHE_CATEGORY_PATH)
+        self.redirects_path = None
+        # канонический source -> [канонический target, сколько редиректов было в цепочке]
+        self.redirects: dict[str, list] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        if not crawler.settings.getbool('CANONICAL_URL_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.redirects_path = self.cache_path / REDIRECTS_FILENAME.format(spider_name=spider.name)
+        self.redirects = self.load_redirects(self.redirects_path)
+        logger.debug(f'Loaded {len(self.redirects)} known redirects from {self.redirects_path}')
+
+    def spider_closed(self, spider):
+        self.redirects_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.redirects_path, 'w') as file:
+            file.write(json.dumps(self.redirects))
+
+    @staticmethod
+    def load_redirects(path: Path) -> dict:
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except OSError as e:
+            logger.debug(f"Can't open {path}: {e}")
+        except JSONDecodeError as e:
+            logger.debug(f"Can't load data from {path}: {e}")
+        return dict()
+
+    def process_spider_input(self, response, spider):
+        self.learn_redirects(response.request)
+
+    def process_spider_output(self, response, result, spider):
+        for entry in result:
+            yield self.canonicalize(entry, spider) if isinstance(entry, Request) else entry
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            yield self.canonicalize(request, spider)
+
+    def canonicalize(self, request: Request, spider) -> Request:
+        canonical_url = get_canonical_url(request.url)
+        url, hops = self.resolve(canonical_url)
+        if url == request.url:
+            return request
+
+        if canonical_url != request.url:
+            self.stats.inc_value('canonical_url/canonicalized', spider=spider)
+        if hops:
+            self.stats.inc_value('canonical_url/redirects_avoided', spider=spider)
+            self.stats.inc_value('canonical_url/round_trips_saved', hops, spider=spider)
+        return request.replace(url=url)
+
+    def resolve(self, url: str) -> tuple[str, int]:
+        """Проходит по известным редиректам и возвращает конечный адрес и число сэкономленных запросов."""
+        total_hops = 0
+        for _ in range(MAX_REDIRECT_HOPS):
+            redirect = self.redirects.get(url)
+            if redirect is None:
+                break
+            url, hops = redirect
+            total_hops += hops
+        return url, total_hops
+
+    def learn_redirects(self, request):
+        redirect_urls = request.meta.get('redirect_urls')
+        if not redirect_urls:
+            return
+
+        # redirect_reasons есть не во всех версиях Scrapy, без них учим все редиректы
+        reasons = request.meta.get('redirect_reasons') or [None] * len(redirect_urls)
+        target_url = get_canonical_url(request.url)
+        for position, (source_url, reason) in enumerate(zip(redirect_urls, reasons)):
+            if reason is not None and reason not in self.learn_codes:
+                continue
+            source_url = get_canonical_url(source_url)
+            if source_url == target_url or self.redirects.get(source_url, [None])[0] == target_url:
+                continue
+            self.redirects[source_url] = [target_url, len(redirect_urls) - position]
+            self.stats.inc_value('canonical_url/redirects_learned')
@@ -0,0 +1,137 @@
+import logging
+import time
+
+from scrapy.core.downloader import Slot
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from twisted.internet.error import ConnectionRefusedError, TCPTimedOutError, TimeoutError
+
+from .proxy_rotator import BAN_HTTP_CODES, ERROR_HTTP_CODES, get_proxy_label
+
+logger = logging.getLogger(__name__)
+
+PROXY_SLOT_PREFIX = 'proxy:'
+OVERLOAD_EXCEPTIONS = (TimeoutError, TCPTimedOutError, ConnectionRefusedError)
+
+
+class SlotController:
+    """AIMD для одного слота: +1 за окно успешных ответов, вдвое меньше при перегрузке."""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self.successes = 0
+        self.last_decrease = 0.0
+
+    def on_success(self) -> bool:
+        self.successes += 1
+        if self.successes < self.concurrency:
+            return False
+        self.successes = 0
+        return True
+
+    def on_overload(self, min_concurrency: int, hold_time: float) -> bool:
+        """
+        Уменьшает параллельность не чаще раза в hold_time: запросы, ушедшие
+        до прошлого снижения, ещё возвращают ошибки и не должны ронять его дальше.
+        """
+        self.successes = 0
+        now = time.monotonic()
+        if now - self.last_decrease < hold_time or self.concurrency <= min_concurrency:
+            return False
+        self.concurrency = max(min_concurrency, self.concurrency // 2)
+        self.last_decrease = now
+        return True
+
+
+class AdaptiveConcurrency:
+    """
+    Даёт каждой прокси свой слот загрузчика вместо общего слота домена
+    и подбирает параллельность каждого слота отдельно: растит её, пока
+    ответы быстрые и без ошибок, и резко снижает на 429/403, 5xx и таймаутах.
+    Сумма по слотам не превышает CONCURRENT_REQUESTS.
+    Должен стоять после ProxyRotator, чтобы прокси уже была выбрана.
+    """
+
+    def __init__(self, crawler: Crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.total_limit = settings.getint('CONCURRENT_REQUESTS')
+        self.start_concurrency = settings.getint('ADAPTIVE_CONCURRENCY_START')
+        self.min_concurrency = settings.getint('ADAPTIVE_CONCURRENCY_MIN')
+        self.max_concurrency = settings.getint('ADAPTIVE_CONCURRENCY_MAX_PER_SLOT')
+        self.target_latency = settings.getfloat('ADAPTIVE_CONCURRENCY_TARGET_LATENCY')
+        self.controllers: dict[str, SlotController] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        if not crawler.settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        proxy = request.meta.get('proxy')
+        slot_key = request.meta.get('download_slot')
+        # повтор мог уйти через другую прокси, тогда и слот нужен другой
+        if not proxy or (slot_key and not slot_key.startswith(PROXY_SLOT_PREFIX)):
+            return
+
+        slot_key = f'{PROXY_SLOT_PREFIX}{get_proxy_label(proxy)}'
+        request.meta['download_slot'] = slot_key
+        self.ensure_slot(slot_key)
+
+    def ensure_slot(self, slot_key: str):
+        controller = self.controllers.get(slot_key)
+        if controller is None:
+            controller = self.controllers[slot_key] = SlotController(self.start_concurrency)
+
+        downloader = self.crawler.engine.downloader
+        if slot_key not in downloader.slots:  # простаивающие слоты загрузчик удаляет
+            delay = self.crawler.settings.getfloat('DOWNLOAD_DELAY')
+            downloader.slots[slot_key] = Slot(controller.concurrency, delay, downloader.randomize_delay)
+
+    def process_response(self, request, response, spider):
+        slot_key = request.meta.get('download_slot')
+        if slot_key not in self.controllers:
+            return response
+
+        if response.status in BAN_HTTP_CODES or response.status in ERROR_HTTP_CODES:
+            self.decrease(slot_key, request)
+        elif request.meta.get('download_latency', 0) <= self.target_latency:
+            self.increase(slot_key)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        slot_key = request.meta.get('download_slot')
+        if slot_key in self.controllers and isinstance(exception, OVERLOAD_EXCEPTIONS):
+            self.decrease(slot_key, request)
+
+    def increase(self, slot_key: str):
+        controller = self.controllers[slot_key]
+        if not controller.on_success() or controller.concurrency >= self.max_concurrency:
+            return
+        if self.get_total_concurrency() >= self.total_limit:
+            return
+
+        controller.concurrency += 1
+        self.apply(slot_key)
+        self.stats.inc_value('concurrency/increases')
+
+    def decrease(self, slot_key: str, request):
+        controller = self.controllers[slot_key]
+        hold_time = max(request.meta.get('download_latency', 0), 1.0)
+        if controller.on_overload(self.min_concurrency, hold_time):
+            self.apply(slot_key)
+            self.stats.inc_value('concurrency/decreases')
+            logger.debug(f'Concurrency of {slot_key} lowered to {controller.concurrency}')
+
+    def apply(self, slot_key: str):
+        concurrency = self.controllers[slot_key].concurrency
+        slot = self.crawler.engine.downloader.slots.get(slot_key)
+        if slot is not None:
+            slot.concurrency = concurrency
+        self.stats.set_value(f'concurrency/{slot_key}', concurrency)
+        self.stats.set_value('concurrency/total', self.get_total_concurrency())
+
+    def get_total_concurrency(self) -> int:
+        return sum(controller.concurrency for controller in self.controllers.values())
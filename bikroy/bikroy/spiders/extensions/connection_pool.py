@@ -0,0 +1,231 @@
+import logging
+import time
+import weakref
+from typing import Optional
+
+from OpenSSL import SSL
+from scrapy import Request, signals
+from scrapy.core.downloader.contextfactory import ScrapyClientContextFactory
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.core.downloader.tls import ScrapyClientTLSOptions
+from scrapy.crawler import Crawler
+from twisted.web.client import HTTPConnectionPool
+
+from .proxy_rotator import ProxyRotator
+
+logger = logging.getLogger(__name__)
+
+# Twisted даёт каждому контексту случайный id, а Scrapy создаёт контекст на каждое
+# соединение: с разными id OpenSSL не отдаст сессию другому соединению
+SESSION_ID_CONTEXT = b'bikroy'
+# ключ соединения через CONNECT-туннель: (scheme, host, port, proxy host, proxy port, Proxy-Authorization)
+TUNNEL_KEY_LENGTH = 6
+# соединение закрыто через close_notify: OpenSSL не забыл его сессию и её можно возобновить
+CLEAN_SHUTDOWN = SSL.SENT_SHUTDOWN | SSL.RECEIVED_SHUTDOWN
+
+
+class Average:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+
+    @property
+    def value(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+
+class TlsSessionCache:
+    """
+    Последняя TLS-сессия по каждому хосту: новое соединение к хосту
+    предлагает её серверу и проходит сокращённое рукопожатие.
+    Сессию забираем только у соединения, закрытого через close_notify:
+    в TLS 1.3 билет для возобновления приходит после рукопожатия, а сессию
+    соединения, оборванного без close_notify, OpenSSL возобновлять не даёт.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats
+        self.sessions: dict[str, SSL.Session] = {}
+        # соединения, оборванные без close_notify, исчезают отсюда вместе с протоколом
+        self.connections: dict[str, weakref.WeakSet] = {}
+        self.handshake_time = Average()
+        self.offered_handshake_time = Average()
+
+    def get(self, hostname: str) -> Optional[SSL.Session]:
+        connections = self.connections.get(hostname, ())
+        for connection in [connection for connection in connections if connection.get_shutdown() & CLEAN_SHUTDOWN]:
+            session = connection.get_session()
+            if session is not None:
+                self.sessions[hostname] = session
+            connections.discard(connection)
+        return self.sessions.get(hostname)
+
+    def handshake_done(self, hostname: str, connection: SSL.Connection, duration: float, offered: bool):
+        self.connections.setdefault(hostname, weakref.WeakSet()).add(connection)
+        # принял ли сервер сессию, публичный API pyOpenSSL не говорит, считаем предложенные
+        average = self.offered_handshake_time if offered else self.handshake_time
+        average.add(duration)
+        if self.stats is not None:
+            self.stats.inc_value('tls/sessions_offered' if offered else 'tls/handshakes')
+            self.stats.set_value('tls/offered_handshake_ms_avg' if offered else 'tls/handshake_ms_avg',
+                                 round(average.value * 1000))
+
+
+class SessionReuseTLSOptions(ScrapyClientTLSOptions):
+    def __init__(self, hostname: str, ctx, sessions: TlsSessionCache, verbose_logging: bool = False):
+        super().__init__(hostname, ctx, verbose_logging=verbose_logging)
+        self.sessions = sessions
+        self.started_at = None
+        self.session_offered = False
+
+    def clientConnectionForTLS(self, tlsProtocol):
+        connection = super().clientConnectionForTLS(tlsProtocol)
+        session = self.sessions.get(self._hostnameASCII)
+        if session is not None:
+            connection.set_session(session)
+        self.session_offered = session is not None
+        self.started_at = time.monotonic()
+        return connection
+
+    def _identityVerifyingInfoCallback(self, connection, where, ret):
+        super()._identityVerifyingInfoCallback(connection, where, ret)
+        if where & SSL.SSL_CB_HANDSHAKE_DONE and self.started_at is not None:
+            self.sessions.handshake_done(self._hostnameASCII, connection, time.monotonic() - self.started_at,
+                                         self.session_offered)
+            self.started_at = None
+
+
+class SessionReuseContextFactory(ScrapyClientContextFactory):
+    """
+    Контекст TLS Scrapy, который возобновляет сессии с хостом вместо полного
+    рукопожатия (CONNECTION_POOL_ENABLED) и считает рукопожатия в статистике.
+    Ставится в DOWNLOADER_CLIENTCONTEXTFACTORY.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sessions = TlsSessionCache()
+        self.enabled = False
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler, method=SSL.SSLv23_METHOD, *args, **kwargs):
+        factory = cls.from_settings(crawler.settings, method, *args, **kwargs)
+        factory.sessions.stats = crawler.stats
+        factory.enabled = crawler.settings.getbool('CONNECTION_POOL_ENABLED')
+        return factory
+
+    def getContext(self, hostname=None, port=None):
+        context = super().getContext(hostname, port)
+        if self.enabled:
+            context.set_session_id(SESSION_ID_CONTEXT)
+        return context
+
+    def creatorForNetloc(self, hostname, port):
+        if not self.enabled:
+            return super().creatorForNetloc(hostname, port)
+        return SessionReuseTLSOptions(hostname.decode('ascii'), self.getContext(), self.sessions,
+                                      verbose_logging=self.tls_verbose_logging)
+
+
+class WarmConnectionPool(HTTPConnectionPool):
+    """
+    Пул постоянных соединений, который считает новые соединения и знает, где есть простаивающие.
+    Среднее время соединения сразу попадает в статистику: по нему ранняя остановка решает,
+    стоит ли обрывать загрузку.
+    """
+
+    def __init__(self, reactor, stats):
+        super().__init__(reactor, persistent=True)
+        self.stats = stats
+        self.connect_time = Average()
+
+    def getConnection(self, key, endpoint):
+        self.stats.inc_value('connection_pool/requests')
+        return super().getConnection(key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        self.stats.inc_value('connection_pool/new')
+        started_at = time.monotonic()
+        deferred = super()._newConnection(key, endpoint)
+
+        def connected(protocol):
+            self.connect_time.add(time.monotonic() - started_at)
+            self.stats.set_value('connection_pool/connect_ms_avg', round(self.connect_time.value * 1000))
+            return protocol
+
+        return deferred.addCallback(connected)
+
+    def get_warm_proxies(self, host: str) -> set:
+        """Адреса прокси (host:port), у которых есть простаивающий туннель к host."""
+        host = host.encode('ascii')
+        return {f'{key[3]}:{key[4]}' for key, connections in self._connections.items()
+                if connections and len(key) == TUNNEL_KEY_LENGTH and key[1] == host}
+
+
+class PooledDownloadHandler(HTTP11DownloadHandler):
+    """
+    Обработчик https, который держит до CONNECTION_POOL_MAX_PER_PROXY
+    постоянных туннелей на каждую пару (прокси, хост), при открытии паука
+    заранее, не задерживая первые запросы, открывает по CONNECTION_POOL_PREWARM
+    соединений через каждую прокси и подсказывает ProxyRotator, у каких прокси есть свободный
+    прогретый туннель. Без CONNECTION_POOL_ENABLED работает как обычный HTTP11.
+    """
+
+    def __init__(self, settings, crawler: Crawler = None):
+        super().__init__(settings, crawler)
+        self.enabled = crawler is not None and settings.getbool('CONNECTION_POOL_ENABLED')
+        if not self.enabled:
+            return
+
+        from twisted.internet import reactor
+        self.stats = crawler.stats
+        self._pool = WarmConnectionPool(reactor, crawler.stats)
+        self._pool.maxPersistentPerHost = settings.getint('CONNECTION_POOL_MAX_PER_PROXY')
+        self._pool._factory.noisy = False
+        self.prewarm_count = settings.getint('CONNECTION_POOL_PREWARM')
+        self.prewarm_url = settings.get('CONNECTION_POOL_PREWARM_URL')
+        self.prewarm_timeout = settings.getfloat('CONNECTION_POOL_PREWARM_TIMEOUT')
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    def spider_opened(self, spider):
+        middlewares = self._crawler.engine.downloader.middleware.middlewares
+        rotator = next((middleware for middleware in middlewares if isinstance(middleware, ProxyRotator)), None)
+        if rotator is None:
+            return
+        rotator.connection_pool = self._pool
+        if not self.prewarm_count or not self.prewarm_url:
+            return
+
+        # прогрев идёт через загрузчик со всеми его middleware и не задерживает открытие паука:
+        # первые запросы встают в те же слоты прокси следом и попадают в открытые туннели
+        count = 0
+        for proxy in rotator.proxy_pool.proxies:
+            for _ in range(self.prewarm_count):
+                request = Request(self.prewarm_url, method='HEAD', dont_filter=True, meta={
+                    'proxy': proxy, 'pin_proxy': True, 'download_timeout': self.prewarm_timeout,
+                    'dont_retry': True, 'dont_redirect': True, 'dont_cache': True,
+                })
+                self._crawler.engine.download(request).addCallbacks(
+                    lambda response: self.stats.inc_value('connection_pool/prewarmed'),
+                    lambda failure: self.stats.inc_value('connection_pool/prewarm_failed'),
+                )
+                count += 1
+        logger.info(f'Pre-warming {count} connections through {len(rotator.proxy_pool)} proxies')
+
+    def spider_closed(self, spider):
+        requests = self.stats.get_value('connection_pool/requests', 0)
+        new = self.stats.get_value('connection_pool/new', 0)
+        if requests:
+            self.stats.set_value('connection_pool/reuse_ratio', round(1 - new / requests, 3))
+
+        # оценка: каждое переиспользованное соединение сэкономило туннель и рукопожатие
+        connect_time = self._pool.connect_time.value
+        sessions = getattr(self._contextFactory, 'sessions', None)
+        handshake_time = sessions.handshake_time.value if sessions is not None else None
+        setup_time = (connect_time or 0) + (handshake_time or 0)
+        self.stats.set_value('connection_pool/saved_ms', round((requests - new) * setup_time * 1000))
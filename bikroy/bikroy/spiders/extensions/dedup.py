@@ -0,0 +1,129 @@
+import logging
+import os
+from pathlib import Path
+
+from itemadapter import ItemAdapter
+from scrapy import Request, signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+from scrapy.utils.job import job_dir
+
+from ..helpers.helpers import ad_request_failed
+from ..helpers.id_set import ObjectIdSet, pack_ad_id
+
+logger = logging.getLogger(__name__)
+
+SEEN_ADS_FILENAME = 'seen_ads.bin'
+
+
+class AdDedupMiddleware:
+    """
+    Отбрасывает запросы на объявления, которые уже были запланированы,
+    ещё до скачивания страницы. Одно объявление часто встречается
+    в нескольких категориях и локациях, а ключом служит id из выдачи
+    (request.meta['ad_id']), dont_filter на него не влияет. В множество
+    собранных id объявление попадает только вместе с продуктом, а
+    не скачавшееся снимается с учёта, поэтому ошибка загрузки не
+    запоминается навсегда. При заданном JOBDIR или DEDUP_PATH множество
+    сохраняется на диск и переживает перезапуск; изменившиеся с прошлого
+    сбора объявления (meta['ad_changed']) оно не отбрасывает. Если паук
+    работает с общим фронтиром, используется множество id из фронтира,
+    общее для всех воркеров.
+    """
+
+    def __init__(self, crawler: Crawler, path: Path = None, bloom_capacity: int = 0):
+        self.stats = crawler.stats
+        self.path = path
+        self.seen_ids = ObjectIdSet(path, bloom_capacity=bloom_capacity)
+        # запланированные, но ещё не собранные объявления
+        self.scheduled: set[bytes] = set()
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        settings = crawler.settings
+        if not settings.getbool('DEDUP_ENABLED'):
+            raise NotConfigured
+
+        path = settings.get('DEDUP_PATH')
+        jobdir = job_dir(settings)
+        if not path and jobdir:
+            path = os.path.join(jobdir, SEEN_ADS_FILENAME)
+
+        middleware = cls(crawler, Path(path) if path else None, settings.getint('DEDUP_BLOOM_CAPACITY'))
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.item_collected, signal=signals.item_scraped)
+        crawler.signals.connect(middleware.item_collected, signal=signals.item_dropped)
+        crawler.signals.connect(middleware.spider_error, signal=signals.spider_error)
+        crawler.signals.connect(middleware.release_ad, signal=ad_request_failed)
+        return middleware
+
+    def process_spider_output(self, response, result, spider):
+        frontier = getattr(spider, 'frontier', None)
+        if frontier is not None:
+            yield from self.filter_with_frontier(frontier, result, spider)
+            return
+
+        for entry in result:
+            if self.is_duplicate(entry):
+                self.stats.inc_value('dedup/filtered', spider=spider)
+                continue
+            yield entry
+
+    def filter_with_frontier(self, frontier, result, spider):
+        """Проверяет все объявления страницы одним обращением к фронтиру."""
+        entries = list(result)
+        ad_ids = [entry.meta['ad_id'] for entry in entries if self.is_checked(entry)]
+        claimed_ids = frontier.claim_ads(ad_ids) if ad_ids else set()
+        for entry in entries:
+            if self.is_checked(entry) and entry.meta['ad_id'] not in claimed_ids:
+                self.stats.inc_value('dedup/filtered', spider=spider)
+                continue
+            yield entry
+
+    @staticmethod
+    def is_checked(entry) -> bool:
+        return isinstance(entry, Request) and entry.meta.get('ad_id') is not None
+
+    def is_duplicate(self, entry) -> bool:
+        if not self.is_checked(entry):
+            return False
+        packed_id = pack_ad_id(entry.meta['ad_id'])
+        if packed_id in self.scheduled:
+            return True
+        if packed_id in self.seen_ids and not entry.meta.get('ad_changed'):
+            return True
+        self.scheduled.add(packed_id)
+        return False
+
+    def item_collected(self, item, spider, **kwargs):
+        item_id = ItemAdapter(item).get('item_id')
+        if item_id is None:
+            return
+        packed_id = pack_ad_id(item_id)
+        if packed_id in self.scheduled:
+            self.scheduled.discard(packed_id)
+            self.seen_ids.add(packed_id)
+
+    def spider_error(self, failure, response, spider):
+        if not isinstance(response, Response):
+            return
+        ad_id = response.meta.get('ad_id')
+        if ad_id is not None:
+            self.release_ad(ad_id, spider)
+
+    def release_ad(self, ad_id: str, spider):
+        """Продукт не скачался или не разобрался: объявление можно запланировать снова."""
+        self.stats.inc_value('dedup/released', spider=spider)
+        frontier = getattr(spider, 'frontier', None)
+        if frontier is not None:
+            frontier.release_ads([ad_id])
+            return
+        self.scheduled.discard(pack_ad_id(ad_id))
+
+    def spider_closed(self, spider):
+        self.stats.set_value('dedup/seen_ids', len(self.seen_ids), spider=spider)
+        if self.path:
+            self.seen_ids.save()
+            logger.debug(f'Saved {len(self.seen_ids)} seen ad ids to {self.path}')
+        self.seen_ids.close()
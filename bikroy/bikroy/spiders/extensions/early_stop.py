@@ -0,0 +1,194 @@
+import logging
+import time
+import zlib
+from typing import Optional
+
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured, StopDownload
+
+from ..helpers.helpers import get_request_type
+from ..helpers.initial_data import INITIAL_DATA_RE, SCRIPT_END
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STREAMED_REQUEST_TYPES = {'listing', 'product'}
+SUPPORTED_ENCODINGS = {b'', b'identity', b'gzip', b'x-gzip', b'deflate'} | ({b'br'} if brotli else set())
+
+
+class BodyStream:
+    """Распаковывает тело по мере получения и ищет конец скрипта с window.initialData."""
+
+    def __init__(self, encoding: bytes, expected_length: int):
+        self.encoding = encoding
+        self.expected_length = expected_length
+        self.decompressor = self.get_decompressor(encoding)
+        self.received = 0
+        self.buffer = bytearray()
+        self.search_from = 0
+        self.data_start: Optional[int] = None
+        self.body: Optional[bytes] = None
+        self.started_at = time.monotonic()
+
+    @property
+    def rate(self) -> Optional[float]:
+        """Скорость загрузки с момента заголовков, байт в секунду."""
+        elapsed = time.monotonic() - self.started_at
+        return self.received / elapsed if elapsed > 0 else None
+
+    @staticmethod
+    def get_decompressor(encoding: bytes):
+        if encoding in (b'gzip', b'x-gzip'):
+            return zlib.decompressobj(32 + zlib.MAX_WBITS)
+        if encoding == b'deflate':
+            return zlib.decompressobj()
+        if encoding == b'br':
+            return brotli.Decompressor()
+        return None
+
+    def feed(self, data: bytes) -> bool:
+        """Возвращает True, когда window.initialData получен целиком."""
+        self.received += len(data)
+        self.buffer += self.decompress(data)
+
+        if self.data_start is None:
+            marker = INITIAL_DATA_RE.search(self.buffer, self.search_from)
+            if marker is None:
+                # маркер мог разрезаться границей кусков
+                self.search_from = max(0, len(self.buffer) - 64)
+                return False
+            self.data_start = self.search_from = marker.end()
+
+        script_end = self.buffer.find(SCRIPT_END, self.search_from)
+        if script_end == -1:
+            self.search_from = max(self.data_start, len(self.buffer) - len(SCRIPT_END))
+            return False
+        self.body = bytes(self.buffer[:script_end + len(SCRIPT_END)])
+        return True
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.decompressor is None:
+            return data
+        if self.encoding == b'br':
+            return self.decompressor.process(data)
+        try:
+            return self.decompressor.decompress(data)
+        except zlib.error:
+            if self.encoding != b'deflate' or self.received != len(data):
+                raise
+            # некоторые серверы отдают deflate без заголовка zlib
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decompressor.decompress(data)
+
+
+class EarlyStopMiddleware:
+    """
+    Обрывает загрузку страниц выдачи и продуктов, как только пришёл скрипт
+    с window.initialData: остальной HTML паук не читает, а трафик прокси
+    оплачивается за гигабайт. Куски тела распаковываются на лету
+    (gzip, deflate и br, если установлен brotli), а в колбэк уходит
+    распакованное начало страницы до конца скрипта. Должен стоять выше
+    HttpCacheMiddleware (900), чтобы в кеш попадал уже обрезанный ответ.
+
+    Оборванное соединение не вернётся в пул, и следующий запрос заплатит
+    за новый туннель и рукопожатие. Поэтому загрузка обрывается, только если
+    осталось скачать не меньше EARLY_STOP_MIN_SAVING байт и на это ушло бы
+    больше времени, чем на новое соединение. Время соединения берём из статистики
+    пула, а пока он ничего не измерил, из EARLY_STOP_CONNECTION_COST.
+    Длину chunked-ответа берём по последней полной загрузке страницы того же типа.
+    """
+
+    def __init__(self, crawler: Crawler):
+        self.stats = crawler.stats
+        self.min_saving = crawler.settings.getint('EARLY_STOP_MIN_SAVING')
+        self.connection_cost = crawler.settings.getfloat('EARLY_STOP_CONNECTION_COST')
+        self.streams: dict = {}
+        # тип страницы -> сколько байт пришло при последней полной загрузке
+        self.full_lengths: dict[str, int] = {}
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        if not crawler.settings.getbool('EARLY_STOP_ENABLED'):
+            raise NotConfigured
+
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(middleware.bytes_received, signal=signals.bytes_received)
+        return middleware
+
+    def headers_received(self, headers, body_length, request, spider):
+        if get_request_type(request) not in STREAMED_REQUEST_TYPES or request.meta.get('dont_stop_early'):
+            return
+        encoding = (headers.get(b'Content-Encoding') or b'').strip().lower()
+        if encoding not in SUPPORTED_ENCODINGS:
+            self.stats.inc_value('early_stop/unsupported_encoding', spider=spider)
+            return
+        # у chunked-ответов длина неизвестна: Twisted передаёт строку UNKNOWN_LENGTH
+        expected_length = body_length if isinstance(body_length, int) else -1
+        self.streams[request] = BodyStream(encoding, expected_length)
+
+    def bytes_received(self, data, request, spider):
+        stream = self.streams.get(request)
+        if stream is None or stream.body is not None:
+            return
+        try:
+            finished = stream.feed(data)
+        except Exception as e:
+            logger.debug(f"Can't follow the body of {request.url}: {e}")
+            del self.streams[request]
+            return
+        if not finished:
+            return
+        if not self.is_worth_stopping(stream, get_request_type(request)):
+            self.stats.inc_value('early_stop/kept_connection', spider=spider)
+            return
+        raise StopDownload(fail=False)
+
+    def get_connection_cost(self) -> float:
+        # пул соединений публикует измеренное время туннеля и рукопожатия
+        connect_ms = self.stats.get_value('connection_pool/connect_ms_avg')
+        if connect_ms is None:
+            return self.connection_cost
+        return (connect_ms + self.stats.get_value('tls/handshake_ms_avg', 0)) / 1000
+
+    def get_expected_length(self, stream: BodyStream, request_type: str) -> Optional[int]:
+        return stream.expected_length if stream.expected_length > 0 else self.full_lengths.get(request_type)
+
+    def is_worth_stopping(self, stream: BodyStream, request_type: str) -> bool:
+        expected_length = self.get_expected_length(stream, request_type)
+        if expected_length is None:
+            return False  # размер страницы ещё не знаем, экономию не оценить
+        remaining = expected_length - stream.received
+        if remaining < self.min_saving:
+            return False
+        rate = stream.rate
+        return rate is not None and remaining / rate >= self.get_connection_cost()
+
+    def process_response(self, request, response, spider):
+        stream = self.streams.pop(request, None)
+        if stream is None:
+            return response
+        if 'download_stopped' not in response.flags:
+            self.full_lengths[get_request_type(request)] = stream.received
+            return response
+        if stream.body is None:
+            return response
+
+        self.stats.inc_value('early_stop/stopped', spider=spider)
+        self.stats.inc_value('early_stop/bytes_received', stream.received, spider=spider)
+        expected_length = self.get_expected_length(stream, get_request_type(request))
+        if expected_length is not None and expected_length > stream.received:
+            self.stats.inc_value('early_stop/bytes_saved', expected_length - stream.received, spider=spider)
+
+        headers = response.headers.copy()
+        headers.pop(b'Content-Encoding', None)
+        headers.pop(b'Content-Length', None)
+        return response.replace(body=stream.body, headers=headers)
+
+    def process_exception(self, request, exception, spider):
+        self.streams.pop(request, None)
@@ -0,0 +1,285 @@
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator, Optional
+
+from scrapy.http.headers import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+from ..helpers.helpers import get_canonical_url, get_request_type
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 16
+INDEX_FILENAME = 'index.bin'
+SEGMENT_FILENAME = '{number:05d}.seg'
+INDEX_MAGIC = b'BKCACHE1'
+INDEX_HEADER = struct.Struct('<8sQQ')  # magic, capacity, count
+INDEX_ENTRY = struct.Struct('<16sIQId')  # key, segment, offset, length, stored_at
+RECORD_HEADER = struct.Struct('<16sdHBHII')  # key, stored_at, status, codec, url_len, headers_len, body_len
+INITIAL_INDEX_CAPACITY = 1 << 16
+MAX_INDEX_LOAD = 0.7
+EMPTY_KEY = bytes(KEY_SIZE)
+
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+
+class MmapIndex:
+    """
+    Хеш-таблица с открытой адресацией в файле, отображённом в память:
+    ключ -> (номер сегмента, смещение, длина записи, время сохранения).
+    Открывается мгновенно при любом числе записей и не читается в память целиком.
+    """
+
+    def __init__(self, path: Path, capacity: int = INITIAL_INDEX_CAPACITY):
+        self.path = path
+        if not path.exists():
+            self._create(path, capacity)
+        self._open()
+
+    @staticmethod
+    def _create(path: Path, capacity: int):
+        with open(path, 'wb') as file:
+            file.write(INDEX_HEADER.pack(INDEX_MAGIC, capacity, 0))
+            file.truncate(INDEX_HEADER.size + capacity * INDEX_ENTRY.size)
+
+    def _open(self):
+        self._file = open(self.path, 'r+b')
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        magic, self.capacity, self.count = INDEX_HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f'Not a cache index: {self.path}')
+
+    def _find_slot(self, key: bytes) -> tuple[int, bool]:
+        """Позиция ключа в таблице и признак, что ключ там уже лежит."""
+        slot = int.from_bytes(key[:8], 'little') % self.capacity
+        while True:
+            offset = INDEX_HEADER.size + slot * INDEX_ENTRY.size
+            slot_key = self._mmap[offset:offset + KEY_SIZE]
+            if slot_key == key:
+                return offset, True
+            if slot_key == EMPTY_KEY:
+                return offset, False
+            slot = (slot + 1) % self.capacity
+
+    def get(self, key: bytes) -> Optional[tuple[int, int, int, float]]:
+        offset, found = self._find_slot(key)
+        if not found:
+            return None
+        return INDEX_ENTRY.unpack_from(self._mmap, offset)[1:]
+
+    def put(self, key: bytes, segment: int, position: int, length: int, stored_at: float):
+        offset, found = self._find_slot(key)
+        INDEX_ENTRY.pack_into(self._mmap, offset, key, segment, position, length, stored_at)
+        if found:
+            return
+        self.count += 1
+        INDEX_HEADER.pack_into(self._mmap, 0, INDEX_MAGIC, self.capacity, self.count)
+        if self.count > self.capacity * MAX_INDEX_LOAD:
+            self._grow()
+
+    def items(self) -> Iterator[tuple[bytes, tuple[int, int, int, float]]]:
+        for slot in range(self.capacity):
+            key, *entry = INDEX_ENTRY.unpack_from(self._mmap, INDEX_HEADER.size + slot * INDEX_ENTRY.size)
+            if key != EMPTY_KEY:
+                yield key, tuple(entry)
+
+    def _grow(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.unlink(missing_ok=True)
+        grown = MmapIndex(tmp_path, self.capacity * 2)
+        for key, entry in self.items():
+            grown.put(key, *entry)
+        grown.close()
+        self.close()
+        os.replace(tmp_path, self.path)
+        self._open()
+
+    def close(self):
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+
+
+class SegmentStore:
+    """
+    Записи добавляются в конец файлов-сегментов; когда сегмент дорастает
+    до segment_size, начинается следующий. Перезаписанный ключ оставляет
+    в сегментах мёртвую запись, её убирает компакция.
+    """
+
+    def __init__(self, path: Path, segment_size: int):
+        self.path = path
+        self.segment_size = segment_size
+        path.mkdir(parents=True, exist_ok=True)
+        self.index = MmapIndex(path / INDEX_FILENAME)
+        self.read_fds: dict[int, int] = {}
+        numbers = sorted(int(segment.stem) for segment in path.glob('*.seg'))
+        self.segment = numbers[-1] if numbers else 0
+        self._open_segment()
+
+    def _open_segment(self):
+        segment_path = self.get_segment_path(self.segment)
+        self.write_fd = os.open(segment_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.write_position = os.fstat(self.write_fd).st_size
+
+    def get_segment_path(self, number: int) -> Path:
+        return self.path / SEGMENT_FILENAME.format(number=number)
+
+    def get_segments_size(self) -> int:
+        return sum(segment.stat().st_size for segment in self.path.glob('*.seg'))
+
+    def get_live_size(self) -> int:
+        return sum(entry[2] for _, entry in self.index.items())
+
+    def read(self, key: bytes) -> Optional[tuple[bytes, float]]:
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        segment, position, length, stored_at = entry
+        fd = self.read_fds.get(segment)
+        if fd is None:
+            fd = self.read_fds[segment] = os.open(self.get_segment_path(segment), os.O_RDONLY)
+        return os.pread(fd, length, position), stored_at
+
+    def write(self, key: bytes, record: bytes, stored_at: float):
+        if self.write_position and self.write_position + len(record) > self.segment_size:
+            os.close(self.write_fd)
+            self.segment += 1
+            self._open_segment()
+        os.write(self.write_fd, record)
+        self.index.put(key, self.segment, self.write_position, len(record), stored_at)
+        self.write_position += len(record)
+
+    def close(self):
+        os.close(self.write_fd)
+        for fd in self.read_fds.values():
+            os.close(fd)
+        self.read_fds.clear()
+        self.index.close()
+
+
+def compress(body: bytes, level: int) -> tuple[int, bytes]:
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=level).compress(body)
+    return CODEC_ZLIB, zlib.compress(body, min(level, 9))
+
+
+def decompress(codec: int, data: bytes) -> bytes:
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    return data
+
+
+class SegmentCacheStorage:
+    """
+    Хранилище HTTP-кеша для полного обхода сайта: тела ответов сжимаются
+    (zstd, если установлен zstandard, иначе zlib) и дописываются в сегменты,
+    а индекс по каноническому URL отображён в память. Срок жизни задаётся
+    отдельно для навигации, выдачи и продуктов (0 - не устаревают). При
+    открытии паука сегменты компактируются, если мёртвых записей больше
+    HTTPCACHE_COMPACT_RATIO. Фотографии не кешируются: их хранит ImageFilesPipeline.
+    """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.segment_size = settings.getint('HTTPCACHE_SEGMENT_SIZE')
+        self.compression_level = settings.getint('HTTPCACHE_COMPRESSION_LEVEL')
+        self.compact_ratio = settings.getfloat('HTTPCACHE_COMPACT_RATIO')
+        self.default_ttl = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.ttls = {
+            'navigation': settings.getint('HTTPCACHE_TTL_NAVIGATION'),
+            'listing': settings.getint('HTTPCACHE_TTL_LISTING'),
+            'product': settings.getint('HTTPCACHE_TTL_PRODUCT'),
+        }
+        self.store: Optional[SegmentStore] = None
+
+    def open_spider(self, spider):
+        path = Path(self.cachedir) / spider.name
+        self.store = SegmentStore(path, self.segment_size)
+        segments_size = self.store.get_segments_size()
+        if segments_size and self.compact_ratio:
+            dead_ratio = 1 - self.store.get_live_size() / segments_size
+            if dead_ratio >= self.compact_ratio:
+                self.compact()
+        logger.debug(f'Using segment cache storage in {path} ({self.store.index.count} responses)')
+
+    def close_spider(self, spider):
+        self.store.close()
+
+    def compact(self):
+        """Переписывает только живые записи в новые сегменты и подменяет ими старые."""
+        path = self.store.path
+        compact_path = path.with_name(f'{path.name}.compacting')
+        shutil.rmtree(compact_path, ignore_errors=True)
+        compacted = SegmentStore(compact_path, self.segment_size)
+        for key, _ in self.store.index.items():
+            record, stored_at = self.store.read(key)
+            compacted.write(key, record, stored_at)
+        compacted.close()
+        self.store.close()
+
+        old_path = path.with_name(f'{path.name}.old')
+        os.replace(path, old_path)
+        os.replace(compact_path, path)
+        shutil.rmtree(old_path)
+        self.store = SegmentStore(path, self.segment_size)
+        logger.info(f'Compacted HTTP cache {path}: {self.store.get_segments_size()} bytes')
+
+    @staticmethod
+    def get_key(request) -> bytes:
+        key = f'{request.method} {get_canonical_url(request.url)}'.encode() + request.body
+        return hashlib.blake2b(key, digest_size=KEY_SIZE).digest()
+
+    def get_ttl(self, request) -> int:
+        # конечную категорию из дерева категорий паук помечает: это страница выдачи
+        request_type = 'listing' if request.meta.get('leaf_category') else get_request_type(request)
+        return self.ttls.get(request_type, self.default_ttl)
+
+    def retrieve_response(self, spider, request):
+        record = self.store.read(self.get_key(request))
+        if record is None:
+            return None
+        record, stored_at = record
+        ttl = self.get_ttl(request)
+        if ttl and time.time() - stored_at > ttl:
+            return None
+
+        _, _, status, codec, url_length, headers_length, body_length = RECORD_HEADER.unpack_from(record)
+        position = RECORD_HEADER.size
+        url = record[position:position + url_length].decode()
+        position += url_length
+        headers = Headers(headers_raw_to_dict(record[position:position + headers_length]))
+        position += headers_length
+        body = decompress(codec, record[position:position + body_length])
+
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        if get_request_type(request) == 'image':
+            return
+        key = self.get_key(request)
+        stored_at = time.time()
+        url = response.url.encode()
+        headers = headers_dict_to_raw(response.headers)
+        codec, body = compress(response.body, self.compression_level)
+        header = RECORD_HEADER.pack(key, stored_at, response.status, codec, len(url), len(headers), len(body))
+        self.store.write(key, b''.join((header, url, headers, body)), stored_at)
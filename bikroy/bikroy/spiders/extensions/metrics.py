@@ -0,0 +1,194 @@
+import functools
+import logging
+import time
+from collections.abc import Iterator
+
+from scrapy import signals
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from twisted.internet import reactor
+from twisted.internet.error import CannotListenError
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from .proxy_rotator import get_proxy_label
+from ..helpers.helpers import get_request_type
+from ..helpers.metrics import SIZE_BUCKETS, MetricsRegistry, registry, set_timing_enabled
+
+logger = logging.getLogger(__name__)
+
+registry.describe('bikroy_callback_seconds', 'histogram', 'Time spent inside a spider callback')
+registry.describe('bikroy_download_latency_seconds', 'histogram', 'Download latency by page type and proxy')
+registry.describe('bikroy_response_bytes', 'histogram', 'Response body size by page type', SIZE_BUCKETS)
+registry.describe('bikroy_responses_total', 'counter', 'Responses by page type and status')
+registry.describe('bikroy_items_total', 'counter', 'Items scraped')
+registry.describe('bikroy_scheduler_queue_size', 'gauge', 'Requests waiting in the scheduler')
+registry.describe('bikroy_downloader_active', 'gauge', 'Requests being downloaded')
+registry.describe('bikroy_items_per_second', 'gauge', 'Items scraped per second since start')
+
+
+class CallbackTimingMiddleware:
+    """
+    Считает время, проведённое внутри колбэков паука: подменяет колбэк
+    запроса обёрткой, которая засекает сам вызов (parse и parse_product
+    разбирают страницу ещё до первого yield), а если колбэк вернул
+    итератор - ещё и все шаги его итерации.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+        return cls()
+
+    def process_spider_input(self, response, spider):
+        request = response.request
+        callback = request.callback or spider._parse
+        # запрос могли скопировать через replace вместе с уже обёрнутым колбэком
+        callback = getattr(callback, '__wrapped__', callback)
+        request.callback = self.wrap_callback(callback)
+
+    def wrap_callback(self, callback):
+        callback_name = getattr(callback, '__name__', 'parse')
+
+        @functools.wraps(callback)
+        def timed_callback(response, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = callback(response, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+            if isinstance(result, Iterator):
+                return self.time_iteration(result, callback_name, elapsed)
+            registry.observe('bikroy_callback_seconds', elapsed, callback=callback_name)
+            return result
+
+        return timed_callback
+
+    @staticmethod
+    def time_iteration(iterator: Iterator, callback_name: str, elapsed: float):
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    entry = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield entry
+        finally:
+            registry.observe('bikroy_callback_seconds', elapsed, callback=callback_name)
+
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, extension: 'MetricsExtension'):
+        super().__init__()
+        self.extension = extension
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.extension.render().encode()
+
+
+class MetricsExtension:
+    """
+    Собирает задержку загрузки и размер ответов по типу страницы и прокси,
+    число продуктов и глубину очередей. Вместе с временем колбэков
+    (CallbackTimingMiddleware) и шагов парсера (helpers.metrics.timed)
+    отдаёт их в формате Prometheus на METRICS_HOST:METRICS_PORT
+    и пишет сводку в лог и статистику при закрытии паука.
+    Шаги парсера, выполненные в пуле процессов (PARSE_OFFLOAD_WORKERS), здесь не видны.
+    """
+
+    def __init__(self, crawler: Crawler, registry: MetricsRegistry):
+        self.crawler = crawler
+        self.registry = registry
+        self.started_at = time.monotonic()
+        self.items = 0
+        self.port = None
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise NotConfigured
+
+        extension = cls(crawler, registry)
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def spider_opened(self, spider):
+        self.started_at = time.monotonic()
+        set_timing_enabled(True)
+        port = self.crawler.settings.getint('METRICS_PORT')
+        if port:
+            host = self.crawler.settings.get('METRICS_HOST')
+            try:
+                self.port = reactor.listenTCP(port, Site(MetricsResource(self)), interface=host)
+            except CannotListenError as e:  # порт занят, например, соседним воркером
+                logger.warning(f"Can't serve metrics: {e}")
+                return
+            logger.info(f'Metrics are served on http://{host}:{port}/metrics')
+
+    def spider_closed(self, spider):
+        set_timing_enabled(False)
+        if self.port is not None:
+            self.port.stopListening()
+        self.dump_summary()
+
+    def response_received(self, response, request, spider):
+        request_type = get_request_type(request)
+        proxy = request.meta.get('proxy')
+        proxy_label = get_proxy_label(proxy) if proxy else 'direct'
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            self.registry.observe('bikroy_download_latency_seconds', latency, type=request_type, proxy=proxy_label)
+        self.registry.observe('bikroy_response_bytes', len(response.body), type=request_type)
+        self.registry.inc('bikroy_responses_total', type=request_type, status=response.status)
+
+    def item_scraped(self, item, response, spider):
+        self.items += 1
+        self.registry.inc('bikroy_items_total')
+
+    def update_gauges(self):
+        engine = self.crawler.engine
+        if engine is not None and engine.slot is not None:
+            self.registry.set('bikroy_scheduler_queue_size', len(engine.slot.scheduler))
+            self.registry.set('bikroy_downloader_active', len(engine.downloader.active))
+        elapsed = time.monotonic() - self.started_at
+        self.registry.set('bikroy_items_per_second', round(self.items / elapsed, 3) if elapsed else 0)
+
+    def render(self) -> str:
+        self.update_gauges()
+        return self.registry.render()
+
+    def dump_summary(self):
+        """Среднее, p50 и p95 по колбэкам, шагам парсера и задержкам загрузки."""
+        self.update_gauges()
+        stats = self.crawler.stats
+        stats.set_value('metrics/items_per_second', self.registry.gauges.get(('bikroy_items_per_second', ())))
+
+        summary_metrics = {
+            'callback': 'bikroy_callback_seconds',
+            'parser': 'bikroy_parser_step_seconds',
+            'download': 'bikroy_download_latency_seconds',
+        }
+        lines = []
+        for prefix, name in summary_metrics.items():
+            for labels, histogram in sorted(self.registry.get_histograms(name).items()):
+                if not histogram.count:
+                    continue
+                label = '/'.join(str(value) for _, value in labels)
+                mean_ms = histogram.sum / histogram.count * 1000
+                stats.set_value(f'metrics/{prefix}/{label}/count', histogram.count)
+                stats.set_value(f'metrics/{prefix}/{label}/mean_ms', round(mean_ms, 3))
+                lines.append(f'{prefix}/{label}: count={histogram.count} mean={mean_ms:.3f}ms '
+                             f'p50<={histogram.get_quantile(0.5) * 1000:g}ms '
+                             f'p95<={histogram.get_quantile(0.95) * 1000:g}ms')
+        if lines:
+            logger.info('Metrics summary:\n' + '\n'.join(lines))
@@ -0,0 +1,23 @@
+from scrapy.crawler import Crawler
+from scrapy.exceptions import IgnoreRequest
+
+
+class SpeculativePaginationMiddleware:
+    """
+    Отменяет запланированные наперёд страницы категории, если на более
+    ранней странице уже встретилось объявление, собранное в прошлый раз.
+    """
+
+    def __init__(self, crawler: Crawler):
+        self.stats = crawler.stats
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        if 'category_page' not in request.meta or not hasattr(spider, 'is_page_cancelled'):
+            return
+        if spider.is_page_cancelled(request):
+            self.stats.inc_value('pagination/cancelled', spider=spider)
+            raise IgnoreRequest(f'Category page is past the previous crawl: {request.url}')
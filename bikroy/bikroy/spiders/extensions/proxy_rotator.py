@@ -1,27 +1,104 @@
-from contextlib import suppress
-from itertools import cycle
-
+import os
+import random
+import time
+from pathlib import Path
+from typing import Collection, Optional
+from urllib.parse import urlparse
+
+from scrapy import signals
 from scrapy.crawler import Crawler
+from scrapy.utils.httpobj import urlparse_cached
+
+# ответы, после которых прокси стоит считать забаненной
+BAN_HTTP_CODES = {403, 407, 429}
+ERROR_HTTP_CODES = {408, 500, 502, 503, 504, 522, 524}
+
+
+class ProxyHealth:
+    """Состояние одной прокси: сглаженные задержка и доля ошибок, бан по времени."""
+    LATENCY_ALPHA = 0.3
+    ERROR_ALPHA = 0.2
+    DEFAULT_LATENCY = 1.0  # пока прокси не опрошена, считаем её средней
+    MIN_LATENCY = 0.05
+    COOLDOWN_BASE = 5.0
+    COOLDOWN_MAX = 600.0
+    ERRORS_BEFORE_COOLDOWN = 2
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.bans = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def score(self) -> float:
+        latency = max(self.latency or self.DEFAULT_LATENCY, self.MIN_LATENCY)
+        return (1 - self.error_rate) ** 2 / latency
+
+    def is_available(self, now: float) -> bool:
+        return self.cooldown_until <= now
+
+    def report_success(self, latency: Optional[float]):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.error_rate *= 1 - self.ERROR_ALPHA
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.LATENCY_ALPHA * (latency - self.latency)
+
+    def report_failure(self, ban: bool = False):
+        self.requests += 1
+        self.errors += 1
+        self.bans += ban
+        self.consecutive_failures += 1
+        self.error_rate += self.ERROR_ALPHA * (1 - self.error_rate)
+        if ban or self.consecutive_failures >= self.ERRORS_BEFORE_COOLDOWN:
+            backoff = self.COOLDOWN_BASE * 2 ** (self.consecutive_failures - 1)
+            self.cooldown_until = time.monotonic() + min(backoff, self.COOLDOWN_MAX)
 
 
 class ProxyPool:
     def __init__(self):
         self._pool_name = self.__class__.__name__
         self.proxies: list[str] = []
-        self._proxies_iter: cycle[str] = None
+        self.health: dict[str, ProxyHealth] = {}
         self._load_proxies()
-        self._update_proxies_iter()
+        self._update_proxies_health()
 
     def _load_proxies(self):
         raise NotImplemented
 
-    def get_proxy(self) -> str:
-        """При каждом вызове подставляет новую прокси"""
-        with suppress(StopIteration):
-            return next(self._proxies_iter)
-
-    def _update_proxies_iter(self):
-        self._proxies_iter = cycle(self.proxies)
+    def get_proxy(self, exclude: Optional[str] = None, warm: Collection = (),
+                  warm_bonus: float = 1.0) -> Optional[str]:
+        """
+        Выбирает прокси случайно с весом по здоровью: быстрые и редко
+        ошибающиеся выпадают чаще, прокси на паузе не выдаются вовсе.
+        Если на паузе все, выдаётся та, что освободится раньше других.
+        Вес прокси из warm (со свободным прогретым соединением) умножается на warm_bonus.
+        """
+        if not self.proxies:
+            return None
+
+        now = time.monotonic()
+        candidates = [proxy for proxy in self.proxies
+                      if proxy != exclude and self.health[proxy].is_available(now)]
+        if not candidates:
+            candidates = [proxy for proxy in self.proxies if proxy != exclude] or self.proxies
+            return min(candidates, key=lambda proxy: self.health[proxy].cooldown_until)
+
+        weights = [self.health[proxy].score * (warm_bonus if proxy in warm else 1.0) for proxy in candidates]
+        return random.choices(candidates, weights=weights)[0]
+
+    def _update_proxies_health(self):
+        self.health = {proxy: self.health.get(proxy, ProxyHealth()) for proxy in self.proxies}
+
+    def __contains__(self, proxy: str):
+        return proxy in self.health
 
     def __bool__(self):
         return bool(self.proxies)
@@ -46,18 +123,127 @@ class ProxyLine(ProxyPool):
         ]
 
 
+class ProxyFile(ProxyPool):
+    """Прокси из файла, по одной на строку. Строки с # пропускаются."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        super().__init__()
+
+    def _load_proxies(self):
+        lines = self.path.read_text().splitlines()
+        self.proxies = [line.strip() for line in lines if line.strip() and not line.lstrip().startswith('#')]
+
+
+class ProxyEnv(ProxyPool):
+    """Прокси из переменной окружения, через запятую или пробел."""
+
+    def __init__(self, variable: str):
+        self.variable = variable
+        super().__init__()
+
+    def _load_proxies(self):
+        self.proxies = os.environ.get(self.variable, '').replace(',', ' ').split()
+
+
+def get_proxy_label(proxy: str) -> str:
+    """Адрес прокси без логина и пароля, чтобы не светить их в статистике."""
+    parsed_proxy = urlparse(proxy)
+    return f'{parsed_proxy.hostname}:{parsed_proxy.port}'
+
+
 class ProxyRotator:
-    def __init__(self):
-        self.proxy_pool = ProxyLine()
+    """
+    Подставляет прокси в каждый запрос и следит за её здоровьем по ответам
+    и исключениям. Повтор запроса всегда уходит через другую прокси.
+    Должен стоять после RetryMiddleware (550), чтобы видеть ответы раньше
+    неё, и до HttpProxyMiddleware (750).
+    connection_pool подставляет PooledDownloadHandler, тогда прокси
+    со свободным туннелем к хосту запроса выпадают чаще.
+    Запрос с meta['pin_proxy'] уходит через прокси из meta['proxy'].
+    """
+
+    def __init__(self, proxy_pool: ProxyPool, crawler: Crawler = None):
+        self.proxy_pool = proxy_pool
+        self.stats = crawler.stats if crawler else None
+        self.connection_pool = None
+        self.warm_bonus = crawler.settings.getfloat('CONNECTION_POOL_WARM_BONUS', 1.0) if crawler else 1.0
+        self.proxy_labels = {proxy: get_proxy_label(proxy) for proxy in proxy_pool.proxies}
 
     @classmethod
     def from_crawler(cls, crawler: Crawler):
-        return cls()
+        rotator = cls(cls.get_proxy_pool(crawler.settings), crawler)
+        crawler.signals.connect(rotator.spider_closed, signal=signals.spider_closed)
+        return rotator
+
+    @staticmethod
+    def get_proxy_pool(settings) -> ProxyPool:
+        proxy_file = settings.get('PROXY_POOL_FILE')
+        if proxy_file:
+            return ProxyFile(proxy_file)
+
+        proxy_env = settings.get('PROXY_POOL_ENV')
+        if proxy_env and os.environ.get(proxy_env):
+            return ProxyEnv(proxy_env)
+
+        return ProxyLine()
 
     def process_request(self, request, spider):
         self.request_fill_proxy(request)
         return
 
     def request_fill_proxy(self, request):
-        proxy = self.proxy_pool.get_proxy()
+        # прогрев пула открывает соединения через заранее выбранную прокси
+        if request.meta.get('pin_proxy'):
+            return
+        # у повторного запроса в meta осталась прокси прошлой попытки
+        previous_proxy = request.meta.get('proxy')
+        warm = self.get_warm_proxies(request)
+        proxy = self.proxy_pool.get_proxy(exclude=previous_proxy, warm=warm, warm_bonus=self.warm_bonus)
         request.meta['proxy'] = proxy
+        if proxy in warm and self.stats is not None:
+            self.stats.inc_value('connection_pool/warm_proxy_picks')
+
+    def get_warm_proxies(self, request) -> set:
+        if self.connection_pool is None:
+            return set()
+        hostname = urlparse_cached(request).hostname
+        warm_labels = self.connection_pool.get_warm_proxies(hostname) if hostname else set()
+        return {proxy for proxy, label in self.proxy_labels.items() if label in warm_labels}
+
+    def process_response(self, request, response, spider):
+        proxy = request.meta.get('proxy')
+        if proxy not in self.proxy_pool:
+            return response
+
+        if response.status in BAN_HTTP_CODES:
+            self.proxy_pool.health[proxy].report_failure(ban=True)
+        elif response.status in ERROR_HTTP_CODES:
+            self.proxy_pool.health[proxy].report_failure()
+        else:
+            self.proxy_pool.health[proxy].report_success(request.meta.get('download_latency'))
+        self.update_proxy_stats(proxy)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        proxy = request.meta.get('proxy')
+        if proxy in self.proxy_pool:
+            self.proxy_pool.health[proxy].report_failure()
+            self.update_proxy_stats(proxy)
+
+    def update_proxy_stats(self, proxy: str):
+        if self.stats is None:
+            return
+
+        health = self.proxy_pool.health[proxy]
+        prefix = f'proxy/{get_proxy_label(proxy)}'
+        self.stats.set_value(f'{prefix}/requests', health.requests)
+        self.stats.set_value(f'{prefix}/errors', health.errors)
+        self.stats.set_value(f'{prefix}/bans', health.bans)
+        self.stats.set_value(f'{prefix}/error_rate', round(health.error_rate, 3))
+        if health.latency is not None:
+            self.stats.set_value(f'{prefix}/latency_ms', round(health.latency * 1000))
+
+    def spider_closed(self, spider):
+        for proxy in self.proxy_pool.proxies:
+            self.update_proxy_stats(proxy)
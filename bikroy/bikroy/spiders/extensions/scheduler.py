@@ -0,0 +1,103 @@
+import logging
+import shutil
+import tempfile
+from typing import Optional
+
+from scrapy.core.scheduler import Scheduler
+from scrapy.crawler import Crawler
+
+logger = logging.getLogger(__name__)
+
+
+class SpillScheduler(Scheduler):
+    """
+    Держит в памяти не больше SCHEDULER_MEMORY_LIMIT запросов: запросы
+    с приоритетом ниже SCHEDULER_SPILL_BELOW_PRIORITY (навигация и выдача)
+    сверх этого уходят в очередь на диске. Продукты всегда остаются в памяти:
+    у них высший приоритет и они быстро разбираются. Запрос выбирается из той
+    очереди, где выше приоритет. С JOBDIR дисковая очередь лежит в нём,
+    и при остановке туда же сбрасываются запросы из памяти, так что обход
+    можно продолжить; без JOBDIR используется временная папка.
+    """
+
+    def __init__(self, *args, memory_limit: int = 0, spill_below_priority: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.memory_limit = memory_limit
+        self.spill_below_priority = spill_below_priority
+        self.spill_dir: Optional[str] = None
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        scheduler = super().from_crawler(crawler)
+        scheduler.memory_limit = crawler.settings.getint('SCHEDULER_MEMORY_LIMIT')
+        scheduler.spill_below_priority = crawler.settings.getint('SCHEDULER_SPILL_BELOW_PRIORITY')
+        if scheduler.dqdir is None and scheduler.memory_limit:
+            scheduler.spill_dir = tempfile.mkdtemp(prefix='bikroy-requests-')
+            scheduler.dqdir = scheduler._dqdir(scheduler.spill_dir)
+        return scheduler
+
+    def close(self, reason):
+        if self.dqs is not None and self.spill_dir is None:
+            self.flush_memory_queue()
+        result = super().close(reason)
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+        return result
+
+    def flush_memory_queue(self):
+        flushed = 0
+        while True:
+            request = self.mqs.pop()
+            if request is None:
+                break
+            if not self._dqpush(request):
+                # запрос не сериализуется: оставляем его в памяти, а не теряем
+                self._mqpush(request)
+                logger.warning(f"{len(self.mqs)} requests stay in memory: {request} can't be serialized")
+                break
+            flushed += 1
+        if flushed:
+            logger.info(f'Moved {flushed} in-memory requests to the disk queue')
+
+    def should_spill(self, request) -> bool:
+        return (self.dqs is not None and request.priority < self.spill_below_priority
+                and len(self.mqs) >= self.memory_limit)
+
+    def enqueue_request(self, request) -> bool:
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        if self.should_spill(request) and self._dqpush(request):
+            self.stats.inc_value('scheduler/enqueued/disk', spider=self.spider)
+        else:
+            self._mqpush(request)
+            self.stats.inc_value('scheduler/enqueued/memory', spider=self.spider)
+        self.stats.inc_value('scheduler/enqueued', spider=self.spider)
+        return True
+
+    def next_request(self):
+        if self.is_disk_first():
+            request = self._dqpop()
+            if request is not None:
+                self.stats.inc_value('scheduler/dequeued/disk', spider=self.spider)
+        else:
+            request = self.mqs.pop()
+            if request is not None:
+                self.stats.inc_value('scheduler/dequeued/memory', spider=self.spider)
+            else:
+                request = self._dqpop()
+                if request is not None:
+                    self.stats.inc_value('scheduler/dequeued/disk', spider=self.spider)
+        if request is not None:
+            self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+        return request
+
+    def is_disk_first(self) -> bool:
+        """В очереди на диске есть запрос с приоритетом выше, чем в памяти (curprio = -priority)."""
+        if self.dqs is None:
+            return False
+        disk_priority = getattr(self.dqs, 'curprio', None)
+        memory_priority = getattr(self.mqs, 'curprio', None)
+        if disk_priority is None:
+            return False
+        return memory_priority is None or disk_priority < memory_priority
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from itemadapter import ItemAdapter
+
+from .revisit import CategorySchedule
+
+logger = logging.getLogger(__name__)
+
+CRAWL_STATE_FILENAME = '{spider_name}_crawl_state.sqlite3'
+FINGERPRINT_FIELDS = ('title', 'price', 'description', 'author_phone', 'images', 'metadata')
+SQLITE_MAX_VARIABLES = 500
+
+# метки change_type у продуктов в режиме DELTA_OUTPUT_ENABLED
+CHANGE_NEW = 'new'
+CHANGE_CHANGED = 'changed'
+CHANGE_UNCHANGED = 'unchanged'
+CHANGE_REMOVED = 'removed'
+
+
+def get_item_fingerprint(item) -> str:
+    """Хеш содержимого продукта, по которому видно, менялось ли объявление."""
+    adapter = ItemAdapter(item)
+    content = [adapter.get(field) for field in FINGERPRINT_FIELDS]
+    serialized = json.dumps(content, ensure_ascii=False, sort_keys=True, default=list)
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+
+class CrawlStateStore:
+    """
+    Состояние краулинга между запусками: время обновления и хеш каждого
+    собранного объявления, отметки о последних спаршенных объявлениях
+    по категориям и расписание повторных обходов категорий. Изменения
+    фиксируются короткими транзакциями: пачками по checkpoint_items и не реже
+    раза в checkpoint_interval секунд (по таймеру паука, а не при следующей
+    записи), поэтому блокировка записи в общей базе надолго не держится,
+    а после падения паук продолжает почти с того же места.
+    """
+
+    def __init__(self, path: Path, checkpoint_items: int = 50, checkpoint_interval: float = 5.0):
+        self.path = path
+        self.checkpoint_items = checkpoint_items
+        self.checkpoint_interval = checkpoint_interval
+        self._uncommitted = 0
+        self._last_checkpoint = time.monotonic()
+        self.opened_at = int(time.time())
+
+        self.connection = sqlite3.connect(str(path), timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS ads (
+                item_id TEXT PRIMARY KEY,
+                updated_timestamp INTEGER NOT NULL,
+                content_hash TEXT,
+                category_url TEXT,
+                seen_at INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ads_category_url ON ads (category_url);
+            CREATE TABLE IF NOT EXISTS category_watermarks (
+                category_url TEXT PRIMARY KEY,
+                timestamp INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS category_schedules (
+                category_url TEXT PRIMARY KEY,
+                rate REAL,
+                last_visit REAL,
+                next_visit REAL NOT NULL
+            );
+        ''')
+        self.connection.commit()
+
+    def get_ads_updated_timestamps(self, item_ids: Iterable[str]) -> dict:
+        item_ids = list(item_ids)
+        result = dict()
+        for chunk_start in range(0, len(item_ids), SQLITE_MAX_VARIABLES):
+            chunk = item_ids[chunk_start:chunk_start + SQLITE_MAX_VARIABLES]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f'SELECT item_id, updated_timestamp FROM ads WHERE item_id IN ({placeholders})', chunk
+            )
+            result.update(rows)
+        return result
+
+    def get_content_hash(self, item_id: str) -> Optional[str]:
+        row = self.connection.execute('SELECT content_hash FROM ads WHERE item_id = ?', (item_id,)).fetchone()
+        return row[0] if row else None
+
+    def mark_ads_seen(self, item_ids: Iterable[str]):
+        """Объявления есть в выдаче, даже если их продукты не скачивались."""
+        item_ids = list(item_ids)
+        now = int(time.time())
+        for chunk_start in range(0, len(item_ids), SQLITE_MAX_VARIABLES):
+            chunk = item_ids[chunk_start:chunk_start + SQLITE_MAX_VARIABLES]
+            placeholders = ', '.join('?' * len(chunk))
+            self.connection.execute(f'UPDATE ads SET seen_at = ? WHERE item_id IN ({placeholders})', [now, *chunk])
+        self._uncommitted += len(item_ids)
+        self.checkpoint()
+
+    def count_category_ads(self, category_url: str, seen_before: Optional[int] = None) -> int:
+        if seen_before is None:
+            row = self.connection.execute('SELECT COUNT(*) FROM ads WHERE category_url = ?', (category_url,))
+        else:
+            row = self.connection.execute('SELECT COUNT(*) FROM ads WHERE category_url = ? AND seen_at < ?',
+                                          (category_url, seen_before))
+        return row.fetchone()[0]
+
+    def pop_unseen_ads(self, category_url: str, seen_before: int) -> list:
+        """Удаляет и возвращает объявления категории, которых не было в выдаче с момента seen_before."""
+        item_ids = [item_id for item_id, in self.connection.execute(
+            'SELECT item_id FROM ads WHERE category_url = ? AND seen_at < ?', (category_url, seen_before)
+        )]
+        self.connection.execute('DELETE FROM ads WHERE category_url = ? AND seen_at < ?', (category_url, seen_before))
+        self.checkpoint(force=True)
+        return item_ids
+
+    def save_ad(self, item_id: str, updated_timestamp: int, content_hash: Optional[str],
+                category_url: Optional[str] = None):
+        self.connection.execute(
+            '''
+            INSERT INTO ads (item_id, updated_timestamp, content_hash, category_url, seen_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (item_id) DO UPDATE SET
+                updated_timestamp = MAX(updated_timestamp, excluded.updated_timestamp),
+                content_hash = excluded.content_hash,
+                category_url = COALESCE(excluded.category_url, category_url),
+                seen_at = excluded.seen_at
+            ''',
+            (item_id, updated_timestamp, content_hash, category_url, int(time.time())),
+        )
+        self._uncommitted += 1
+        self.checkpoint()
+
+    def get_category_watermarks(self) -> dict:
+        return dict(self.connection.execute('SELECT category_url, timestamp FROM category_watermarks'))
+
+    def save_category_watermarks(self, category_stats: dict):
+        self.connection.executemany(
+            '''
+            INSERT INTO category_watermarks (category_url, timestamp) VALUES (?, ?)
+            ON CONFLICT (category_url) DO UPDATE SET timestamp = MAX(timestamp, excluded.timestamp)
+            ''',
+            category_stats.items(),
+        )
+        self.checkpoint(force=True)
+
+    def get_category_schedules(self) -> dict:
+        rows = self.connection.execute('SELECT category_url, rate, last_visit, next_visit FROM category_schedules')
+        return {category_url: CategorySchedule(rate, last_visit, next_visit)
+                for category_url, rate, last_visit, next_visit in rows}
+
+    def save_category_schedule(self, category_url: str, schedule: CategorySchedule):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO category_schedules VALUES (?, ?, ?, ?)',
+            (category_url, schedule.rate, schedule.last_visit, schedule.next_visit),
+        )
+        self._uncommitted += 1
+        self.checkpoint()
+
+    def checkpoint(self, force: bool = False) -> bool:
+        """Фиксирует накопленные изменения, если их много или давно не сохраняли."""
+        if not self.connection.in_transaction:
+            return False
+        if not force and self._uncommitted < self.checkpoint_items \
+                and time.monotonic() - self._last_checkpoint < self.checkpoint_interval:
+            return False
+
+        self.connection.commit()
+        logger.debug(f'Crawl state checkpoint: {self._uncommitted} changes saved to {self.path}')
+        self._uncommitted = 0
+        self._last_checkpoint = time.monotonic()
+        return True
+
+    def close(self):
+        self.checkpoint(force=True)
+        self.connection.close()
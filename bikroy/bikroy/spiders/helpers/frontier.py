@@ -0,0 +1,222 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+from urllib.parse import urlparse
+
+from .id_set import pack_ad_id
+
+DEFAULT_LEASE_SECONDS = 30 * 60
+
+# возврат просроченных аренд и выдача шарда одним скриптом: Redis выполняет его атомарно,
+# поэтому шард не теряется, если воркер упадёт между RPOP и HSET
+REDIS_POP_SCRIPT = '''
+local leases = redis.call('HGETALL', KEYS[2])
+for i = 1, #leases, 2 do
+    if tonumber(leases[i + 1]) < tonumber(ARGV[1]) then
+        redis.call('HDEL', KEYS[2], leases[i])
+        redis.call('LPUSH', KEYS[1], leases[i])
+    end
+end
+local url = redis.call('RPOP', KEYS[1])
+if url then
+    redis.call('HSET', KEYS[2], url, ARGV[2])
+end
+return url
+'''
+
+
+class Frontier:
+    """
+    Общая очередь шардов (конечных категорий и локаций) для нескольких
+    процессов паука. Взятый шард сдаётся в аренду: если воркер упал и не
+    отметил его выполненным, после истечения аренды шард берёт другой.
+    Заодно фронтир хранит общее множество уже запланированных объявлений.
+    """
+
+    def push(self, urls: Iterable[str]):
+        raise NotImplementedError
+
+    def pop(self, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Optional[str]:
+        raise NotImplementedError
+
+    def done(self, url: str):
+        raise NotImplementedError
+
+    def claim_ads(self, ad_ids: list) -> set:
+        """Отмечает объявления запланированными и возвращает те, которых ещё не было."""
+        raise NotImplementedError
+
+    def release_ads(self, ad_ids: list):
+        """Снимает отметку с объявлений, продукты которых не скачались."""
+        raise NotImplementedError
+
+    def has_unfinished(self) -> bool:
+        raise NotImplementedError
+
+    def set_discovery_done(self):
+        raise NotImplementedError
+
+    def is_discovery_done(self) -> bool:
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteFrontier(Frontier):
+    """Фронтир в файле SQLite: подходит для нескольких процессов на одной машине."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.connection = sqlite3.connect(str(path), timeout=60, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS shards (
+                url TEXT PRIMARY KEY,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                leased_until REAL NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS shards_state ON shards (state, leased_until);
+            CREATE TABLE IF NOT EXISTS seen_ads (ad_id BLOB PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS frontier_meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+
+    def push(self, urls: Iterable[str]):
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO shards (url) VALUES (?)', ((url,) for url in urls))
+
+    def pop(self, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Optional[str]:
+        now = time.time()
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute(
+                '''
+                SELECT url FROM shards
+                WHERE state = 'pending' OR (state = 'leased' AND leased_until < ?)
+                LIMIT 1
+                ''',
+                (now,),
+            ).fetchone()
+            if row:
+                self.connection.execute(
+                    "UPDATE shards SET state = 'leased', worker_id = ?, leased_until = ? WHERE url = ?",
+                    (worker_id, now + lease_seconds, row[0]),
+                )
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+        return row[0] if row else None
+
+    def done(self, url: str):
+        with self.connection:
+            self.connection.execute("UPDATE shards SET state = 'done' WHERE url = ?", (url,))
+
+    def claim_ads(self, ad_ids: list) -> set:
+        claimed = set()
+        with self.connection:
+            for ad_id in ad_ids:
+                cursor = self.connection.execute('INSERT OR IGNORE INTO seen_ads (ad_id) VALUES (?)',
+                                                 (pack_ad_id(ad_id),))
+                if cursor.rowcount:
+                    claimed.add(ad_id)
+        return claimed
+
+    def release_ads(self, ad_ids: list):
+        with self.connection:
+            self.connection.executemany('DELETE FROM seen_ads WHERE ad_id = ?',
+                                        ((pack_ad_id(ad_id),) for ad_id in ad_ids))
+
+    def has_unfinished(self) -> bool:
+        row = self.connection.execute("SELECT 1 FROM shards WHERE state != 'done' LIMIT 1").fetchone()
+        return row is not None
+
+    def set_discovery_done(self):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO frontier_meta VALUES ('discovery_done', '1')")
+
+    def is_discovery_done(self) -> bool:
+        row = self.connection.execute("SELECT value FROM frontier_meta WHERE key = 'discovery_done'").fetchone()
+        return row is not None
+
+    def reset(self):
+        with self.connection:
+            self.connection.execute('DELETE FROM shards')
+            self.connection.execute('DELETE FROM seen_ads')
+            self.connection.execute('DELETE FROM frontier_meta')
+
+    def close(self):
+        self.connection.close()
+
+
+class RedisFrontier(Frontier):
+    """Фронтир в Redis для воркеров на разных машинах. Нужен пакет redis."""
+
+    def __init__(self, url: str, prefix: str = 'bikroy:frontier'):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.pending_key = f'{prefix}:pending'
+        self.known_key = f'{prefix}:known'
+        self.leases_key = f'{prefix}:leases'
+        self.done_key = f'{prefix}:done'
+        self.seen_ads_key = f'{prefix}:seen_ads'
+        self.discovery_key = f'{prefix}:discovery_done'
+        self.pop_script = self.redis.register_script(REDIS_POP_SCRIPT)
+
+    def push(self, urls: Iterable[str]):
+        for url in urls:
+            if self.redis.sadd(self.known_key, url):
+                self.redis.lpush(self.pending_key, url)
+
+    def pop(self, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Optional[str]:
+        now = time.time()
+        url = self.pop_script(keys=[self.pending_key, self.leases_key], args=[now, now + lease_seconds])
+        return url.decode() if url is not None else None
+
+    def done(self, url: str):
+        self.redis.hdel(self.leases_key, url)
+        self.redis.sadd(self.done_key, url)
+
+    def claim_ads(self, ad_ids: list) -> set:
+        pipeline = self.redis.pipeline()
+        for ad_id in ad_ids:
+            pipeline.sadd(self.seen_ads_key, pack_ad_id(ad_id))
+        return {ad_id for ad_id, added in zip(ad_ids, pipeline.execute()) if added}
+
+    def release_ads(self, ad_ids: list):
+        self.redis.srem(self.seen_ads_key, *(pack_ad_id(ad_id) for ad_id in ad_ids))
+
+    def has_unfinished(self) -> bool:
+        return bool(self.redis.llen(self.pending_key) or self.redis.hlen(self.leases_key))
+
+    def set_discovery_done(self):
+        self.redis.set(self.discovery_key, 1)
+
+    def is_discovery_done(self) -> bool:
+        return bool(self.redis.exists(self.discovery_key))
+
+    def reset(self):
+        self.redis.delete(self.pending_key, self.known_key, self.leases_key, self.done_key,
+                          self.seen_ads_key, self.discovery_key)
+
+    def close(self):
+        self.redis.close()
+
+
+def get_frontier(uri: str) -> Frontier:
+    """
+    sqlite:///relative/path.sqlite3, sqlite:////absolute/path.sqlite3
+    или redis://host:port/db
+    """
+    parsed_uri = urlparse(uri)
+    if parsed_uri.scheme == 'sqlite':
+        return SQLiteFrontier(Path(parsed_uri.path[1:]))
+    if parsed_uri.scheme in ('redis', 'rediss'):
+        return RedisFrontier(uri)
+    raise ValueError(f'Unknown frontier backend: {uri}')
@@ -1,27 +1,64 @@
 import json
 import logging
+import time
 from json import JSONDecodeError
 from pathlib import Path
-from urllib.parse import urljoin, urlparse
+from urllib.parse import parse_qsl, urljoin, urlparse
+
+from w3lib.url import add_or_replace_parameters
 
 logger = logging.getLogger(__name__)
 
-CACHE_CATEGORY_PATH = Path('./bikroy/spiders/cache')
+# папка spiders/cache самого проекта: от текущей папки кеши зависеть не должны,
+# иначе запуск из другого места молча начнёт с пустых кешей
+CACHE_CATEGORY_PATH = Path(__file__).resolve().parent.parent / 'cache'
 CATEGORY_STATS_FILENAME = '{spider_name}_parsed_category_stats.json'
+CATEGORY_TREE_FILENAME = '{spider_name}_category_tree.json'
+
+# тип страницы по колбэку запроса: навигация по дереву категорий, выдача, продукт
+REQUEST_TYPES = {
+    'parse_categories': 'navigation',
+    'parse': 'listing',
+    'parse_product': 'product',
+}
+
+
+# сигнал паука: продукт объявления (ad_id) не скачался, и объявление можно запланировать снова
+ad_request_failed = object()
 
 
 def get_url_without_query(url: str) -> str:
     return urljoin(url, urlparse(url).path)
 
 
-def get_latest_category_stats(spider_name: str) -> dict:
+def get_request_type(request) -> str:
+    if 'image_uuid' in request.meta:
+        return 'image'
+    callback_name = getattr(request.callback, '__name__', 'parse')
+    return REQUEST_TYPES.get(callback_name, 'other')
+
+
+def get_canonical_url(url: str) -> str:
+    """
+    Сайт редиректит при любом удобном случае, замедляя паука
+    в несколько раз. Нужно ставить query-params в алфавитном
+    порядке и удалять "www.", хотя сайт сам его даёт.
+    """
+    sorted_params = sorted(parse_qsl(urlparse(url).query))
+    sorted_query = {key: value for key, value in sorted_params}
+
+    url = add_or_replace_parameters(get_url_without_query(url), sorted_query)
+    return url.replace('://www.', '://')
+
+
+def get_latest_category_stats(spider_name: str, cache_path: Path = CACHE_CATEGORY_PATH) -> dict:
     """
     Получить файл, содержащий данные о самом раннем спаршенном
     продукте по всем ранее собранным категориям.
     """
     latest_category_stats = dict()
     filename = CATEGORY_STATS_FILENAME.format(spider_name=spider_name)
-    filepath = CACHE_CATEGORY_PATH / filename
+    filepath = cache_path / filename
     try:
         with open(filepath) as file:
             latest_category_stats = json.load(file)
@@ -34,8 +71,43 @@ def get_latest_category_stats(spider_name: str) -> dict:
     return latest_category_stats
 
 
-def save_current_category_stats(spider_name: str, category_stats: dict):
-    filename = CATEGORY_STATS_FILENAME.format(spider_name=spider_name)
-    filepath = CACHE_CATEGORY_PATH / filename
+def _load_category_trees(filepath: Path) -> dict:
+    try:
+        with open(filepath) as file:
+            return json.load(file)
+    except OSError as e:
+        logger.debug(f"Can't open {filepath}: {e}")
+    except JSONDecodeError as e:
+        logger.debug(f"Can't load data from {filepath}: {e}")
+    return dict()
+
+
+def get_cached_category_tree(spider_name: str, ttl: int, cache_path: Path = CACHE_CATEGORY_PATH) -> dict:
+    """
+    Возвращает ссылки на конечные категории для каждой стартовой ссылки,
+    если дерево категорий было обойдено не раньше, чем ttl секунд назад.
+    """
+    filepath = cache_path / CATEGORY_TREE_FILENAME.format(spider_name=spider_name)
+    category_trees = _load_category_trees(filepath)
+
+    min_timestamp = time.time() - ttl
+    return {start_url: tree['leaf_urls'] for start_url, tree in category_trees.items()
+            if tree['timestamp'] >= min_timestamp}
+
+
+def get_known_leaf_urls(spider_name: str, cache_path: Path = CACHE_CATEGORY_PATH) -> set:
+    """Все конечные категории из сохранённого дерева, даже если оно устарело."""
+    filepath = cache_path / CATEGORY_TREE_FILENAME.format(spider_name=spider_name)
+    return {url for tree in _load_category_trees(filepath).values() for url in tree['leaf_urls']}
+
+
+def save_category_tree(spider_name: str, leaf_urls_by_start_url: dict, cache_path: Path = CACHE_CATEGORY_PATH):
+    filepath = cache_path / CATEGORY_TREE_FILENAME.format(spider_name=spider_name)
+    category_trees = _load_category_trees(filepath)
+
+    timestamp = int(time.time())
+    for start_url, leaf_urls in leaf_urls_by_start_url.items():
+        category_trees[start_url] = {'timestamp': timestamp, 'leaf_urls': sorted(leaf_urls)}
+
     with open(filepath, 'w') as file:
-        file.write(json.dumps(category_stats))
+        file.write(json.dumps(category_trees))
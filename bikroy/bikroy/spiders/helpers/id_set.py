@@ -0,0 +1,147 @@
+import hashlib
+import heapq
+import math
+import mmap
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
+ID_SIZE = 12
+MIN_PENDING_MERGE = 65536
+
+
+def pack_ad_id(ad_id: str) -> bytes:
+    """
+    Упаковывает id объявления в 12 байт: hex ObjectId переводится в байты
+    как есть, всё остальное (например, slug) заменяется хешем той же длины.
+    """
+    if len(ad_id) == ID_SIZE * 2:
+        try:
+            return bytes.fromhex(ad_id)
+        except ValueError:
+            pass
+    return hashlib.blake2b(ad_id.encode(), digest_size=ID_SIZE).digest()
+
+
+class SortedIdArray:
+    """Неизменяемый отсортированный массив упакованных id поверх bytes или mmap."""
+
+    def __init__(self, buffer=b''):
+        self.buffer = buffer
+        self.count = len(buffer) // ID_SIZE
+
+    def __contains__(self, packed_id: bytes) -> bool:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * ID_SIZE
+            current = self.buffer[offset:offset + ID_SIZE]
+            if current < packed_id:
+                low = middle + 1
+            elif current > packed_id:
+                high = middle
+            else:
+                return True
+        return False
+
+    def __iter__(self) -> Iterator[bytes]:
+        for offset in range(0, self.count * ID_SIZE, ID_SIZE):
+            yield self.buffer[offset:offset + ID_SIZE]
+
+    def __len__(self):
+        return self.count
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, packed_id: bytes) -> Iterator[int]:
+        digest = hashlib.blake2b(packed_id, digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], 'little')
+        second_hash = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (first_hash + i * second_hash) % self.size
+
+    def add(self, packed_id: bytes):
+        for position in self._positions(packed_id):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, packed_id: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(packed_id))
+
+
+class ObjectIdSet:
+    """
+    Компактное множество 12-байтных id. Ранее сохранённые id читаются
+    из файла через mmap, новые копятся в обычном set и периодически
+    вливаются в отсортированный массив, где на id уходит ровно 12 байт.
+    Фильтр Блума (если задан capacity) отсекает большинство новых id
+    без бинарного поиска.
+    """
+
+    def __init__(self, path: Optional[Path] = None, bloom_capacity: int = 0, bloom_error_rate: float = 0.01):
+        self.path = path
+        self._file = None
+        self._base = SortedIdArray()
+        self._merged = SortedIdArray()
+        self._pending: set[bytes] = set()
+        self._bloom = BloomFilter(bloom_capacity, bloom_error_rate) if bloom_capacity else None
+
+        if path and path.exists():
+            self._open_base(path)
+            if self._bloom is not None:
+                for packed_id in self._base:
+                    self._bloom.add(packed_id)
+
+    def _open_base(self, path: Path):
+        if not path.stat().st_size:  # пустой файл нельзя отобразить в память
+            return
+        self._file = open(path, 'rb')
+        self._base = SortedIdArray(mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def add(self, packed_id: bytes) -> bool:
+        """Возвращает False, если id уже был в множестве."""
+        if packed_id in self:
+            return False
+
+        self._pending.add(packed_id)
+        if self._bloom is not None:
+            self._bloom.add(packed_id)
+        if len(self._pending) >= max(MIN_PENDING_MERGE, len(self._merged) // 4):
+            self._merge_pending()
+        return True
+
+    def __contains__(self, packed_id: bytes) -> bool:
+        if self._bloom is not None and packed_id not in self._bloom:
+            return False
+        return packed_id in self._pending or packed_id in self._merged or packed_id in self._base
+
+    def __len__(self):
+        return len(self._base) + len(self._merged) + len(self._pending)
+
+    def _merge_pending(self):
+        merged = heapq.merge(self._merged, sorted(self._pending))
+        self._merged = SortedIdArray(b''.join(merged))
+        self._pending.clear()
+
+    def save(self, path: Optional[Path] = None):
+        """Сохраняет все id одним отсортированным файлом, пригодным для mmap."""
+        path = path or self.path
+        self._merge_pending()
+        tmp_path = path.with_name(f'{path.name}.tmp')
+        with open(tmp_path, 'wb') as file:
+            file.writelines(heapq.merge(self._base, self._merged))
+        self.close()
+        os.replace(tmp_path, path)
+        self._merged = SortedIdArray()
+        self._open_base(path)
+
+    def close(self):
+        if self._file is not None:
+            self._base.buffer.close()
+            self._file.close()
+            self._file = None
+            self._base = SortedIdArray()
@@ -0,0 +1,93 @@
+import re
+from typing import Any, Iterable
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    import json
+
+    json_loads = json.loads
+
+INITIAL_DATA_RE = re.compile(rb'window\.initialData\s*=\s*')
+SCRIPT_END = b'</script>'
+# строки пропускаются целиком, чтобы скобки внутри них не сбивали подсчёт
+STRING_PATTERN = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+# всё до следующей скобки вне строк
+FLAT_PATTERN = rb'[^"{}\[\]]*(?:' + STRING_PATTERN + rb'[^"{}\[\]]*)*'
+# следующая скобка вне строк; открывающая попадает в группу open
+BRACKET_RE = re.compile(FLAT_PATTERN + rb'(?:(?P<open>[{\[])|[}\]])', re.DOTALL)
+
+SCALAR_RE = re.compile(STRING_PATTERN + rb'|[^\s,}\]]+', re.DOTALL)
+WHITESPACE_RE = re.compile(rb'\s*')
+
+OPEN_BRACKETS = frozenset(b'{[')
+
+
+def extract_initial_data(body: bytes, path: Iterable[str] = ()) -> Any:
+    """
+    Достаёт из сырой страницы объект window.initialData без декодирования
+    всего HTML. Поиск ограничен скриптом (до </script>). Если указан путь
+    ключей, JSON-декодером разбирается только нужное поддерево, соседние
+    значения лишь пропускаются по скобкам. Бросает KeyError, если ключа из пути нет.
+    """
+    marker = INITIAL_DATA_RE.search(body)
+    if not marker:
+        raise ValueError('window.initialData not found')
+    script_end = body.find(SCRIPT_END, marker.end())
+    if script_end == -1:
+        raise ValueError('Unterminated window.initialData script')
+
+    value_start = _skip_whitespace(body, marker.end())
+    for key in path:
+        value_start = _find_member(body, value_start, key, script_end)
+
+    value_end = _find_value_end(body, value_start, script_end)
+    return json_loads(body[value_start:value_end])
+
+
+def _skip_whitespace(body: bytes, pos: int) -> int:
+    return WHITESPACE_RE.match(body, pos).end()
+
+
+def _find_member(body: bytes, object_start: int, key: str, end: int) -> int:
+    """Возвращает позицию значения ключа key в объекте, начинающемся с object_start."""
+    if body[object_start:object_start + 1] != b'{':
+        raise KeyError(key)
+
+    # ключ - строка, сразу за которой двоеточие; внутри строки кавычка была бы экранирована
+    member_re = re.compile(rb'(?<!\\)"' + re.escape(key.encode()) + rb'"\s*:\s*')
+    depth = 0
+    for bracket in BRACKET_RE.finditer(body, object_start + 1, end):
+        # ключ ищется только на верхнем уровне объекта, вложенные значения пропускаются по скобкам
+        if depth == 0:
+            member = member_re.search(body, bracket.start(), bracket.end() - 1)
+            if member:
+                return member.end()
+        if bracket.lastindex:
+            depth += 1
+        else:
+            depth -= 1
+            if depth < 0:
+                break
+    raise KeyError(key)
+
+
+def _find_value_end(body: bytes, value_start: int, end: int) -> int:
+    """Возвращает позицию сразу за значением, начинающимся с value_start."""
+    if body[value_start] not in OPEN_BRACKETS:
+        scalar = SCALAR_RE.match(body, value_start, end)
+        if not scalar:
+            raise ValueError(f'Broken JSON value at {value_start}')
+        return scalar.end()
+
+    depth = 0
+    for bracket in BRACKET_RE.finditer(body, value_start, end):
+        if bracket.lastindex:
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return bracket.end()
+    raise ValueError('Unterminated JSON object in window.initialData')
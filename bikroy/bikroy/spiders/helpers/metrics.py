@@ -0,0 +1,133 @@
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Optional
+
+TIME_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """Гистограмма в стиле Prometheus: число значений до каждой границы, сумма и количество."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self) -> list:
+        result, total = [], 0
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def get_quantile(self, quantile: float) -> float:
+        """Оценка квантиля по верхней границе корзины, в которую он попал."""
+        rank = quantile * self.count
+        for bound, total in zip(self.buckets, self.get_cumulative_counts()):
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class MetricsRegistry:
+    """
+    Счётчики, значения и гистограммы с метками. Рассчитан на горячий путь:
+    запись метрики - поиск в словаре и bisect. Отдаёт всё в текстовом формате Prometheus.
+    """
+
+    def __init__(self):
+        self.descriptions: dict[str, tuple[str, str, Optional[tuple]]] = {}
+        self.counters: dict[tuple, float] = {}
+        self.gauges: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+
+    def describe(self, name: str, metric_type: str, help_text: str, buckets: tuple = None):
+        self.descriptions[name] = (metric_type, help_text, buckets)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(labels.items()))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges[(name, tuple(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(labels.items()))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            buckets = self.descriptions.get(name, (None, None, None))[2] or TIME_BUCKETS
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def get_histograms(self, name: str) -> dict[tuple, Histogram]:
+        return {labels: histogram for (metric_name, labels), histogram in self.histograms.items()
+                if metric_name == name}
+
+    def render(self) -> str:
+        lines = []
+        samples_by_name: dict[str, list] = {}
+        for (name, labels), value in list(self.counters.items()) + list(self.gauges.items()):
+            samples_by_name.setdefault(name, []).append(f'{name}{format_labels(labels)} {value}')
+        for (name, labels), histogram in self.histograms.items():
+            samples = samples_by_name.setdefault(name, [])
+            bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+            for bound, total in zip(bounds, histogram.get_cumulative_counts()):
+                samples.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {total}')
+            samples.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+            samples.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+
+        for name, samples in sorted(samples_by_name.items()):
+            metric_type, help_text, _ = self.descriptions.get(name, ('untyped', None, None))
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+registry = MetricsRegistry()
+registry.describe('bikroy_parser_step_seconds', 'histogram', 'Time spent in a parser step')
+# шаги парсера замеряются, только пока работает MetricsExtension
+timing_enabled = False
+
+
+def set_timing_enabled(enabled: bool):
+    global timing_enabled
+    timing_enabled = enabled
+
+
+def timed(step: str) -> Callable:
+    """
+    Записывает время выполнения функции в bikroy_parser_step_seconds{step=...}.
+    Без METRICS_ENABLED просто вызывает функцию.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            if not timing_enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe('bikroy_parser_step_seconds', time.perf_counter() - start, step=step)
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,65 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable
+
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+_parser = None
+
+
+def _get_parser():
+    """Парсер создаётся один раз на процесс пула, вместе со своим кешем дат."""
+    global _parser
+    if _parser is None:
+        from ..bikroy_spider import BikroyComParser
+
+        _parser = BikroyComParser()
+    return _parser
+
+
+def extract_listing_data(body: bytes, listing_first: bool) -> dict:
+    return _get_parser().get_listing_data(body, listing_first)
+
+
+def extract_product_fields(body: bytes, url: str) -> dict:
+    return _get_parser().get_product_fields(body, url)
+
+
+class ParseOffloader:
+    """
+    Выносит декодирование window.initialData и сборку полей продукта
+    в пул процессов, чтобы поток реактора не стоял на больших страницах.
+    В пул одновременно отдаётся не больше max_pending задач, остальные
+    ждут в колбэках паука; пока они ждут, Scrapy не берёт новые ответы
+    сверх SCRAPER_SLOT_MAX_ACTIVE_SIZE и загрузчик притормаживает.
+    """
+
+    def __init__(self, workers: int, max_pending: int = 0):
+        # fork после запуска реактора скопировал бы в дочерние процессы сокеты и базы sqlite
+        self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        self.semaphore = defer.DeferredSemaphore(max_pending or workers * 2)
+        self.tasks = 0
+
+    async def run(self, func: Callable, *args):
+        return await maybe_deferred_to_future(self.semaphore.run(self._submit, func, *args))
+
+    def _submit(self, func: Callable, *args) -> defer.Deferred:
+        self.tasks += 1
+        deferred = defer.Deferred()
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda done: reactor.callFromThread(self._fire, deferred, done))
+        return deferred
+
+    @staticmethod
+    def _fire(deferred: defer.Deferred, future: Future):
+        try:
+            result = future.result()
+        except Exception:
+            deferred.errback(Failure())
+        else:
+            deferred.callback(result)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,48 @@
+import math
+from typing import Optional
+
+
+class CategoryProgress:
+    """
+    Обход страниц одной категории: сколько их всего, до какой уже
+    запланированы запросы, какие разобраны и на какой странице
+    встретилось объявление, собранное в прошлый раз.
+    """
+
+    def __init__(self, total_pages: int, scheduled_until: int = 1):
+        self.total_pages = total_pages
+        self.scheduled_until = scheduled_until
+        self.parsed_pages: set[int] = set()
+        self.stop_page: Optional[int] = None
+        self.finished = False
+
+    @classmethod
+    def from_pagination_data(cls, pagination_data: dict, scheduled_until: int = 1):
+        total_pages = math.ceil(pagination_data['total'] / pagination_data['pageSize'])
+        return cls(total_pages, scheduled_until)
+
+    @property
+    def last_page(self) -> int:
+        return self.stop_page if self.stop_page is not None else self.total_pages
+
+    def is_cancelled(self, page: int) -> bool:
+        return page > self.last_page
+
+    def stop(self, page: int):
+        """Дальше этой страницы идут уже собранные объявления."""
+        if self.stop_page is None or page < self.stop_page:
+            self.stop_page = page
+
+    def get_pages_to_schedule(self, page: int, window: int) -> range:
+        last_page = min(page + window, self.last_page)
+        pages = range(self.scheduled_until + 1, last_page + 1)
+        self.scheduled_until = max(self.scheduled_until, last_page)
+        return pages
+
+    def mark_parsed(self, page: int) -> bool:
+        """Возвращает True, когда разобраны все нужные страницы категории (один раз)."""
+        self.parsed_pages.add(page)
+        if self.finished:
+            return False
+        self.finished = all(page in self.parsed_pages for page in range(1, self.last_page + 1))
+        return self.finished
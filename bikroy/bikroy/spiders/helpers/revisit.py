@@ -0,0 +1,65 @@
+from typing import Optional
+
+
+class CategorySchedule:
+
+    def __init__(self, rate: Optional[float] = None, last_visit: Optional[float] = None, next_visit: float = 0.0):
+        self.rate = rate  # новых объявлений в секунду, сглаженное
+        self.last_visit = last_visit
+        self.next_visit = next_visit
+
+
+class RevisitScheduler:
+    """
+    Решает, когда снова обходить конечную категорию. По каждому обходу
+    считается скорость появления новых объявлений (EWMA), и следующий обход
+    назначается через время, за которое их наберётся около target_ads:
+    оживлённые категории обходятся раз в несколько минут, тихие - раз в часы.
+    """
+
+    def __init__(self, target_ads: float, min_interval: float, max_interval: float, smoothing: float,
+                 schedules: dict = None):
+        self.target_ads = target_ads
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.schedules: dict[str, CategorySchedule] = schedules or {}
+
+    def __contains__(self, category_url: str) -> bool:
+        return category_url in self.schedules
+
+    def is_due(self, category_url: str, now: float) -> bool:
+        schedule = self.schedules.get(category_url)
+        return schedule is None or schedule.next_visit <= now
+
+    def get_due(self, now: float) -> list:
+        return [category_url for category_url, schedule in self.schedules.items() if schedule.next_visit <= now]
+
+    def add(self, category_url: str, now: float):
+        """Категория, найденная в дереве, но ещё не обходившаяся, обходится сразу."""
+        self.schedules.setdefault(category_url, CategorySchedule(next_visit=now))
+
+    def record_visit(self, category_url: str, new_ads: int, now: float, since: Optional[float]) -> CategorySchedule:
+        """
+        since - время прошлого обхода, а если его нет, отметка самого свежего
+        объявления из прошлого запуска: новые объявления появились после неё.
+        """
+        schedule = self.schedules.setdefault(category_url, CategorySchedule())
+        since = schedule.last_visit or since
+        if since is not None and now > since:
+            observed_rate = new_ads / (now - since)
+            if schedule.rate is None:
+                schedule.rate = observed_rate
+            else:
+                schedule.rate = self.smoothing * observed_rate + (1 - self.smoothing) * schedule.rate
+
+        schedule.last_visit = now
+        schedule.next_visit = now + self.get_interval(schedule.rate)
+        return schedule
+
+    def get_interval(self, rate: Optional[float]) -> float:
+        if rate is None:
+            return self.min_interval
+        if not rate:
+            return self.max_interval
+        return min(self.max_interval, max(self.min_interval, self.target_ads / rate))
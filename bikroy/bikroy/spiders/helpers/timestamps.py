@@ -0,0 +1,134 @@
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+TIMESTAMP_CACHE_SIZE = 4096
+
+ISO_DATETIME_RE = re.compile(
+    r'^\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?)?(?:Z|[+-]\d{2}:?\d{2})?$'
+)
+RELATIVE_RE = re.compile(
+    r'^(?P<amount>\d+|an?|one)\s*'
+    r'(?P<unit>s|secs?|seconds?|m|mins?|minutes?|h|hrs?|hours?|d|days?|w|weeks?|months?|years?)'
+    r'(?:\s+ago)?$',
+    re.IGNORECASE,
+)
+
+RELATIVE_UNIT_SECONDS = {
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+    'w': 7 * 24 * 60 * 60,
+    'mo': 30 * 24 * 60 * 60,
+    'y': 365 * 24 * 60 * 60,
+}
+RELATIVE_WORDS_SECONDS = {
+    'now': 0,
+    'just now': 0,
+    'today': 0,
+    'yesterday': 24 * 60 * 60,
+}
+
+# единицы, которыми сайт округляет возраст объявления, от крупной к мелкой
+RELATIVE_RESOLUTIONS = sorted(set(RELATIVE_UNIT_SECONDS.values()), reverse=True)
+
+ABSOLUTE = 'absolute'
+RELATIVE = 'relative'
+
+
+def get_timestamp_resolution(timestamp: int, now: Optional[int] = None) -> int:
+    """
+    Точность времени, полученного из относительной даты: "3 days" означает
+    что-то между тремя и четырьмя днями, поэтому сравнивать такие значения
+    между запусками можно только с допуском в одну единицу.
+    """
+    age = (now or int(time.time())) - timestamp
+    for resolution in RELATIVE_RESOLUTIONS:
+        if age >= resolution:
+            return resolution
+    return RELATIVE_UNIT_SECONDS['m']
+
+
+class TimestampParser:
+    """
+    Переводит даты с сайта в unix timestamp. Известные форматы (ISO-строки
+    и относительные "5 mins", "2 days") разбираются регулярками, всё
+    остальное уходит в dateparser. Результаты запоминаются в ограниченном
+    LRU-кеше: для относительных дат хранится смещение, а не момент времени.
+    """
+
+    def __init__(self, cache_size: int = TIMESTAMP_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self.stats = {'cache_hit': 0, 'cache_miss': 0, 'fallback': 0, 'failed': 0}
+
+    def to_timestamp(self, value: str) -> Optional[int]:
+        """Возвращает None, если строку не удалось разобрать."""
+        if not isinstance(value, str) or not value:
+            return None
+
+        cached = self._cache.get(value)
+        if cached is not None:
+            self._cache.move_to_end(value)
+            self.stats['cache_hit'] += 1
+            return self._resolve(cached)
+
+        self.stats['cache_miss'] += 1
+        parsed = self._parse_fast(value)
+        if parsed is None:
+            parsed = self._parse_fallback(value)
+        if parsed is None:
+            self.stats['failed'] += 1
+            return None
+
+        self._cache[value] = parsed
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return self._resolve(parsed)
+
+    def _resolve(self, parsed: tuple[str, int]) -> int:
+        kind, value = parsed
+        if kind == RELATIVE:
+            return int(time.time()) - value
+        return value
+
+    def _parse_fast(self, value: str) -> Optional[tuple[str, int]]:
+        cleaned = value.strip()
+        if ISO_DATETIME_RE.match(cleaned):
+            return self._parse_iso(cleaned)
+
+        lowered = cleaned.lower()
+        if lowered in RELATIVE_WORDS_SECONDS:
+            return RELATIVE, RELATIVE_WORDS_SECONDS[lowered]
+
+        match = RELATIVE_RE.match(lowered)
+        if match:
+            amount = match['amount']
+            amount = int(amount) if amount.isdigit() else 1
+            unit = match['unit']
+            unit_key = 'mo' if unit.startswith('mo') else unit[0]
+            return RELATIVE, amount * RELATIVE_UNIT_SECONDS[unit_key]
+        return None
+
+    def _parse_iso(self, value: str) -> Optional[tuple[str, int]]:
+        if value.endswith('Z'):
+            value = f'{value[:-1]}+00:00'
+        try:
+            parsed_date = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        # наивные даты, как и в dateparser, считаются локальным временем
+        return ABSOLUTE, int(parsed_date.timestamp())
+
+    def _parse_fallback(self, value: str) -> Optional[tuple[str, int]]:
+        # dateparser импортируется долго, поэтому тянем его только по необходимости
+        import dateparser
+
+        parsed_date = dateparser.parse(value)
+        if parsed_date is None:
+            return None
+        self.stats['fallback'] += 1
+        return ABSOLUTE, int(parsed_date.timestamp())
@@ -0,0 +1,43 @@
+import pytest
+from scrapy.crawler import Crawler
+from scrapy.settings import Settings
+
+from bikroy import settings as project_settings
+from bikroy.spiders.bikroy_spider import BikroySpiderSpider
+
+# паук не должен трогать кеши проекта и открывать порты
+TEST_SETTINGS = {
+    'METRICS_ENABLED': False,
+    'TELNETCONSOLE_ENABLED': False,
+    'PARSE_OFFLOAD_WORKERS': 0,
+    'CATEGORY_TREE_TTL': 0,
+}
+
+
+@pytest.fixture
+def make_crawler(tmp_path):
+    """Краулер паука с настройками проекта; кеши и состояние краулинга - во временной папке."""
+    def make_crawler(**settings_overrides) -> Crawler:
+        settings = Settings()
+        settings.setmodule(project_settings, priority='project')
+        settings.update({**TEST_SETTINGS, 'SPIDER_CACHE_DIR': str(tmp_path / 'cache'), **settings_overrides},
+                        priority='cmdline')
+        return Crawler(BikroySpiderSpider, settings)
+
+    return make_crawler
+
+
+@pytest.fixture
+def make_spider(make_crawler):
+    spiders = []
+
+    def make_spider(settings: dict = None, **spider_args) -> BikroySpiderSpider:
+        crawler = make_crawler(**(settings or {}))
+        spider = BikroySpiderSpider.from_crawler(crawler, **spider_args)
+        crawler.spider = spider
+        spiders.append(spider)
+        return spider
+
+    yield make_spider
+    for spider in spiders:
+        spider.crawl_state.close()
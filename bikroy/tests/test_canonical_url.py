@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from bikroy.spiders.extensions.canonical_url import CanonicalUrlMiddleware
+
+SOURCE_URL = 'https://bikroy.com/en/ads/dhaka/mobiles'
+TARGET_URL = 'https://bikroy.com/en/ads/dhaka/mobile-phones'
+
+
+def get_redirected_response(source_url: str, target_url: str) -> HtmlResponse:
+    request = Request(target_url, meta={'redirect_urls': [source_url], 'redirect_reasons': [301]})
+    return HtmlResponse(target_url, body=b'', request=request)
+
+
+def test_rewrites_requests_before_scheduling(make_crawler):
+    middleware = CanonicalUrlMiddleware(make_crawler())
+    middleware.process_spider_input(get_redirected_response(SOURCE_URL, TARGET_URL), spider=None)
+
+    item = {'url': SOURCE_URL}
+    requests = [Request('https://www.bikroy.com/en/ads/dhaka/mobiles?page=2&sort=date'), Request(SOURCE_URL), item]
+    first, second, result_item = middleware.process_spider_output(None, requests, spider=None)
+    assert first.url == 'https://bikroy.com/en/ads/dhaka/mobiles?page=2&sort=date'
+    assert second.url == TARGET_URL and result_item is item
+    assert [request.url for request in middleware.process_start_requests([Request(SOURCE_URL)], None)] == [TARGET_URL]
+    assert middleware.stats.get_value('canonical_url/round_trips_saved') == 2
+
+
+def test_redirects_saved_to_missing_cache_dir(make_crawler, tmp_path):
+    crawler = make_crawler(SPIDER_CACHE_DIR=str(tmp_path / 'missing'))
+    middleware = CanonicalUrlMiddleware(crawler)
+    spider = SimpleNamespace(name='bikroy.com')
+    middleware.spider_opened(spider)
+    middleware.process_spider_input(get_redirected_response(SOURCE_URL, TARGET_URL), spider)
+    middleware.spider_closed(spider)
+
+    middleware = CanonicalUrlMiddleware(crawler)
+    middleware.spider_opened(spider)
+    assert middleware.resolve(SOURCE_URL) == (TARGET_URL, 1)
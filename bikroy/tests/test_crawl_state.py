@@ -0,0 +1,88 @@
+import sqlite3
+
+from bikroy.spiders.helpers.crawl_state import CrawlStateStore
+from bikroy.spiders.helpers.revisit import CategorySchedule
+
+CATEGORY_URL = 'https://bikroy.com/en/ads/dhaka/mobile-phones'
+
+
+def test_keeps_latest_updated_timestamp(tmp_path):
+    store = CrawlStateStore(tmp_path / 'state.sqlite3')
+    store.save_ad('ad-1', 200, 'hash-1', CATEGORY_URL)
+    store.save_ad('ad-1', 100, 'hash-2')
+
+    assert store.get_ads_updated_timestamps(['ad-1', 'ad-2']) == {'ad-1': 200}
+    assert store.get_content_hash('ad-1') == 'hash-2'
+    assert store.count_category_ads(CATEGORY_URL) == 1
+    store.close()
+
+
+def test_state_survives_reopen(tmp_path):
+    path = tmp_path / 'state.sqlite3'
+    store = CrawlStateStore(path, checkpoint_items=1000, checkpoint_interval=3600)
+    store.save_ad('ad-1', 100, None, CATEGORY_URL)
+    store.save_category_watermarks({CATEGORY_URL: 100})
+    store.save_category_schedule(CATEGORY_URL, CategorySchedule(rate=0.5, last_visit=10.0, next_visit=20.0))
+    store.close()
+
+    store = CrawlStateStore(path)
+    assert store.get_ads_updated_timestamps(['ad-1']) == {'ad-1': 100}
+    assert store.get_category_watermarks() == {CATEGORY_URL: 100}
+    schedule = store.get_category_schedules()[CATEGORY_URL]
+    assert (schedule.rate, schedule.last_visit, schedule.next_visit) == (0.5, 10.0, 20.0)
+    store.close()
+
+
+def test_watermarks_only_move_forward(tmp_path):
+    store = CrawlStateStore(tmp_path / 'state.sqlite3')
+    store.save_category_watermarks({CATEGORY_URL: 200})
+    store.save_category_watermarks({CATEGORY_URL: 100})
+    assert store.get_category_watermarks() == {CATEGORY_URL: 200}
+    store.close()
+
+
+def test_pop_unseen_ads(tmp_path):
+    store = CrawlStateStore(tmp_path / 'state.sqlite3')
+    store.save_ad('removed', 100, None, CATEGORY_URL)
+    store.save_ad('listed', 100, None, CATEGORY_URL)
+    store.connection.execute('UPDATE ads SET seen_at = 0')
+    store.mark_ads_seen(['listed'])
+
+    assert store.pop_unseen_ads(CATEGORY_URL, seen_before=1) == ['removed']
+    assert store.get_ads_updated_timestamps(['removed', 'listed']) == {'listed': 100}
+    store.close()
+
+
+def is_committed(path, item_id: str) -> bool:
+    reader = sqlite3.connect(str(path))
+    try:
+        return reader.execute('SELECT 1 FROM ads WHERE item_id = ?', (item_id,)).fetchone() is not None
+    finally:
+        reader.close()
+
+
+def test_commits_in_short_batches(tmp_path):
+    path = tmp_path / 'state.sqlite3'
+    store = CrawlStateStore(path, checkpoint_items=2, checkpoint_interval=3600)
+    store.save_ad('ad-1', 100, None, CATEGORY_URL)
+    assert not is_committed(path, 'ad-1')
+    store.save_ad('ad-2', 100, None, CATEGORY_URL)
+    assert is_committed(path, 'ad-1') and not store.connection.in_transaction
+    store.close()
+
+
+def test_timer_commits_without_new_writes(tmp_path):
+    path = tmp_path / 'state.sqlite3'
+    store = CrawlStateStore(path, checkpoint_items=1000, checkpoint_interval=0)
+    store.connection.execute('INSERT INTO ads VALUES (?, ?, ?, ?, ?)', ('ad-1', 100, None, CATEGORY_URL, 0))
+    # таймер паука вызывает checkpoint без записи: транзакция не должна ждать следующего объявления
+    assert store.checkpoint() and is_committed(path, 'ad-1')
+    assert not store.checkpoint()
+    store.close()
+
+
+def test_spider_runs_checkpoint_timer(make_spider):
+    spider = make_spider(settings={'CRAWL_STATE_CHECKPOINT_INTERVAL': 60})
+    spider.crawl_state_opened(spider)
+    assert spider.checkpoint_loop.running and spider.checkpoint_loop.interval == 60
+    spider.checkpoint_loop.stop()
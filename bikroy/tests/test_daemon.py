@@ -0,0 +1,94 @@
+import time
+from types import SimpleNamespace
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from bikroy.spiders.helpers.pagination import CategoryProgress
+from bikroy.spiders.helpers.revisit import RevisitScheduler
+
+CATEGORY_URL = 'https://bikroy.com/en/ads/dhaka/mobile-phones'
+
+
+def get_listing_data(*ads, total: int = 75) -> dict:
+    return {
+        'pagination': {'total': total, 'pageSize': 25},
+        'products': [{'id': ad_id, 'slug': f'ad-{ad_id}', 'updated_timestamp': updated_timestamp}
+                     for ad_id, updated_timestamp in ads],
+    }
+
+
+def parse_first_page(spider, listing_data: dict) -> list:
+    request = Request(CATEGORY_URL, meta={'category_url': CATEGORY_URL})
+    response = HtmlResponse(CATEGORY_URL, body=b'', request=request)
+    return list(spider.parse_listing_data(response, listing_data))
+
+
+def get_page_requests(results: list) -> list:
+    return [result for result in results if isinstance(result, Request) and 'category_page' in result.meta]
+
+
+def get_product_requests(results: list) -> dict:
+    return {result.meta['ad_id']: result for result in results
+            if isinstance(result, Request) and 'ad_id' in result.meta}
+
+
+def test_daemon_pagination_passes_dupe_filter(make_spider):
+    spider = make_spider(daemon='true')
+    pages = get_page_requests(parse_first_page(spider, get_listing_data(('a' * 24, 0))))
+    assert pages and all(request.dont_filter for request in pages)
+
+
+def test_single_run_pagination_is_filtered(make_spider):
+    spider = make_spider()
+    pages = get_page_requests(parse_first_page(spider, get_listing_data(('a' * 24, 0))))
+    assert pages and not any(request.dont_filter for request in pages)
+
+
+def test_changed_ad_is_refetched_outside_daemon(make_spider):
+    spider = make_spider()
+    # сравнение идёт с допуском точности относительной даты, поэтому даты свежие
+    collected_at = int(time.time()) - 10 * 24 * 60 * 60
+    spider.crawl_state.save_ad('changed', collected_at, None, CATEGORY_URL)
+    spider.crawl_state.save_ad('unchanged', collected_at, None, CATEGORY_URL)
+
+    updated_at = int(time.time()) - 10 * 60
+    requests = get_product_requests(parse_first_page(
+        spider, get_listing_data(('changed', updated_at), ('unchanged', collected_at), ('new', updated_at))))
+    assert set(requests) == {'changed', 'new'}
+    assert requests['changed'].dont_filter and not requests['new'].dont_filter
+    assert requests['changed'].meta['ad_changed'] and 'ad_changed' not in requests['new'].meta
+    assert requests['new'].errback == spider.product_failed
+
+
+def test_due_revisit_restarts_category_progress(make_spider):
+    spider = make_spider(daemon='true')
+    scheduled = []
+    spider.crawler.engine = SimpleNamespace(crawl=scheduled.append)
+    spider.revisit_scheduler.add(CATEGORY_URL, time.time() - 1)
+    finished = CategoryProgress(3, scheduled_until=3)
+    finished.parsed_pages.update({1, 2, 3})
+    spider.category_progress[CATEGORY_URL] = finished
+
+    spider.revisit_categories()
+    [request] = scheduled
+    assert request.url == CATEGORY_URL and request.dont_filter
+    assert CATEGORY_URL not in spider.category_progress
+    # повторный обход снова ставит в очередь следующие страницы
+    assert get_page_requests(parse_first_page(spider, get_listing_data(('a' * 24, 0))))
+
+
+def test_leaf_from_tree_walk_restarts_category_progress(make_spider):
+    spider = make_spider(daemon='true')
+    spider.category_progress[CATEGORY_URL] = CategoryProgress(3, scheduled_until=3)
+    assert spider.is_visit_due(CATEGORY_URL)
+    assert CATEGORY_URL not in spider.category_progress
+
+
+def test_revisit_interval_follows_new_ads_rate():
+    scheduler = RevisitScheduler(target_ads=10, min_interval=60, max_interval=3600, smoothing=1.0)
+    busy = scheduler.record_visit('busy', new_ads=100, now=1000.0, since=0.0)
+    quiet = scheduler.record_visit('quiet', new_ads=0, now=1000.0, since=0.0)
+    assert busy.next_visit == 1000.0 + 100
+    assert quiet.next_visit == 1000.0 + 3600
+    assert scheduler.get_due(1100.0) == ['busy']
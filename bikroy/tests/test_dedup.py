@@ -0,0 +1,78 @@
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from bikroy.spiders.extensions.dedup import AdDedupMiddleware
+from bikroy.spiders.helpers.frontier import get_frontier
+from bikroy.spiders.helpers.helpers import ad_request_failed
+
+
+def get_product_requests(*ad_ids, meta: dict = None, **request_kwargs) -> list:
+    return [Request(f'https://bikroy.com/en/ad/{ad_id}', meta={'ad_id': ad_id, **(meta or {})}, **request_kwargs)
+            for ad_id in ad_ids]
+
+
+def filter_requests(middleware, requests, spider=None) -> list:
+    return [request.meta['ad_id'] for request in middleware.process_spider_output(None, requests, spider=spider)]
+
+
+def scrape(middleware, *ad_ids):
+    for ad_id in ad_ids:
+        middleware.item_collected({'item_id': ad_id}, spider=None)
+
+
+def test_drops_ads_scheduled_before(make_crawler):
+    middleware = AdDedupMiddleware(make_crawler())
+    assert filter_requests(middleware, get_product_requests('a' * 24, 'b' * 24)) == ['a' * 24, 'b' * 24]
+    assert filter_requests(middleware, get_product_requests('a' * 24, 'slug-c')) == ['slug-c']
+    scrape(middleware, 'a' * 24)
+    assert filter_requests(middleware, get_product_requests('a' * 24)) == []
+    assert middleware.stats.get_value('dedup/filtered') == 2
+
+
+def test_dont_filter_does_not_bypass_dedup(make_crawler):
+    middleware = AdDedupMiddleware(make_crawler())
+    filter_requests(middleware, get_product_requests('a' * 24))
+    assert filter_requests(middleware, get_product_requests('a' * 24, dont_filter=True)) == []
+
+
+def test_changed_ad_passes_seen_ids_once(make_crawler):
+    middleware = AdDedupMiddleware(make_crawler())
+    filter_requests(middleware, get_product_requests('a' * 24))
+    scrape(middleware, 'a' * 24)
+    changed = get_product_requests('a' * 24, 'a' * 24, meta={'ad_changed': True})
+    assert filter_requests(middleware, changed) == ['a' * 24]
+
+
+def test_failed_download_is_released(make_crawler):
+    crawler = make_crawler()
+    middleware = AdDedupMiddleware.from_crawler(crawler)
+    filter_requests(middleware, get_product_requests('a' * 24, 'b' * 24))
+    crawler.signals.send_catch_log(signal=ad_request_failed, ad_id='a' * 24, spider=None)
+    request = Request('https://bikroy.com/en/ad/b', meta={'ad_id': 'b' * 24})
+    middleware.spider_error(None, HtmlResponse(request.url, request=request), spider=None)
+
+    assert filter_requests(middleware, get_product_requests('a' * 24, 'b' * 24)) == ['a' * 24, 'b' * 24]
+    assert middleware.stats.get_value('dedup/released') == 2
+    middleware.seen_ids.close()
+
+
+def test_failed_download_is_released_in_frontier(make_crawler, tmp_path):
+    middleware = AdDedupMiddleware(make_crawler())
+    spider = type('Spider', (), {'frontier': get_frontier(f'sqlite:///{tmp_path / "frontier.sqlite3"}')})()
+    assert filter_requests(middleware, get_product_requests('a' * 24), spider) == ['a' * 24]
+    assert filter_requests(middleware, get_product_requests('a' * 24), spider) == []
+    middleware.release_ad('a' * 24, spider)
+    assert filter_requests(middleware, get_product_requests('a' * 24), spider) == ['a' * 24]
+    spider.frontier.close()
+
+
+def test_only_scraped_ids_survive_restart(make_crawler, tmp_path):
+    path = tmp_path / 'seen_ads.bin'
+    middleware = AdDedupMiddleware(make_crawler(), path)
+    filter_requests(middleware, get_product_requests('a' * 24, 'b' * 24))
+    scrape(middleware, 'a' * 24)
+    middleware.spider_closed(spider=None)
+
+    middleware = AdDedupMiddleware(make_crawler(), path)
+    assert filter_requests(middleware, get_product_requests('a' * 24, 'b' * 24)) == ['b' * 24]
+    middleware.seen_ids.close()
@@ -0,0 +1,64 @@
+import pytest
+from itemadapter import ItemAdapter
+from scrapy import Request
+from scrapy.exceptions import DropItem
+from scrapy.http import HtmlResponse
+
+from bikroy.pipelines import DeltaPipeline
+from bikroy.spiders.helpers.crawl_state import CHANGE_CHANGED, CHANGE_NEW, CHANGE_REMOVED, CHANGE_UNCHANGED
+
+CATEGORY_URL = 'https://bikroy.com/en/ads/dhaka/mobile-phones'
+PRODUCT_URL = 'https://bikroy.com/en/ad/iphone-11-for-sale-dhaka'
+ITEM_ID = '5f0c8a1e2b3c4d5e6f708192'
+
+
+def scrape_product(spider, item_id: str = ITEM_ID, **fields):
+    request = Request(PRODUCT_URL, meta={'category_url': CATEGORY_URL, 'updated_timestamp': 1700000000})
+    response = HtmlResponse(PRODUCT_URL, body=b'', request=request)
+    product_fields = {'url': PRODUCT_URL, 'item_id': item_id, 'title': 'iPhone 11', 'price': 45000.0, **fields}
+    [item] = spider.parse_product_fields(response, product_fields)
+    return item
+
+
+def get_change_type(item) -> str:
+    return ItemAdapter(item)['change_type']
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_change_type_follows_content(make_spider, compact):
+    spider = make_spider(settings={'DELTA_OUTPUT_ENABLED': True, 'COMPACT_ITEMS': compact})
+    assert get_change_type(scrape_product(spider)) == CHANGE_NEW
+    assert get_change_type(scrape_product(spider)) == CHANGE_UNCHANGED
+    assert get_change_type(scrape_product(spider, price=40000.0)) == CHANGE_CHANGED
+
+
+def test_ads_missing_from_full_traversal_are_removed(make_spider):
+    spider = make_spider(settings={'DELTA_OUTPUT_ENABLED': True})
+    scrape_product(spider, item_id='removed')
+    scrape_product(spider, item_id='listed')
+    spider.crawl_state.connection.execute('UPDATE ads SET seen_at = 0')
+    spider.crawl_state.opened_at = 1
+    spider.crawl_state.mark_ads_seen(['listed'])
+
+    [removed] = spider.category_finished(CATEGORY_URL)
+    assert ItemAdapter(removed).asdict() == {'item_id': 'removed', 'change_type': CHANGE_REMOVED}
+    assert spider.crawl_state.get_ads_updated_timestamps(['removed', 'listed']).keys() == {'listed'}
+
+
+def test_partial_traversal_removes_nothing(make_spider):
+    spider = make_spider(settings={'DELTA_OUTPUT_ENABLED': True})
+    scrape_product(spider, item_id='removed')
+    scrape_product(spider, item_id='listed')
+    spider.crawl_state.connection.execute('UPDATE ads SET seen_at = 0')
+    spider.crawl_state.opened_at = 1
+    spider.partial_categories.add(CATEGORY_URL)
+    assert spider.category_finished(CATEGORY_URL) == []
+
+
+def test_pipeline_drops_unchanged_items(make_crawler):
+    crawler = make_crawler(DELTA_OUTPUT_ENABLED=True)
+    pipeline = DeltaPipeline.from_crawler(crawler)
+    new_item = {'item_id': ITEM_ID, 'change_type': CHANGE_NEW}
+    assert pipeline.process_item(new_item, spider=None) is new_item
+    with pytest.raises(DropItem):
+        pipeline.process_item({'item_id': ITEM_ID, 'change_type': CHANGE_UNCHANGED}, spider=None)
@@ -0,0 +1,72 @@
+import io
+import json
+
+import pytest
+
+from bikroy.exporters import NdjsonItemExporter
+from bikroy.items import CompactProductItem, ProductItem
+
+PRODUCT_FIELDS = {
+    'url': 'https://bikroy.com/en/ad/iphone-11-for-sale-dhaka',
+    'item_id': '5f0c8a1e2b3c4d5e6f708192',
+    'title': 'iPhone 11',
+    'price': 45000.0,
+    'creation_timestamp': 1700000000,
+    'images': [
+        'https://i.bikroy-st.com/iphone-11-for-sale-dhaka/0a1b2c3d-0000-1111-2222-333344445555/780/585/fitted.jpg',
+        'https://i.bikroy-st.com/iphone-11-for-sale-dhaka/0a1b2c3d-0000-1111-2222-666677778888/780/585/fitted.jpg',
+    ],
+    'metadata': {'Brand': 'Apple', 'Address': 'Dhaka'},
+    'address': 'Dhaka',
+}
+
+
+def export_ndjson(items, **kwargs) -> list:
+    output = io.BytesIO()
+    exporter = NdjsonItemExporter(output, batch_bytes=1, **kwargs)
+    exporter.start_exporting()
+    for item in items:
+        exporter.export_item(item)
+    exporter.finish_exporting()
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_ndjson_exports_one_object_per_line():
+    records = export_ndjson([ProductItem(PRODUCT_FIELDS), ProductItem(url='https://bikroy.com/en/ad/other')])
+    assert records == [PRODUCT_FIELDS, {'url': 'https://bikroy.com/en/ad/other'}]
+
+
+def test_compact_item_exports_like_product_item():
+    [record] = export_ndjson([CompactProductItem(PRODUCT_FIELDS)])
+    assert {field: value for field, value in record.items() if value is not None} == PRODUCT_FIELDS
+    assert set(record) == set(ProductItem.fields)
+
+
+def test_compact_items_share_address():
+    # строки собраны заново, как после распаковки результата из пула процессов
+    first, second = (CompactProductItem({**PRODUCT_FIELDS, 'address': ''.join(['Dha', 'ka']),
+                                         'metadata': {'Address': ''.join(['Dha', 'ka'])}}) for _ in range(2))
+    assert first.address is second.address is first.metadata['Address']
+
+
+def test_compact_item_respects_fields_to_export():
+    records = export_ndjson([CompactProductItem(PRODUCT_FIELDS)], fields_to_export=['item_id', 'images'])
+    assert records == [{'item_id': PRODUCT_FIELDS['item_id'], 'images': PRODUCT_FIELDS['images']}]
+
+
+def test_parquet_schema_keeps_fields_missing_from_first_batch():
+    parquet = pytest.importorskip('pyarrow.parquet')
+    from bikroy.exporters import ParquetItemExporter
+
+    output = io.BytesIO()
+    exporter = ParquetItemExporter(output, batch_items=1)
+    exporter.start_exporting()
+    exporter.export_item(ProductItem(url='https://bikroy.com/en/ad/first', metadata={'Brand': 'Apple'}))
+    exporter.export_item(ProductItem(PRODUCT_FIELDS))
+    exporter.finish_exporting()
+
+    output.seek(0)
+    first, second = parquet.read_table(output).to_pylist()
+    assert first['price'] is None and first['metadata.Brand'] == 'Apple'
+    assert second['price'] == 45000.0 and second['images'] == PRODUCT_FIELDS['images']
+    assert json.loads(second['metadata.other']) == {'Address': 'Dhaka'}
@@ -0,0 +1,24 @@
+from pathlib import Path
+from urllib.parse import urlparse
+
+from bikroy.runner import DEFAULT_FRONTIER, PROJECT_PATH
+from bikroy.spiders.helpers.frontier import get_frontier
+
+LEAF_URL = 'https://bikroy.com/en/ads/dhaka/mobile-phones'
+
+
+def test_default_frontier_does_not_depend_on_cwd():
+    path = Path(urlparse(DEFAULT_FRONTIER).path[1:])
+    assert path.is_absolute() and path.is_relative_to(PROJECT_PATH)
+
+
+def test_expired_lease_returns_shard(tmp_path):
+    frontier = get_frontier(f'sqlite:///{tmp_path / "frontier.sqlite3"}')
+    frontier.push([LEAF_URL, LEAF_URL])
+    assert frontier.pop('worker-1', lease_seconds=-1) == LEAF_URL
+    # первый воркер не отметил шард выполненным, аренда истекла
+    assert frontier.pop('worker-2') == LEAF_URL
+    assert frontier.pop('worker-3') is None
+    frontier.done(LEAF_URL)
+    assert not frontier.has_unfinished()
+    frontier.close()
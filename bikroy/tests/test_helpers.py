@@ -0,0 +1,22 @@
+from bikroy.spiders.helpers.helpers import CACHE_CATEGORY_PATH, get_cached_category_tree, get_known_leaf_urls, \
+    save_category_tree
+
+START_URL = 'https://bikroy.com/en/ads'
+LEAF_URL = 'https://bikroy.com/en/ads/dhaka/mobile-phones'
+
+
+def test_cache_path_does_not_depend_on_cwd():
+    assert CACHE_CATEGORY_PATH.is_absolute()
+    assert (CACHE_CATEGORY_PATH.parent / 'bikroy_spider.py').exists()
+
+
+def test_category_tree_is_kept_in_given_cache(tmp_path):
+    save_category_tree('test', {START_URL: {LEAF_URL}}, tmp_path)
+    assert get_cached_category_tree('test', 60, tmp_path) == {START_URL: [LEAF_URL]}
+    assert get_known_leaf_urls('test', tmp_path) == {LEAF_URL}
+
+
+def test_spider_keeps_caches_in_spider_cache_dir(make_spider, tmp_path):
+    spider = make_spider(settings={'SPIDER_CACHE_DIR': str(tmp_path / 'spider-cache')})
+    assert spider.cache_path == tmp_path / 'spider-cache'
+    assert spider.crawl_state.path.parent == spider.cache_path
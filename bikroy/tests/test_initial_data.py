@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from bikroy.benchmarks.corpus import CORPUS_PATH, load_corpus
+from bikroy.spiders.constants.bikroy_com import PRODUCT_DATA_PATH, SERP_DATA_PATH
+from bikroy.spiders.helpers.initial_data import extract_initial_data
+
+
+def get_page(initial_data, trailer: str = ';') -> bytes:
+    script = initial_data if isinstance(initial_data, str) else json.dumps(initial_data, ensure_ascii=False)
+    return (f'<html><script>var other = {{"serp": 1}};</script>'
+            f'<script>window.initialData = {script}{trailer}</script><p>{{"serp": 2}}</p></html>').encode()
+
+
+def test_returns_only_requested_subtree():
+    page = get_page({'locations': [{'serp': 'nested'}], 'serp': {'ads': {'data': [{'id': 'a' * 24}]}}})
+    assert extract_initial_data(page, ('serp', 'ads', 'data')) == [{'id': 'a' * 24}]
+
+
+def test_brackets_and_quotes_inside_strings_are_skipped():
+    page = get_page(r'{"title": "}{ \"serp\": [", "serp": {"title": "ঢাকা ]}", "price": 1.5}}')
+    assert extract_initial_data(page, ('serp',)) == {'title': 'ঢাকা ]}', 'price': 1.5}
+    assert extract_initial_data(page, ('serp', 'price')) == 1.5
+
+
+def test_key_of_sibling_object_is_not_matched():
+    page = get_page({'a': {'b': 1}, 'c': {'b': 2}})
+    with pytest.raises(KeyError):
+        extract_initial_data(page, ('a', 'x'))
+    with pytest.raises(KeyError):
+        extract_initial_data(page, ('a', 'b', 'c'))
+    assert extract_initial_data(page, ('c', 'b')) == 2
+
+
+def test_search_is_bounded_by_script():
+    # объект обрезан, а "serp" есть только после конца скрипта
+    page = get_page('{"ads": [1', trailer='')
+    with pytest.raises(KeyError):
+        extract_initial_data(page, ('serp',))
+    with pytest.raises(ValueError):
+        extract_initial_data(page)
+    with pytest.raises(ValueError):
+        extract_initial_data(b'<html></html>')
+
+
+def test_matches_full_decode_on_corpus():
+    corpus = load_corpus(CORPUS_PATH)
+    for kind, path in (('listing', SERP_DATA_PATH), ('product', PRODUCT_DATA_PATH)):
+        for page in corpus[kind]:
+            data = extract_initial_data(page.body)
+            for key in path:
+                data = data[key]
+            assert extract_initial_data(page.body, path) == data
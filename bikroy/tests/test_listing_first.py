@@ -0,0 +1,39 @@
+from itemadapter import ItemAdapter
+from scrapy import Request
+from scrapy.http import HtmlResponse
+
+from bikroy.benchmarks.corpus import CORPUS_PATH, load_corpus
+
+CATEGORY_URL = 'https://bikroy.com/en/ads/dhaka/mobile-phones'
+UPDATED_AT = 1700000000
+
+
+def get_listing_product(ad_id: str, updated_timestamp: int) -> dict:
+    listing_fields = {'url': f'https://bikroy.com/en/ad/ad-{ad_id}', 'item_id': ad_id, 'title': 'iPhone 11',
+                      'price': 45000.0, 'updated_timestamp': updated_timestamp}
+    return {'id': ad_id, 'slug': f'ad-{ad_id}', 'updated_timestamp': updated_timestamp,
+            'listing_fields': listing_fields}
+
+
+def test_listing_fields_keep_update_time_apart(make_spider):
+    spider = make_spider(settings={'LISTING_FIRST_ENABLED': True})
+    page = load_corpus(CORPUS_PATH)['listing'][0]
+    products = spider.get_listing_data(page.body, listing_first=True)['products']
+    assert products
+    for product in products:
+        assert 'creation_timestamp' not in product['listing_fields']
+        assert product['listing_fields'].get('updated_timestamp') == (product['updated_timestamp'] or None)
+
+
+def test_category_watermark_is_listing_update_time(make_spider):
+    spider = make_spider(settings={'LISTING_FIRST_ENABLED': True})
+    request = Request(CATEGORY_URL, meta={'category_url': CATEGORY_URL})
+    response = HtmlResponse(CATEGORY_URL, body=b'', request=request)
+    listing_data = {
+        'pagination': {'total': 2, 'pageSize': 25},
+        'products': [get_listing_product('a' * 24, UPDATED_AT), get_listing_product('b' * 24, UPDATED_AT - 60)],
+    }
+
+    items = [result for result in spider.parse_listing_data(response, listing_data) if not isinstance(result, Request)]
+    assert [ItemAdapter(item)['updated_timestamp'] for item in items] == [UPDATED_AT, UPDATED_AT - 60]
+    assert spider.current_category_stats == {CATEGORY_URL: UPDATED_AT}
@@ -0,0 +1,27 @@
+from bikroy.spiders.extensions.metrics import MetricsExtension
+from bikroy.spiders.helpers.metrics import registry, timed
+
+
+@timed('test_step')
+def parse_step(value):
+    return value
+
+
+def get_step_count() -> int:
+    histogram = registry.histograms.get(('bikroy_parser_step_seconds', (('step', 'test_step'),)))
+    return histogram.count if histogram is not None else 0
+
+
+def test_steps_are_timed_only_while_extension_runs(make_crawler):
+    count = get_step_count()
+    assert parse_step(1) == 1
+    assert get_step_count() == count
+
+    extension = MetricsExtension.from_crawler(make_crawler(METRICS_ENABLED=True, METRICS_PORT=0))
+    extension.spider_opened(spider=None)
+    assert parse_step(2) == 2
+    assert get_step_count() == count + 1
+
+    extension.spider_closed(spider=None)
+    parse_step(3)
+    assert get_step_count() == count + 1
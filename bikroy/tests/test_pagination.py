@@ -0,0 +1,46 @@
+from scrapy import Request
+from twisted.internet.error import TimeoutError
+from twisted.python.failure import Failure
+
+from bikroy.spiders.helpers.pagination import CategoryProgress
+
+CATEGORY_URL = 'https://bikroy.com/en/ads/dhaka/mobile-phones'
+
+
+def fail_page(spider, page: int) -> list:
+    request = Request(f'{CATEGORY_URL}?page={page}', callback=spider.parse, errback=spider.listing_failed,
+                      meta={'category_url': CATEGORY_URL, 'category_page': page})
+    failure = Failure(TimeoutError())
+    failure.request = request
+    return request.errback(failure)
+
+
+def test_failed_page_finishes_category(make_spider):
+    spider = make_spider()
+    progress = spider.category_progress[CATEGORY_URL] = CategoryProgress(3, scheduled_until=3)
+    progress.mark_parsed(1)
+    progress.mark_parsed(3)
+
+    assert fail_page(spider, 2) == []
+    assert progress.finished
+    assert spider.crawler.stats.get_value('pagination/categories_finished') == 1
+    assert spider.crawler.stats.get_value('pagination/failed_pages') == 1
+    # по неполному обходу снятые объявления не ищутся
+    assert CATEGORY_URL in spider.partial_categories
+
+
+def test_failed_first_page_finishes_category(make_spider):
+    spider = make_spider()
+    fail_page(spider, 1)
+    assert spider.category_progress[CATEGORY_URL].finished
+
+
+def test_cancelled_page_is_not_a_failure(make_spider):
+    spider = make_spider()
+    progress = spider.category_progress[CATEGORY_URL] = CategoryProgress(3, scheduled_until=3)
+    progress.stop(1)
+    progress.mark_parsed(1)
+
+    fail_page(spider, 2)
+    assert spider.crawler.stats.get_value('pagination/failed_pages') is None
+    assert CATEGORY_URL not in spider.partial_categories
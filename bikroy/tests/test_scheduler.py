@@ -0,0 +1,77 @@
+from scrapy import Request
+
+from bikroy.spiders.constants.bikroy_com import LISTING_PRIORITY, NAVIGATION_PRIORITY, PRODUCT_PRIORITY
+from bikroy.spiders.extensions.scheduler import SpillScheduler
+
+CATEGORIES_URL = 'https://bikroy.com/en/ads'
+LISTING_URL = 'https://bikroy.com/en/ads/dhaka/mobile-phones?page={}'
+PRODUCT_URL = 'https://bikroy.com/en/ad/iphone-11-for-sale-dhaka'
+
+
+def open_scheduler(spider) -> SpillScheduler:
+    scheduler = SpillScheduler.from_crawler(spider.crawler)
+    scheduler.open(spider)
+    return scheduler
+
+
+def enqueue_listing_pages(scheduler, spider, *pages):
+    for page in pages:
+        scheduler.enqueue_request(Request(LISTING_URL.format(page), callback=spider.parse, priority=LISTING_PRIORITY))
+
+
+def drain(scheduler) -> list:
+    urls = []
+    while (request := scheduler.next_request()) is not None:
+        urls.append(request.url)
+    return urls
+
+
+def test_low_priority_requests_spill_to_disk(make_spider):
+    spider = make_spider(settings={'SCHEDULER_MEMORY_LIMIT': 1})
+    scheduler = open_scheduler(spider)
+    enqueue_listing_pages(scheduler, spider, 1, 2, 3)
+    scheduler.enqueue_request(Request(PRODUCT_URL, callback=spider.parse_product, priority=PRODUCT_PRIORITY))
+    scheduler.enqueue_request(Request(CATEGORIES_URL, callback=spider.parse_categories, priority=NAVIGATION_PRIORITY))
+
+    stats = spider.crawler.stats
+    assert stats.get_value('scheduler/enqueued/disk') == 3
+    assert stats.get_value('scheduler/enqueued/memory') == 2
+    # продукт остаётся в памяти при любом лимите, дальше очередь по приоритету (внутри приоритета - LIFO)
+    assert drain(scheduler) == [PRODUCT_URL, LISTING_URL.format(1), LISTING_URL.format(3), LISTING_URL.format(2),
+                                CATEGORIES_URL]
+    scheduler.close('finished')
+
+
+def test_disk_queue_goes_first_with_higher_priority(make_spider):
+    spider = make_spider(settings={'SCHEDULER_MEMORY_LIMIT': 1})
+    scheduler = open_scheduler(spider)
+    scheduler.enqueue_request(Request(CATEGORIES_URL, callback=spider.parse_categories, priority=NAVIGATION_PRIORITY))
+    enqueue_listing_pages(scheduler, spider, 1)
+    assert spider.crawler.stats.get_value('scheduler/enqueued/disk') == 1
+    assert drain(scheduler) == [LISTING_URL.format(1), CATEGORIES_URL]
+    scheduler.close('finished')
+
+
+def test_memory_queue_is_saved_to_jobdir(make_spider, tmp_path):
+    settings = {'SCHEDULER_MEMORY_LIMIT': 10, 'JOBDIR': str(tmp_path / 'job')}
+    spider = make_spider(settings=settings)
+    scheduler = open_scheduler(spider)
+    enqueue_listing_pages(scheduler, spider, 1, 2)
+    scheduler.close('shutdown')
+
+    scheduler = open_scheduler(make_spider(settings=settings))
+    assert drain(scheduler) == [LISTING_URL.format(1), LISTING_URL.format(2)]
+    scheduler.close('finished')
+
+
+def test_unserializable_request_is_not_lost_on_flush(make_spider, tmp_path):
+    spider = make_spider(settings={'SCHEDULER_MEMORY_LIMIT': 10, 'JOBDIR': str(tmp_path / 'job')})
+    scheduler = open_scheduler(spider)
+    # колбэк не метод паука: такой запрос не сохранить на диск
+    scheduler.enqueue_request(Request(PRODUCT_URL, callback=lambda response: None, priority=PRODUCT_PRIORITY))
+    enqueue_listing_pages(scheduler, spider, 1)
+
+    scheduler.flush_memory_queue()
+    assert len(scheduler.mqs) == 2
+    assert drain(scheduler) == [PRODUCT_URL, LISTING_URL.format(1)]
+    scheduler.close('finished')
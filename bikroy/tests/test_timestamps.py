@@ -0,0 +1,65 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from bikroy.spiders.helpers.timestamps import TimestampParser, get_timestamp_resolution
+
+
+@pytest.mark.parametrize('value, age', [
+    ('5 mins', 5 * 60),
+    ('an hour ago', 60 * 60),
+    ('2 days', 2 * 24 * 60 * 60),
+    ('3 months', 3 * 30 * 24 * 60 * 60),
+    ('Yesterday', 24 * 60 * 60),
+    ('just now', 0),
+])
+def test_relative_dates_use_fast_path(value, age):
+    parser = TimestampParser()
+    now = int(time.time())
+    assert now - age <= parser.to_timestamp(value) <= int(time.time()) - age
+    assert parser.stats['fallback'] == 0
+
+
+def test_iso_dates_use_fast_path():
+    parser = TimestampParser()
+    expected = int(datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc).timestamp())
+    assert parser.to_timestamp('2023-11-14T22:13:20Z') == expected
+    assert parser.to_timestamp('2023-11-14T22:13:20.000+00:00') == expected
+    assert parser.stats['fallback'] == 0
+
+
+def test_relative_dates_are_cached_as_offsets(monkeypatch):
+    parser = TimestampParser()
+    now = 1_700_000_000.0
+    monkeypatch.setattr(time, 'time', lambda: now)
+    assert parser.to_timestamp('5 mins') == int(now) - 5 * 60
+
+    later = now + 3600
+    monkeypatch.setattr(time, 'time', lambda: later)
+    # из кеша возвращается не прошлый момент, а смещение от текущего времени
+    assert parser.to_timestamp('5 mins') == int(later) - 5 * 60
+    assert parser.stats == {'cache_hit': 1, 'cache_miss': 1, 'fallback': 0, 'failed': 0}
+
+
+def test_cache_evicts_least_recently_used():
+    parser = TimestampParser(cache_size=2)
+    parser.to_timestamp('1 min')
+    parser.to_timestamp('2 mins')
+    parser.to_timestamp('1 min')
+    parser.to_timestamp('3 mins')
+    assert list(parser._cache) == ['1 min', '3 mins']
+
+
+def test_empty_values_are_not_parsed():
+    parser = TimestampParser()
+    assert parser.to_timestamp('') is None and parser.to_timestamp(None) is None
+    assert parser.stats['cache_miss'] == 0
+
+
+def test_resolution_grows_with_age():
+    now = 10 ** 9
+    assert get_timestamp_resolution(now - 30, now) == 1
+    assert get_timestamp_resolution(now - 90, now) == 60
+    assert get_timestamp_resolution(now - 5 * 60 * 60, now) == 60 * 60
+    assert get_timestamp_resolution(now - 3 * 24 * 60 * 60, now) == 24 * 60 * 60